@@ -0,0 +1,295 @@
+"""
+Latency, peak memory and bytes read of every controller, run offline against the upstream stubs.
+
+Each controller is benchmarked in its own process so its peak RSS is not inflated by the others. A controller is
+first called for --cold distinct reaches with empty caches, then --warm times for a single reach. Streaming
+responses are consumed in full, and responses the controllers report as errors (see common.failed) are counted.
+What a controller reads but does not build itself (the per-file tables of the Qout files, the forecast archive) is
+prepared before it is timed, see PREPARE. The export runs as an administrator.
+
+    python -m benchmarks.bench_controllers
+    python -m benchmarks.bench_controllers --only get_time_series forecastpercent
+    python -m benchmarks.bench_controllers --update-baseline
+    python -m benchmarks.bench_controllers --compare    # exits 1 when a controller regressed
+
+Bytes read are the bytes the process read from files and sockets (rchar of /proc/self/io, Linux only); upstream
+bytes are the response bytes served by the stubs.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+from .common import admin_user, failed, make_request, print_table, setup_django, summarize
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+# Relative increase over the baseline reported as a regression
+LATENCY_TOLERANCE = 0.25
+RESOURCE_TOLERANCE = 0.10
+
+ROOT = '/apps/hydroviewer-central-america/'
+AJAX = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+
+def _ecmwf(comid):
+    return {'comid': comid, 'tot_drain_area': 1000}
+
+
+def _spt(comid):
+    return {'watershed_name': 'central_america', 'subbasin_name': 'geoglows', 'reach_id': comid, 'startdate': ''}
+
+
+def _local(comid):
+    return {'watershed': 'central_america', 'subbasin': 'geoglows', 'comid': comid}
+
+
+def _watershed(model):
+    return lambda comid: {'model': model, 'watershed': 'central_america', 'subbasin': 'geoglows'}
+
+
+# name: (controller, url, params for a comid, extra request headers)
+CASES = {
+    'home': ('home', '', lambda comid: {}, {}),
+    'ecmwf': ('ecmwf', 'ecmwf-rapid/', lambda comid: {}, {}),
+    'lis': ('lis', 'lis-rapid/', lambda comid: {}, {}),
+    'hiwat': ('hiwat', 'hiwat-rapid/', lambda comid: {}, {}),
+    'get_warning_points': ('get_warning_points', 'get-warning-points/',
+                           lambda comid: {'model': 'ECMWF-RAPID', 'watershed': 'central_america',
+                                          'subbasin': 'geoglows'}, {}),
+    'get_available_dates': ('get_available_dates', 'get-available-dates/', _local, {}),
+    'get_forecast_cycles': ('get_forecast_cycles', 'get-forecast-cycles/', _local, {}),
+    'get_forecast_archive': ('get_forecast_archive', 'get-forecast-archive/', lambda comid: {'comid': comid}, {}),
+    'get_model_comparison': ('get_model_comparison', 'compare/', _local, {}),
+    'get_time_series': ('get_time_series', 'get-time-series/', _ecmwf, {}),
+    'get_historic_data': ('get_historic_data', 'get-historic-data/', _ecmwf, {}),
+    'get_flow_duration_curve': ('get_flow_duration_curve', 'get-flow-duration-curve/', _ecmwf, {}),
+    'forecastpercent': ('forecastpercent', 'forecastpercent/', lambda comid: {'comid': comid}, AJAX),
+    'get_historic_data_csv': ('get_historic_data_csv', 'get-historic-data-csv/', _spt, {}),
+    'get_forecast_data_csv': ('get_forecast_data_csv', 'get-forecast-data-csv/', _spt, {}),
+    'lis_get_time_series': ('lis_get_time_series', 'lis-rapid/get-time-series/', _local, {}),
+    'hiwat_get_time_series': ('hiwat_get_time_series', 'hiwat-rapid/get-time-series/', _local, {}),
+    'get_lis_data_csv': ('get_lis_data_csv', 'lis-rapid/get-forecast-data-csv/', _spt, {}),
+    'get_hiwat_data_csv': ('get_hiwat_data_csv', 'hiwat-rapid/get-forecast-data-csv/', _spt, {}),
+    'get_anomalies': ('get_anomalies', 'lis-rapid/get-anomalies/',
+                      lambda comid: dict(_watershed('LIS-RAPID')(comid), comid=comid), {}),
+    'get_peak_flows': ('get_peak_flows', 'lis-rapid/get-peak-flows/', _watershed('LIS-RAPID'), {}),
+    'get_drainage_lines': ('get_drainage_lines', 'lis-rapid/get-lis-shp/',
+                           lambda comid: dict(_watershed('LIS-RAPID')(comid), zoom=7), {}),
+    'get_events': ('get_events', 'events/', lambda comid: dict(_watershed('ECMWF-RAPID')(comid), last_id=0), {}),
+    'export_watershed': ('export_start', 'export/start/',
+                         lambda comid: {'model': 'LIS-RAPID', 'format': 'netcdf', 'watershed': 'central_america',
+                                        'subbasin': 'geoglows'}, {}),
+    'get_metrics': ('get_metrics', 'metrics/', lambda comid: {}, {}),
+}
+# Controllers that are not benchmarked: get_return_periods is not reachable from the UI, setDefault writes the app
+# settings and the export status/download controllers are exercised by export_watershed.
+
+
+def read_bytes():
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return 0
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+def consume(response):
+    """
+    Reads a response in full, like the browser would, and returns (size in bytes, body). The body of a streaming
+    response is not kept.
+    """
+    if getattr(response, 'streaming', False):
+        size = sum(len(chunk) for chunk in response.streaming_content)
+        response.close()
+        return size, b''
+    return len(response.content), response.content
+
+
+def call(view, case, comid):
+    _, url, params, headers = case
+    request = make_request(ROOT + url, params(comid))
+    request.META.update(headers)
+    start = time.perf_counter()
+    response = view(request)
+    size, body = consume(response)
+    elapsed = time.perf_counter() - start
+    # Checked once the clock is stopped, parsing a large body is not part of the latency
+    return elapsed, size, failed(response.status_code, response.get('Content-Type', ''), body)
+
+
+def build_tables(env, comids):
+    """
+    Builds the return period, climatology and peak flow tables of the LIS and HIWAT Qout files.
+    """
+    from tethysapp.hydroviewer_central_america import climatology, local_return_periods, peak_flows, qout
+
+    from .offline import SUBBASIN, WATERSHED
+
+    for model in ('LIS-RAPID', 'HIWAT-RAPID'):
+        path = qout.qout_path(model, WATERSHED, SUBBASIN)
+        for tables in (local_return_periods.tables, climatology.tables, peak_flows.tables):
+            tables.build(path)
+
+
+def archive_forecasts(env, comids):
+    """
+    Archives the current forecast of the reaches, as get_time_series does.
+    """
+    from tethysapp.hydroviewer_central_america import controllers
+
+    for comid in comids:
+        controllers.forecast_stats_frame(comid)
+
+
+# Done before a controller is timed, with the reaches it is called for
+PREPARE = {
+    'get_anomalies': build_tables,
+    'get_peak_flows': build_tables,
+    'get_forecast_archive': archive_forecasts,
+}
+
+
+def wait_for_export(response, timeout=600):
+    from tethysapp.hydroviewer_central_america import exports
+
+    job_id = json.loads(response.content.decode('utf-8'))['job_id']
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = exports.job_status(job_id)
+        if status['state'] in ('done', 'failed'):
+            return status
+        time.sleep(0.01)
+    raise RuntimeError('Export {0} did not finish'.format(job_id))
+
+
+def run_case(name, options, results):
+    """
+    Benchmarks one controller; runs in a fresh process.
+    """
+    setup_django()
+    from tethysapp.hydroviewer_central_america import cache, controllers
+
+    from .offline import offline_app
+
+    case = CASES[name]
+    view = getattr(controllers, case[0])
+    with offline_app(n_reaches=options['reaches'], n_steps=options['steps'], root=options['data']) as env:
+        if name in PREPARE:
+            PREPARE[name](env, env.comids[:options['cold']])
+        rss_before = peak_rss_mb()
+        bytes_before = read_bytes()
+
+        cold, warm, sizes, errors = [], [], [], 0
+        for comid in env.comids[:options['cold']]:
+            cache.clear()
+            if name == 'export_watershed':
+                start = time.perf_counter()
+                _, url, params, headers = case
+                status = wait_for_export(view(make_request(ROOT + url, params(comid), user=admin_user())))
+                cold.append(time.perf_counter() - start)
+                errors += status['state'] == 'failed'
+                continue
+            elapsed, size, error = call(view, case, comid)
+            cold.append(elapsed)
+            sizes.append(size)
+            errors += error
+
+        if name != 'export_watershed':
+            for _ in range(options['warm']):
+                elapsed, size, error = call(view, case, env.comids[0])
+                warm.append(elapsed)
+                errors += error
+
+        cold_summary, warm_summary = summarize(cold), summarize(warm)
+        results.put({
+            'controller': name,
+            'errors': errors,
+            'cold_p50_ms': cold_summary['p50_ms'],
+            'cold_p95_ms': cold_summary['p95_ms'],
+            'warm_p50_ms': warm_summary['p50_ms'] if warm else None,
+            'warm_p95_ms': warm_summary['p95_ms'] if warm else None,
+            'response_kb': sum(sizes) / len(sizes) / 1e3 if sizes else None,
+            'peak_rss_mb': peak_rss_mb(),
+            'rss_growth_mb': peak_rss_mb() - rss_before,
+            'read_mb': (read_bytes() - bytes_before) / 1e6,
+            'upstream_mb': env.upstream_bytes() / 1e6,
+        })
+
+
+def compare(rows, baseline):
+    """
+    Returns a list of (controller, metric, baseline, current) for every metric that regressed.
+    """
+    regressions = []
+    for row in rows:
+        base = baseline.get(row['controller'])
+        if not base:
+            continue
+        for metric in ('cold_p50_ms', 'warm_p50_ms', 'peak_rss_mb', 'read_mb'):
+            tolerance = LATENCY_TOLERANCE if metric.endswith('_ms') else RESOURCE_TOLERANCE
+            if base.get(metric) and row.get(metric) is not None and row[metric] > base[metric] * (1 + tolerance):
+                regressions.append((row['controller'], metric, base[metric], row[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--only', nargs='+', choices=sorted(CASES), help='controllers to benchmark')
+    parser.add_argument('--cold', type=int, default=5, help='calls with empty caches, one reach each')
+    parser.add_argument('--warm', type=int, default=50, help='repeated calls for the same reach')
+    parser.add_argument('--reaches', type=int, default=5000, help='reaches in the synthetic Qout files')
+    parser.add_argument('--steps', type=int, default=240, help='time steps in the synthetic Qout files')
+    parser.add_argument('--data', help='directory to keep the synthetic data in between runs')
+    parser.add_argument('--update-baseline', action='store_true', help='write the results to baseline.json')
+    parser.add_argument('--compare', action='store_true', help='compare against baseline.json')
+    args = parser.parse_args()
+
+    options = {'cold': args.cold, 'warm': args.warm, 'reaches': args.reaches, 'steps': args.steps,
+               'data': args.data}
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+
+    rows = []
+    for name in args.only or sorted(CASES):
+        process = context.Process(target=run_case, args=(name, options, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print('{0}: failed with exit code {1}'.format(name, process.exitcode))
+            continue
+        rows.append(results.get())
+
+    print_table(rows, ['controller', 'errors', 'cold_p50_ms', 'cold_p95_ms', 'warm_p50_ms', 'warm_p95_ms',
+                       'response_kb', 'peak_rss_mb', 'rss_growth_mb', 'read_mb', 'upstream_mb'])
+
+    if args.update_baseline:
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+        baseline['controllers'].update({row['controller']: row for row in rows})
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('Updated {0}'.format(BASELINE_PATH))
+
+    if args.compare:
+        with open(BASELINE_PATH) as f:
+            regressions = compare(rows, json.load(f)['controllers'])
+        for controller, metric, base, current in regressions:
+            print('REGRESSION {0} {1}: {2:.2f} -> {3:.2f}'.format(controller, metric, base, current))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Page render latency of the home, ecmwf, lis and hiwat views.
+
+Each page is rendered once right after the cached page context is invalidated (cold: settings, index.json and the
+GeoServer feature types are read again) and then repeatedly with a warm cache.
+
+    python -m benchmarks.bench_page_context --iterations 200
+"""
+import argparse
+
+from .common import make_request, print_table, setup_django, summarize, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100, help='warm renders per page')
+    args = parser.parse_args()
+
+    setup_django()
+    from tethysapp.hydroviewer_central_america import controllers, page_context
+
+    pages = [
+        ('home', controllers.home_standard, '/apps/hydroviewer-central-america/'),
+        ('ecmwf', controllers.ecmwf, '/apps/hydroviewer-central-america/ecmwf-rapid/'),
+        ('lis', controllers.lis, '/apps/hydroviewer-central-america/lis-rapid/'),
+        ('hiwat', controllers.hiwat, '/apps/hydroviewer-central-america/hiwat-rapid/'),
+    ]
+
+    rows = []
+    for name, view, path in pages:
+        page_context.bump_settings_version()
+        try:
+            _, cold = timed(view, make_request(path))
+        except Exception as e:
+            print('{0}: {1}'.format(name, e))
+            continue
+
+        warm = [timed(view, make_request(path))[1] for _ in range(args.iterations)]
+        row = summarize(warm)
+        row.update({'page': name, 'cold_ms': 1000 * cold})
+        rows.append(row)
+
+    print_table(rows, ['page', 'cold_ms', 'n', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'])
+
+
+if __name__ == '__main__':
+    main()
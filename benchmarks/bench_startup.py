@@ -0,0 +1,96 @@
+"""
+Import time of controllers.py and boot time of a worker, each measured in fresh processes.
+
+A boot is: configure Django, import the app controllers and render the home page. It is measured with lazy imports
+(the default) and with warmup.preload() run before the first request, and the heavy modules still missing from
+sys.modules after the boot are listed.
+
+    python -m benchmarks.bench_startup --runs 10
+    python -m benchmarks.bench_startup --importtime    # also list the slowest imports of a boot (Python 3.7+)
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from .common import percentile, print_table
+
+# Runs in the child process; prints one json line with the timings in milliseconds
+CHILD = r'''
+import json, sys, time
+start = time.perf_counter()
+from benchmarks.common import make_request, setup_django
+setup_django()
+django_ready = time.perf_counter()
+from tethysapp.hydroviewer_central_america import controllers
+imported = time.perf_counter()
+preload = 0.0
+if {preload}:
+    from tethysapp.hydroviewer_central_america.warmup import preload as run_preload
+    run_preload()
+    preload = time.perf_counter() - imported
+    imported = time.perf_counter()
+controllers.home_standard(make_request('/apps/hydroviewer-central-america/'))
+served = time.perf_counter()
+from tethysapp.hydroviewer_central_america.warmup import HEAVY_MODULES
+print(json.dumps({{
+    'django_ms': 1000 * (django_ready - start),
+    'import_ms': 1000 * (imported - django_ready - preload),
+    'preload_ms': 1000 * preload,
+    'first_request_ms': 1000 * (served - imported),
+    'boot_ms': 1000 * (served - start),
+    'not_loaded': [m for m in HEAVY_MODULES if m not in sys.modules],
+}}))
+'''
+
+
+def run_child(preload, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + \
+              ['-c', CHILD.format(preload=preload)]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr, top):
+    """
+    Parses -X importtime output and returns the top (cumulative ms, module) of the top-level packages.
+    """
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        totals[package] = max(totals.get(package, 0), int(cumulative) / 1000.0)
+    return sorted(((ms, name) for name, ms in totals.items()), reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per variant')
+    parser.add_argument('--importtime', action='store_true', help='list the slowest imports')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    rows = []
+    for variant, preload in (('lazy', False), ('preload', True)):
+        runs = [run_child(preload)[0] for _ in range(args.runs)]
+        row = {'variant': variant, 'not_loaded': ' '.join(runs[-1]['not_loaded']) or '-'}
+        for metric in ('django_ms', 'import_ms', 'preload_ms', 'first_request_ms', 'boot_ms'):
+            row[metric] = percentile([r[metric] for r in runs], 50)
+        rows.append(row)
+
+    print_table(rows, ['variant', 'django_ms', 'import_ms', 'preload_ms', 'first_request_ms', 'boot_ms',
+                       'not_loaded'])
+
+    if args.importtime:
+        _, stderr = run_child(False, importtime=True)
+        print()
+        print_table([{'package': name, 'cumulative_ms': ms} for ms, name in slowest_imports(stderr, args.top)],
+                    ['package', 'cumulative_ms'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Shared helpers for the benchmark scripts.
+
+The benchmarks run against the installed app, so they must be started from an activated Tethys environment:
+
+    . /usr/lib/tethys/bin/activate
+    python -m benchmarks.<name> --help
+"""
+import json
+import os
+import time
+
+
+def setup_django():
+    """
+    Configure Django from the Tethys portal settings so the app controllers can be imported and called.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tethys_portal.settings')
+    import django
+    django.setup()
+
+
+def make_request(path, params=None, user=None):
+    """
+    Build a GET request with a session and a user attached, ready to be passed to a controller.
+    """
+    from django.contrib.auth.models import AnonymousUser
+    from django.contrib.sessions.backends.cache import SessionStore
+    from django.test import RequestFactory
+
+    request = RequestFactory().get(path, params or {})
+    request.user = user or AnonymousUser()
+    request.session = SessionStore()
+    return request
+
+
+def admin_user():
+    """
+    An unsaved superuser, for the controllers only administrators may call.
+    """
+    from django.contrib.auth.models import User
+
+    return User(username='benchmark', is_active=True, is_staff=True, is_superuser=True)
+
+
+def failed(status, content_type, body):
+    """
+    Whether a response is an error: an HTTP error status, or a JSON body with a non-empty error key, which is how
+    the controllers report most failures.
+    """
+    if status >= 400:
+        return True
+    if 'json' not in content_type:
+        return False
+    try:
+        payload = json.loads(body.decode('utf-8'))
+    except ValueError:
+        return True
+    return isinstance(payload, dict) and bool(payload.get('error'))
+
+
+def percentile(samples, q):
+    """
+    Nearest-rank percentile of a list of samples, q in [0, 100].
+    """
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    rank = max(int(round(q / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def timed(func, *args, **kwargs):
+    """
+    Returns (result, elapsed seconds) of a single call.
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def summarize(samples):
+    """
+    Latency summary in milliseconds.
+    """
+    return {
+        'n': len(samples),
+        'mean_ms': 1000 * sum(samples) / len(samples) if samples else float('nan'),
+        'p50_ms': 1000 * percentile(samples, 50),
+        'p95_ms': 1000 * percentile(samples, 95),
+        'p99_ms': 1000 * percentile(samples, 99),
+        'max_ms': 1000 * max(samples) if samples else float('nan'),
+    }
+
+
+def print_table(rows, columns):
+    """
+    Print a list of dicts as a fixed-width table.
+    """
+    widths = [max([len(col)] + [len(_fmt(row.get(col))) for row in rows]) for col in columns]
+    print('  '.join(col.ljust(width) for col, width in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(_fmt(row.get(col)).ljust(width) for col, width in zip(columns, widths)))
+
+
+def _fmt(value):
+    if isinstance(value, float):
+        return '{0:.2f}'.format(value)
+    return '' if value is None else str(value)
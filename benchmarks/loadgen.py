@@ -0,0 +1,250 @@
+"""
+Session-replay load generator for the map click workflow.
+
+A session replays what a user of the ECMWF page does: open the ecmwf page, select a watershed (get_warning_points),
+then click a number of reaches. Every click fires get_time_series, get_historic_data, get_flow_duration_curve and
+forecastpercent at once, like the browser does. Reaches are drawn from a Zipf-like popularity distribution, so some
+clicks hit cached reaches and most do not.
+
+The load is applied in steps of increasing concurrency (number of simultaneous sessions). For each step the
+throughput, the p50/p95/p99 latency and the errors (an error status or a JSON error body) per endpoint are
+reported, and the saturation point is the first step where adding sessions no longer adds throughput or the p95
+latency of a click more than doubles.
+
+By default the controllers are called in-process with the upstreams stubbed (see benchmarks.offline):
+
+    python -m benchmarks.loadgen --concurrency 1 2 4 8 16 32 --duration 30 --upstream-latency 200
+
+With --url the sessions are sent to a running portal instead; configure it to use the stubs started by
+`python -m benchmarks.stubs serve` to keep the upstreams out of the measurement:
+
+    python -m benchmarks.loadgen --url http://localhost:8000/apps/hydroviewer-central-america/ --cookie sessionid=...
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from .common import failed, make_request, percentile, print_table, setup_django
+
+WATERSHED = {'model': 'ECMWF-RAPID', 'watershed': 'central_america', 'subbasin': 'geoglows'}
+# endpoint: (controller, url)
+ENDPOINTS = {
+    'ecmwf': ('ecmwf', 'ecmwf-rapid/'),
+    'get_warning_points': ('get_warning_points', 'ecmwf-rapid/get-warning-points/'),
+    'get_time_series': ('get_time_series', 'ecmwf-rapid/get-time-series/'),
+    'get_historic_data': ('get_historic_data', 'ecmwf-rapid/get-historic-data/'),
+    'get_flow_duration_curve': ('get_flow_duration_curve', 'ecmwf-rapid/get-flow-duration-curve/'),
+    'forecastpercent': ('forecastpercent', 'ecmwf-rapid/forecastpercent/'),
+}
+CLICK_ENDPOINTS = ('get_time_series', 'get_historic_data', 'get_flow_duration_curve', 'forecastpercent')
+AJAX = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+# A step is saturated when it adds less than this relative throughput over the previous step...
+MIN_THROUGHPUT_GAIN = 0.10
+# ...or its click p95 exceeds this multiple of the click p95 of the first step
+MAX_P95_GROWTH = 2.0
+
+
+class InProcessTarget(object):
+    """
+    Calls the controllers directly with Django requests.
+    """
+
+    def __init__(self):
+        from tethysapp.hydroviewer_central_america import controllers
+        self.views = {name: getattr(controllers, controller) for name, (controller, _) in ENDPOINTS.items()}
+
+    def get(self, endpoint, params, ajax=False):
+        """
+        (status, content type, body) of a request.
+        """
+        request = make_request('/apps/hydroviewer-central-america/' + ENDPOINTS[endpoint][1], params)
+        if ajax:
+            request.META.update(AJAX)
+        response = self.views[endpoint](request)
+        if getattr(response, 'streaming', False):
+            body = b''.join(response.streaming_content)
+        else:
+            body = response.content
+        return response.status_code, response.get('Content-Type', ''), body
+
+
+class HttpTarget(object):
+    """
+    Sends the requests to a running portal.
+    """
+
+    def __init__(self, url, cookie=None):
+        self.url = url.rstrip('/') + '/'
+        self.cookie = cookie
+
+    def get(self, endpoint, params, ajax=False):
+        request = Request(self.url + ENDPOINTS[endpoint][1] + ('?' + urlencode(params) if params else ''))
+        if ajax:
+            request.add_header('X-Requested-With', 'XMLHttpRequest')
+        if self.cookie:
+            request.add_header('Cookie', self.cookie)
+        try:
+            with urlopen(request, timeout=120) as res:
+                return res.status, res.headers.get('Content-Type', ''), res.read()
+        except HTTPError as e:
+            return e.code, e.headers.get('Content-Type', ''), e.read()
+
+
+class Recorder(object):
+    """
+    Collects (endpoint, seconds, ok) samples from all sessions.
+    """
+
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, seconds, ok):
+        with self._lock:
+            self.samples.append((endpoint, seconds, ok))
+
+
+def timed_get(target, recorder, endpoint, params, ajax=False):
+    start = time.perf_counter()
+    try:
+        ok = not failed(*target.get(endpoint, params, ajax))
+    except Exception:
+        ok = False
+    recorder.add(endpoint, time.perf_counter() - start, ok)
+
+
+def choose_reach(rng, comids, skew):
+    """
+    Skewed choice of a reach: skew 0 picks uniformly, larger values favour the first reaches of the list.
+    """
+    rank = int(len(comids) * rng.random() ** (1.0 + skew * 4))
+    return comids[min(rank, len(comids) - 1)]
+
+
+def run_session(target, recorder, rng, comids, options, fanout):
+    timed_get(target, recorder, 'ecmwf', {})
+    timed_get(target, recorder, 'get_warning_points', WATERSHED)
+    for _ in range(options['clicks']):
+        time.sleep(rng.uniform(0, 2 * options['think']))
+        comid = choose_reach(rng, comids, options['skew'])
+        params = {'comid': comid, 'tot_drain_area': 1000}
+        start = time.perf_counter()
+        futures = [fanout.submit(timed_get, target, recorder, endpoint, params, endpoint == 'forecastpercent')
+                   for endpoint in CLICK_ENDPOINTS]
+        for future in futures:
+            future.result()
+        recorder.add('click', time.perf_counter() - start, True)
+
+
+def run_step(target, comids, concurrency, options, seed):
+    """
+    Runs concurrency sessions back to back for options['duration'] seconds and returns the recorder and the
+    elapsed time.
+    """
+    recorder = Recorder()
+    deadline = time.time() + options['duration']
+
+    def user(index):
+        rng = random.Random(seed * 1000 + index)
+        with ThreadPoolExecutor(max_workers=len(CLICK_ENDPOINTS)) as fanout:
+            while time.time() < deadline:
+                run_session(target, recorder, rng, comids, options, fanout)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - start
+
+
+def summarize_step(concurrency, recorder, elapsed):
+    rows = []
+    requests = [s for s in recorder.samples if s[0] != 'click']
+    for endpoint in list(ENDPOINTS) + ['click']:
+        samples = [s for s in recorder.samples if s[0] == endpoint]
+        if not samples:
+            continue
+        latencies = [s[1] for s in samples]
+        rows.append({
+            'sessions': concurrency,
+            'endpoint': endpoint,
+            'n': len(samples),
+            'errors': sum(1 for s in samples if not s[2]),
+            'rps': len(samples) / elapsed,
+            'p50_ms': 1000 * percentile(latencies, 50),
+            'p95_ms': 1000 * percentile(latencies, 95),
+            'p99_ms': 1000 * percentile(latencies, 99),
+        })
+    total = {'sessions': concurrency, 'endpoint': 'all requests', 'n': len(requests),
+             'errors': sum(1 for s in requests if not s[2]), 'rps': len(requests) / elapsed}
+    return rows, total
+
+
+def saturation_point(totals, clicks):
+    """
+    Returns the first concurrency step that is saturated, or None.
+    """
+    first_p95 = clicks[0]['p95_ms'] if clicks else None
+    for i in range(1, len(totals)):
+        gain = totals[i]['rps'] / totals[i - 1]['rps'] - 1 if totals[i - 1]['rps'] else 0
+        if gain < MIN_THROUGHPUT_GAIN or (first_p95 and clicks[i]['p95_ms'] > MAX_P95_GROWTH * first_p95):
+            return totals[i]['sessions']
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help='simultaneous sessions of each step')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per step')
+    parser.add_argument('--clicks', type=int, default=5, help='reach clicks per session')
+    parser.add_argument('--think', type=float, default=1.0, help='mean seconds between two clicks')
+    parser.add_argument('--skew', type=float, default=0.5, help='0 for uniform reach popularity, 1 for very skewed')
+    parser.add_argument('--reaches', type=int, default=5000, help='reaches the sessions click on')
+    parser.add_argument('--upstream-latency', type=float, default=0, help='stub latency per request in milliseconds')
+    parser.add_argument('--url', help='base url of a running app instead of calling the controllers in-process')
+    parser.add_argument('--cookie', help='Cookie header sent with --url, e.g. a logged in session id')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    options = {'duration': args.duration, 'clicks': args.clicks, 'think': args.think, 'skew': args.skew}
+
+    def run(target, comids):
+        rows, totals, clicks = [], [], []
+        for step, concurrency in enumerate(args.concurrency):
+            recorder, elapsed = run_step(target, comids, concurrency, options, args.seed + step)
+            step_rows, total = summarize_step(concurrency, recorder, elapsed)
+            rows.extend(step_rows)
+            totals.append(total)
+            clicks.append(next((r for r in step_rows if r['endpoint'] == 'click'), {'p95_ms': 0}))
+            print('{0} sessions: {1:.1f} requests/s, click p95 {2:.0f} ms'.format(concurrency, total['rps'],
+                                                                                   clicks[-1]['p95_ms']))
+        print()
+        print_table(rows + totals, ['sessions', 'endpoint', 'n', 'errors', 'rps', 'p50_ms', 'p95_ms', 'p99_ms'])
+        saturated = saturation_point(totals, clicks)
+        print()
+        if saturated is None:
+            print('Not saturated up to {0} sessions.'.format(args.concurrency[-1]))
+        else:
+            print('Saturated at {0} sessions.'.format(saturated))
+
+    if args.url:
+        from .stubs import FIRST_COMID
+        run(HttpTarget(args.url, args.cookie), list(range(FIRST_COMID, FIRST_COMID + args.reaches)))
+        return
+
+    setup_django()
+    from .offline import offline_app
+    with offline_app(n_reaches=args.reaches, latency=args.upstream_latency / 1000.0) as env:
+        run(InProcessTarget(), env.comids)
+
+
+if __name__ == '__main__':
+    main()
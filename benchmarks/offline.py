@@ -0,0 +1,111 @@
+"""
+Runs the app against local stubs and synthetic data instead of the live services.
+
+offline_app() starts the upstream stubs, writes synthetic LIS and HIWAT Qout files, and points the app settings,
+GeoServer engine, workspace and GEOGLOWS endpoint at them for the duration of the block:
+
+    setup_django()
+    with offline_app() as env:
+        controllers.ecmwf_get_time_series(make_request('/', {'comid': env.comids[0], 'tot_drain_area': 100}))
+"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from . import stubs, synthetic
+
+WATERSHED = 'central_america'
+SUBBASIN = 'geoglows'
+
+
+class OfflineEnvironment(object):
+    def __init__(self, root, stub_servers, settings, comids):
+        self.root = root
+        self.stubs = stub_servers
+        self.settings = settings
+        self.comids = comids
+
+    def upstream_bytes(self):
+        return sum(stub.bytes_sent for stub in self.stubs.values())
+
+    def upstream_requests(self):
+        return sum(stub.requests for stub in self.stubs.values())
+
+
+class _GeoserverEngine(object):
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.username = 'admin'
+        self.password = 'geoserver'
+
+
+class _Workspace(object):
+    def __init__(self, path):
+        self.path = path
+
+
+@contextmanager
+def offline_app(n_reaches=1000, n_steps=240, latency=0.0, root=None):
+    """
+    Context manager yielding an OfflineEnvironment. Files are written to a temporary directory unless root is
+    given; a given root is reused as is when it already holds the Qout files.
+    """
+    from tethysapp.hydroviewer_central_america import page_context, upstream
+    from tethysapp.hydroviewer_central_america.app import Hydroviewer
+
+    cleanup = root is None
+    root = root or tempfile.mkdtemp(prefix='hydroviewer-bench-')
+    for model in ('lis', 'hiwat'):
+        model_root = os.path.join(root, model)
+        if not os.path.isdir(model_root):
+            synthetic.write_model_tree(model_root, [(WATERSHED, SUBBASIN)], n_reaches=n_reaches, n_steps=n_steps,
+                                       seed=0 if model == 'lis' else 100)
+    workspace = os.path.join(root, 'workspace')
+    if not os.path.isdir(workspace):
+        os.makedirs(workspace)
+
+    stub_servers = stubs.start_all(latency=latency)
+    settings = {
+        'api_source': stub_servers['spt'].root_url,
+        'spt_token': 'offline',
+        'workspace': 'hydroviewer',
+        'layer_name': 'central_america-geoglows-drainage_line',
+        'keywords': 'central_america',
+        'zoom_info': '-87,13,5',
+        'extra_feature': '',
+        'default_model_type': 'ECMWF-RAPID',
+        'default_watershed_name': '',
+        'show_dropdown': False,
+        'region': '',
+        'lis_path': os.path.join(root, 'lis'),
+        'hiwat_path': os.path.join(root, 'hiwat'),
+    }
+    engine = _GeoserverEngine(stub_servers['geoserver'].url + 'rest/')
+
+    patched = {
+        'get_custom_setting': classmethod(lambda cls, name: settings.get(name)),
+        'get_spatial_dataset_service': classmethod(lambda cls, name, as_engine=False: engine),
+        'get_app_workspace': classmethod(lambda cls: _Workspace(workspace)),
+    }
+    original = {name: Hydroviewer.__dict__.get(name) for name in patched}
+    original_endpoint = upstream.GEOGLOWS_ENDPOINT
+    for name, value in patched.items():
+        setattr(Hydroviewer, name, value)
+    upstream.GEOGLOWS_ENDPOINT = stub_servers['geoglows'].url
+    page_context.bump_settings_version()
+
+    comids = list(range(synthetic.FIRST_RIVID, synthetic.FIRST_RIVID + n_reaches))
+    try:
+        yield OfflineEnvironment(root, stub_servers, settings, comids)
+    finally:
+        upstream.GEOGLOWS_ENDPOINT = original_endpoint
+        for name, value in original.items():
+            if value is None:
+                delattr(Hydroviewer, name)
+            else:
+                setattr(Hydroviewer, name, value)
+        for stub in stub_servers.values():
+            stub.stop()
+        if cleanup:
+            shutil.rmtree(root, ignore_errors=True)
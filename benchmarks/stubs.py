@@ -0,0 +1,380 @@
+"""
+Local stub servers for the GEOGLOWS, SPT and GeoServer APIs.
+
+A stub replays responses recorded from the real service (benchmarks/fixtures/<upstream>/) and falls back to
+synthetic responses in the same format for requests that were never recorded, so the controllers can be
+benchmarked without network access. A request is matched to a recording by its method and query string, or failing
+that by its method alone, so a single recorded ForecastStats response serves every reach.
+
+Record fixtures from the live services (needs network access):
+
+    python -m benchmarks.stubs record geoglows https://geoglows.ecmwf.int/api/ --port 8701
+
+then point a client at http://127.0.0.1:8701/ and every response is saved. Serve stubs for manual testing:
+
+    python -m benchmarks.stubs serve --latency 50
+"""
+import argparse
+import datetime as dt
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl, urlsplit
+from urllib.request import Request, urlopen
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+# Path prefixes the app uses for each upstream; the stubs serve everything below them.
+PREFIXES = {
+    'geoglows': '/api/',
+    'spt': '/apps/streamflow-prediction-tool/api/',
+    'geoserver': '/geoserver/',
+}
+N_ENSEMBLES = 52
+N_REACHES = 2000
+FIRST_COMID = 9000001
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubServer(object):
+    """
+    A stub for one upstream running in a background thread. url is the base url to configure in the app.
+    """
+
+    def __init__(self, upstream, port=0, latency=0.0, fixtures_dir=FIXTURES_DIR, record_target=None):
+        self.upstream = upstream
+        self.latency = latency
+        self.fixtures = Fixtures(os.path.join(fixtures_dir, upstream))
+        self.record_target = record_target
+        self.bytes_sent = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingServer(('127.0.0.1', port), _handler_for(self))
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}{1}'.format(self.server.server_address[1], PREFIXES[self.upstream])
+
+    @property
+    def root_url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='stub-' + self.upstream, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, path, query):
+        """
+        Returns (status, content_type, body) for a request.
+        """
+        method = path.rstrip('/').split('/')[-1]
+        key = _request_key(method, query)
+        if self.record_target:
+            return self._record(path, query, key)
+
+        recorded = self.fixtures.find(method, key)
+        if recorded is not None:
+            return recorded
+        generator = SYNTHETIC.get(self.upstream, {}).get(method)
+        if generator is None:
+            return 404, 'text/plain', 'No stub for {0}'.format(path).encode('utf-8')
+        content_type, body = generator(query)
+        return 200, content_type, body.encode('utf-8')
+
+    def _record(self, path, query, key):
+        relative = path[len(PREFIXES[self.upstream]):] if path.startswith(PREFIXES[self.upstream]) else path
+        url = self.record_target.rstrip('/') + '/' + relative.lstrip('/')
+        if query:
+            url += '?' + '&'.join('{0}={1}'.format(k, v) for k, v in query)
+        with urlopen(Request(url, headers={'User-Agent': 'hydroviewer-benchmarks'}), timeout=120) as res:
+            body = res.read()
+            content_type = res.headers.get('Content-Type', 'application/octet-stream')
+            status = res.status
+        self.fixtures.save(path.rstrip('/').split('/')[-1], key, status, content_type, body)
+        return status, content_type, body
+
+    def count(self, n_bytes):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += n_bytes
+
+
+def _handler_for(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            if stub.latency:
+                time.sleep(stub.latency)
+            try:
+                status, content_type, body = stub.respond(parts.path, parse_qsl(parts.query))
+            except Exception as e:
+                status, content_type, body = 502, 'text/plain', str(e).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            stub.count(len(body))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def _request_key(method, query):
+    return method + '?' + '&'.join('{0}={1}'.format(k, v) for k, v in sorted(query))
+
+
+class Fixtures(object):
+    """
+    Recorded responses of one upstream: an index.json of request key -> file, plus one file per response body.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'index.json')
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        self._lock = threading.Lock()
+
+    def find(self, method, key):
+        entry = self.index.get(key)
+        if entry is None:
+            entry = next((e for k, e in sorted(self.index.items()) if k.split('?')[0] == method), None)
+        if entry is None:
+            return None
+        with open(os.path.join(self.directory, entry['file']), 'rb') as f:
+            return entry['status'], entry['content_type'], f.read()
+
+    def save(self, method, key, status, content_type, body):
+        with self._lock:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            name = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.body'
+            with open(os.path.join(self.directory, name), 'wb') as f:
+                f.write(body)
+            self.index[key] = {'file': name, 'status': status, 'content_type': content_type}
+            with open(self.index_path, 'w') as f:
+                json.dump(self.index, f, indent=1, sort_keys=True)
+
+
+# --------------------------------------
+# Synthetic responses
+# --------------------------------------
+def _rng(query, salt=''):
+    params = dict(query)
+    return random.Random(str(params.get('reach_id') or params.get('watershed_name', '')) + salt)
+
+
+def _forecast_times():
+    start = dt.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    hours = list(range(0, 144, 3)) + list(range(144, 361, 6))
+    return [start + dt.timedelta(hours=h) for h in hours]
+
+
+def _historic_times():
+    start = dt.datetime(1979, 1, 1)
+    return [start + dt.timedelta(days=d) for d in range((dt.datetime(2020, 12, 31) - start).days + 1)]
+
+
+def _hydrograph(rng, n, base):
+    flows = []
+    q = base
+    for _ in range(n):
+        q = max(0.1, q * rng.lognormvariate(0, 0.08) + (base * rng.uniform(2, 6) if rng.random() < 0.01 else 0)
+                - 0.05 * (q - base))
+        flows.append(q)
+    return flows
+
+
+def _csv(header, times, columns, time_format='%Y-%m-%d %H:%M:%S'):
+    lines = [','.join(header)]
+    for i, t in enumerate(times):
+        lines.append(','.join([t.strftime(time_format)] + ['' if c[i] is None else '{0:.3f}'.format(c[i])
+                                                           for c in columns]))
+    return '\n'.join(lines) + '\n'
+
+
+def _ensembles(query):
+    rng = _rng(query)
+    times = _forecast_times()
+    base = rng.lognormvariate(3, 1)
+    members = [_hydrograph(random.Random(rng.random()), len(times), base) for _ in range(N_ENSEMBLES)]
+    # The high resolution member only covers the first 10 days
+    members[-1] = [v if i < 64 else None for i, v in enumerate(members[-1])]
+    return times, members
+
+
+def geoglows_forecast_stats(query):
+    times, members = _ensembles(query)
+    rows = list(zip(*[[v if v is not None else float('nan') for v in m] for m in members[:-1]]))
+    stats = [
+        [max(r) for r in rows],
+        [sorted(r)[int(0.75 * len(r))] for r in rows],
+        [sum(r) / len(r) for r in rows],
+        [sorted(r)[int(0.25 * len(r))] for r in rows],
+        [min(r) for r in rows],
+        members[-1],
+    ]
+    header = ['datetime', 'flow_max_m^3/s', 'flow_75%_m^3/s', 'flow_avg_m^3/s', 'flow_25%_m^3/s', 'flow_min_m^3/s',
+              'high_res_m^3/s']
+    return 'text/csv', _csv(header, times, stats)
+
+
+def geoglows_forecast_ensembles(query):
+    times, members = _ensembles(query)
+    header = ['datetime'] + ['ensemble_{0:02d}_m^3/s'.format(i + 1) for i in range(N_ENSEMBLES)]
+    return 'text/csv', _csv(header, times, members)
+
+
+def geoglows_historic_simulation(query):
+    rng = _rng(query, 'historic')
+    times = _historic_times()
+    return 'text/csv', _csv(['datetime', 'streamflow_m^3/s'], times,
+                            [_hydrograph(rng, len(times), rng.lognormvariate(3, 1))])
+
+
+def geoglows_return_periods(query):
+    rng = _rng(query, 'historic')
+    base = rng.lognormvariate(3, 1)
+    values = [base * f for f in (12, 10, 8.5, 7.2, 5.5, 4.2, 2.5)]
+    header = 'rivid,max_simulated,return_period_100,return_period_50,return_period_25,return_period_10,' \
+             'return_period_5,return_period_2'
+    return 'text/csv', header + '\n' + ','.join([dict(query).get('reach_id', '0')] +
+                                                ['{0:.3f}'.format(v) for v in values]) + '\n'
+
+
+def geoglows_available_dates(query):
+    start = dt.datetime.utcnow().date()
+    dates = [(start - dt.timedelta(days=d)).strftime('%Y%m%d.00') for d in range(15)]
+    return 'application/json', json.dumps({'available_dates': dates})
+
+
+def spt_warning_points(query):
+    rng = _rng(query, dict(query).get('return_period', ''))
+    features = [{'type': 'Feature',
+                 'geometry': {'type': 'Point', 'coordinates': [rng.uniform(-92, -77), rng.uniform(7, 18)]},
+                 'properties': {'size': rng.randint(1, 5), 'comid': FIRST_COMID + rng.randint(0, N_REACHES - 1)}}
+                for _ in range(rng.randint(50, 400))]
+    return 'application/json', json.dumps({'type': 'FeatureCollection', 'features': features})
+
+
+def spt_available_dates(query):
+    start = dt.datetime.utcnow().date()
+    dates = []
+    for d in range(30):
+        day = (start - dt.timedelta(days=d)).strftime('%Y%m%d')
+        dates.extend([day + '.0', day + '.1200'])
+    return 'application/json', json.dumps(sorted(dates))
+
+
+def spt_forecast(query):
+    times, members = _ensembles(query)
+    rows = list(zip(*members[:-1]))
+    means = [sum(r) / len(r) for r in rows]
+    stds = [(sum((v - m) ** 2 for v in r) / len(r)) ** 0.5 for r, m in zip(rows, means)]
+    columns = [members[-1], [max(r) for r in rows], means, [min(r) for r in rows],
+               [max(m - s, 0) for m, s in zip(means, stds)], [m + s for m, s in zip(means, stds)]]
+    header = ['datetime', 'high_res', 'max', 'mean', 'min', 'std_dev_range_lower', 'std_dev_range_upper']
+    return 'text/csv', _csv(header, times, columns)
+
+
+def spt_historic_data(query):
+    rng = _rng(query, 'historic')
+    times = _historic_times()
+    return 'text/csv', _csv(['datetime', 'streamflow (m3/s)'], times,
+                            [_hydrograph(rng, len(times), rng.lognormvariate(3, 1))])
+
+
+def spt_return_periods(query):
+    rng = _rng(query, 'historic')
+    base = rng.lognormvariate(3, 1)
+    return 'application/json', json.dumps({'max': base * 12, 'twenty': base * 7.8, 'ten': base * 7.2,
+                                           'two': base * 4.2})
+
+
+def geoserver_feature_types(query):
+    names = ['central_america-geoglows-drainage_line', 'central_america-geoglows-catchment']
+    return 'application/json', json.dumps({'featureTypes': {'featureType': [{'name': n} for n in names]}})
+
+
+def geoserver_wfs(query):
+    features = [{'type': 'Feature', 'properties': {'COMID': FIRST_COMID + i}} for i in range(N_REACHES)]
+    return 'application/json', json.dumps({'type': 'FeatureCollection', 'features': features})
+
+
+SYNTHETIC = {
+    'geoglows': {
+        'ForecastStats': geoglows_forecast_stats,
+        'ForecastEnsembles': geoglows_forecast_ensembles,
+        'HistoricSimulation': geoglows_historic_simulation,
+        'ReturnPeriods': geoglows_return_periods,
+        'AvailableDates': geoglows_available_dates,
+    },
+    'spt': {
+        'GetWarningPoints': spt_warning_points,
+        'GetAvailableDates': spt_available_dates,
+        'GetForecast': spt_forecast,
+        'GetHistoricData': spt_historic_data,
+        'GetReturnPeriods': spt_return_periods,
+    },
+    'geoserver': {
+        'featuretypes.json': geoserver_feature_types,
+        'wfs': geoserver_wfs,
+        'ows': geoserver_wfs,
+    },
+}
+
+
+def start_all(latency=0.0, fixtures_dir=FIXTURES_DIR):
+    """
+    Starts one stub per upstream and returns them by upstream name.
+    """
+    return {name: StubServer(name, latency=latency, fixtures_dir=fixtures_dir).start() for name in PREFIXES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest='command')
+    serve = sub.add_parser('serve', help='serve stubs for every upstream')
+    serve.add_argument('--latency', type=float, default=0.0, help='added latency per request in milliseconds')
+    record = sub.add_parser('record', help='proxy one upstream and record its responses')
+    record.add_argument('upstream', choices=sorted(PREFIXES))
+    record.add_argument('target', help='base url of the live service')
+    record.add_argument('--port', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        stubs = {args.upstream: StubServer(args.upstream, port=args.port, record_target=args.target).start()}
+    else:
+        stubs = start_all(latency=args.latency / 1000.0)
+    for name, stub in sorted(stubs.items()):
+        print('{0}: {1}'.format(name, stub.url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for stub in stubs.values():
+            stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Synthetic RAPID Qout NetCDF files for benchmarking the LIS and HIWAT controllers.
+
+    python -m benchmarks.synthetic --reaches 5000 --steps 2920 --out /tmp/lis/central_america-geoglows/Qout_lis.nc
+
+Flows are deterministic for a given seed: a lognormal base flow per reach, a seasonal cycle, noise and a few
+flood pulses, written in time chunks so files larger than memory can be generated. A polyline shapefile of the
+reaches, a short random walk from each reach's coordinates, is written next to every Qout file for the drainage-line
+controllers.
+"""
+import argparse
+import os
+import struct
+
+import netCDF4 as nc
+import numpy as np
+
+FIRST_RIVID = 9000001
+# Steps generated and written per chunk
+CHUNK_STEPS = 256
+# Points and length in degrees of each synthetic drainage line
+LINE_POINTS = 20
+LINE_STEP = 0.005
+
+
+def write_qout(path, n_reaches=1000, n_steps=240, step_seconds=3 * 3600, start=1577836800, seed=0):
+    """
+    Writes a Qout file with dims (time, rivid) and returns its rivids.
+    """
+    rng = np.random.RandomState(seed)
+    rivids = np.arange(FIRST_RIVID, FIRST_RIVID + n_reaches, dtype='i4')
+    base = rng.lognormal(mean=3.0, sigma=1.2, size=n_reaches).astype('f4')
+    phase = rng.uniform(0, 2 * np.pi, size=n_reaches).astype('f4')
+    n_pulses = max(n_steps // 200, 1)
+    pulse_steps = rng.randint(0, n_steps, size=(n_pulses, n_reaches))
+    pulse_sizes = rng.uniform(2, 10, size=(n_pulses, n_reaches)).astype('f4')
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with nc.Dataset(path, 'w', format='NETCDF4') as ds:
+        ds.createDimension('time', n_steps)
+        ds.createDimension('rivid', n_reaches)
+        ds.createVariable('rivid', 'i4', ('rivid',))[:] = rivids
+        time_var = ds.createVariable('time', 'i4', ('time',))
+        time_var.units = 'seconds since 1970-01-01 00:00:00'
+        time_var[:] = start + step_seconds * np.arange(n_steps)
+        ds.createVariable('lat', 'f8', ('rivid',))[:] = rng.uniform(7, 18, size=n_reaches)
+        ds.createVariable('lon', 'f8', ('rivid',))[:] = rng.uniform(-92, -77, size=n_reaches)
+        qout = ds.createVariable('Qout', 'f4', ('time', 'rivid'), zlib=True, chunksizes=(min(CHUNK_STEPS, n_steps),
+                                                                                      min(n_reaches, 4096)))
+        qout.units = 'm3 s-1'
+
+        seconds_per_year = 365.25 * 86400
+        for lo in range(0, n_steps, CHUNK_STEPS):
+            hi = min(lo + CHUNK_STEPS, n_steps)
+            steps = np.arange(lo, hi)[:, None]
+            season = 1 + 0.6 * np.sin(2 * np.pi * steps * step_seconds / seconds_per_year + phase)
+            flows = base * season * rng.lognormal(0, 0.1, size=(hi - lo, n_reaches))
+            for p in range(n_pulses):
+                distance = steps - pulse_steps[p]
+                flows += base * pulse_sizes[p] * np.exp(-0.5 * (distance / 8.0) ** 2) * (distance >= -24)
+            qout[lo:hi, :] = flows.astype('f4')
+
+    return rivids
+
+
+def write_drainage_lines(base, qout_path, seed=0):
+    """
+    Writes <base>.shp and <base>.dbf, a polyline per reach of a Qout file starting at the reach's lon/lat, with
+    the rivid as COMID.
+    """
+    with nc.Dataset(qout_path, 'r') as ds:
+        rivids = np.asarray(ds.variables['rivid'][:])
+        starts = np.column_stack([ds.variables['lon'][:], ds.variables['lat'][:]])
+    rng = np.random.RandomState(seed)
+    steps = rng.normal(0, LINE_STEP, size=(len(rivids), LINE_POINTS - 1, 2))
+    lines = starts[:, None, :] + np.concatenate([np.zeros((len(rivids), 1, 2)), steps.cumsum(axis=1)], axis=1)
+
+    records = []
+    for number, points in enumerate(lines, 1):
+        content = struct.pack('<i4d2i', 3, *points.min(axis=0), *points.max(axis=0), 1, len(points)) + \
+            struct.pack('<i', 0) + np.asarray(points, dtype='<f8').tobytes()
+        records.append(struct.pack('>2i', number, len(content) // 2) + content)
+    records = b''.join(records)
+    bounds = list(lines.reshape(-1, 2).min(axis=0)) + list(lines.reshape(-1, 2).max(axis=0))
+    with open(base + '.shp', 'wb') as f:
+        f.write(struct.pack('>7i', 9994, 0, 0, 0, 0, 0, (100 + len(records)) // 2))
+        f.write(struct.pack('<2i8d', 1000, 3, *bounds, 0, 0, 0, 0))
+        f.write(records)
+
+    fields = struct.pack('<11sc4xBB14x', b'COMID', b'N', 10, 0)
+    with open(base + '.dbf', 'wb') as f:
+        f.write(struct.pack('<B3BIHH20x', 3, 120, 1, 1, len(rivids), 32 + len(fields) + 1, 11) + fields + b'\r')
+        f.write(b''.join(b' ' + str(int(rivid)).rjust(10).encode('ascii') for rivid in rivids))
+    with open(base + '.prj', 'w') as f:
+        f.write('GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],'
+                'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]')
+
+
+def write_model_tree(root, watersheds, **kwargs):
+    """
+    Creates <root>/<watershed>-<subbasin>/Qout_<watershed>_<subbasin>.nc and drainage_line.shp for every
+    (watershed, subbasin), the layout the app expects under lis_path and hiwat_path.
+    """
+    seed = kwargs.pop('seed', 0)
+    for i, (watershed, subbasin) in enumerate(watersheds):
+        folder = os.path.join(root, '-'.join([watershed, subbasin]))
+        qout_path = os.path.join(folder, 'Qout_{0}_{1}.nc'.format(watershed, subbasin))
+        write_qout(qout_path, seed=seed + i, **kwargs)
+        write_drainage_lines(os.path.join(folder, 'drainage_line'), qout_path, seed=seed + i)
+    return root
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--out', required=True, help='path of the Qout file to write')
+    parser.add_argument('--reaches', type=int, default=1000)
+    parser.add_argument('--steps', type=int, default=240)
+    parser.add_argument('--step-seconds', type=int, default=3 * 3600)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    write_qout(args.out, n_reaches=args.reaches, n_steps=args.steps, step_seconds=args.step_seconds, seed=args.seed)
+    print('{0}: {1:.1f} MB'.format(args.out, os.path.getsize(args.out) / 1e6))
+
+
+if __name__ == '__main__':
+    main()
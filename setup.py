@@ -24,7 +24,7 @@ setup(
     author_email='',
     url='',
     license='MIT',
-    packages=find_namespace_packages(),
+    packages=find_namespace_packages(exclude=['benchmarks', 'benchmarks.*']),
     package_data={'': resource_files},
     include_package_data=True,
     zip_safe=False,
@@ -58,6 +58,94 @@ class Hydroviewer(TethysAppBase):
                 name='get-available-dates',
                 url='ecmwf-rapid/get-available-dates',
                 controller='{0}.controllers.get_available_dates'.format(base_name)),
+            UrlMap(
+                name='get-forecast-cycles',
+                url='get-forecast-cycles',
+                controller='{0}.controllers.get_forecast_cycles'.format(base_name)),
+            UrlMap(
+                name='get-forecast-cycles',
+                url='ecmwf-rapid/get-forecast-cycles',
+                controller='{0}.controllers.get_forecast_cycles'.format(base_name)),
+            UrlMap(
+                name='get-forecast-archive',
+                url='get-forecast-archive',
+                controller='{0}.controllers.get_forecast_archive'.format(base_name)),
+            UrlMap(
+                name='get-forecast-archive',
+                url='ecmwf-rapid/get-forecast-archive',
+                controller='{0}.controllers.get_forecast_archive'.format(base_name)),
+            UrlMap(
+                name='compare',
+                url='compare',
+                controller='{0}.controllers.get_model_comparison'.format(base_name)),
+            UrlMap(
+                name='get-anomalies',
+                url='lis-rapid/get-anomalies',
+                controller='{0}.controllers.get_anomalies'.format(base_name)),
+            UrlMap(
+                name='get-anomalies',
+                url='hiwat-rapid/get-anomalies',
+                controller='{0}.controllers.get_anomalies'.format(base_name)),
+            UrlMap(
+                name='get-peak-flows',
+                url='get-peak-flows',
+                controller='{0}.controllers.get_peak_flows'.format(base_name)),
+            UrlMap(
+                name='get-peak-flows',
+                url='lis-rapid/get-peak-flows',
+                controller='{0}.controllers.get_peak_flows'.format(base_name)),
+            UrlMap(
+                name='get-peak-flows',
+                url='hiwat-rapid/get-peak-flows',
+                controller='{0}.controllers.get_peak_flows'.format(base_name)),
+            UrlMap(
+                name='get-lis-shp',
+                url='get-lis-shp',
+                controller='{0}.controllers.get_drainage_lines'.format(base_name)),
+            UrlMap(
+                name='get-lis-shp',
+                url='lis-rapid/get-lis-shp',
+                controller='{0}.controllers.get_drainage_lines'.format(base_name)),
+            UrlMap(
+                name='get-hiwat-shp',
+                url='get-hiwat-shp',
+                controller='{0}.controllers.get_drainage_lines'.format(base_name)),
+            UrlMap(
+                name='get-hiwat-shp',
+                url='hiwat-rapid/get-hiwat-shp',
+                controller='{0}.controllers.get_drainage_lines'.format(base_name)),
+            UrlMap(
+                name='events',
+                url='events',
+                controller='{0}.controllers.get_events'.format(base_name)),
+            UrlMap(
+                name='events',
+                url='ecmwf-rapid/events',
+                controller='{0}.controllers.get_events'.format(base_name)),
+            UrlMap(
+                name='events',
+                url='lis-rapid/events',
+                controller='{0}.controllers.get_events'.format(base_name)),
+            UrlMap(
+                name='events',
+                url='hiwat-rapid/events',
+                controller='{0}.controllers.get_events'.format(base_name)),
+            UrlMap(
+                name='events-stream',
+                url='events-stream',
+                controller='{0}.controllers.get_event_stream'.format(base_name)),
+            UrlMap(
+                name='events-stream',
+                url='ecmwf-rapid/events-stream',
+                controller='{0}.controllers.get_event_stream'.format(base_name)),
+            UrlMap(
+                name='events-stream',
+                url='lis-rapid/events-stream',
+                controller='{0}.controllers.get_event_stream'.format(base_name)),
+            UrlMap(
+                name='events-stream',
+                url='hiwat-rapid/events-stream',
+                controller='{0}.controllers.get_event_stream'.format(base_name)),
             UrlMap(
                 name='get-time-series',
                 url='get-time-series',
@@ -154,6 +242,26 @@ class Hydroviewer(TethysAppBase):
                 name='forecastpercent',
                 url='forecastpercent',
                 controller='{0}.controllers.forecastpercent'.format(base_name)),
+            UrlMap(
+                name='export_start',
+                url='export/start',
+                controller='{0}.controllers.export_start'.format(base_name)),
+            UrlMap(
+                name='export_status',
+                url='export/status',
+                controller='{0}.controllers.export_status'.format(base_name)),
+            UrlMap(
+                name='export_download',
+                url='export/download',
+                controller='{0}.controllers.export_download'.format(base_name)),
+            UrlMap(
+                name='metrics',
+                url='metrics',
+                controller='{0}.controllers.get_metrics'.format(base_name)),
+            UrlMap(
+                name='profile',
+                url='admin/profile',
+                controller='{0}.controllers.get_profile'.format(base_name)),
         )
 
     def custom_settings(self):
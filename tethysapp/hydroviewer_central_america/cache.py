@@ -0,0 +1,219 @@
+"""
+Stale-while-revalidate cache for payloads built from upstream data.
+
+A fresh entry is returned as is. An expired entry is still returned immediately, together with its age, while a
+background worker rebuilds it; if the rebuild fails the old payload keeps being served. Only a cold miss waits on
+the upstream.
+
+An in-process miss is looked up in the store shared by the workers of the host (see shared_cache.py) before it is
+built, and every payload built or put is written to that store as well, so a payload is built once per host rather
+than once per worker. In-process hits touch the shared entry at most every TOUCH_SECONDS, so the store's least
+recently used eviction sees the entries every worker keeps using. Tests can swap the store with set_shared_store(),
+or turn it off with set_shared_store(None).
+
+Catalogues, return periods and reach products are also snapshotted to the workspace and taken from the snapshots
+after a restart while they are still valid (see snapshots.py); set_snapshots() swaps or turns them off likewise.
+What such a payload was built from (its validator) is recorded just before the build and kept with the entry, in
+process and in the shared store.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_ENTRIES = 1024
+REFRESH_WORKERS = 4
+TOUCH_SECONDS = 60
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+_refreshing = set()
+_executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS)
+# The shared store and the snapshots, created on first use; False once they could not be created or were turned off
+_shared = None
+_snapshots = None
+
+
+def get(key, build, ttl):
+    """
+    Returns (payload, stale_age) for key. stale_age is None when the payload is fresh, otherwise the number of
+    seconds since it was built. build() is called to create the payload and may raise; exceptions are only
+    propagated when there is no cached payload to fall back on.
+    """
+    touch = False
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+            touch = time.time() - entry['touched'] > TOUCH_SECONDS
+            if touch:
+                entry['touched'] = time.time()
+    if touch:
+        _shared_touch(key)
+
+    if entry is None:
+        found = _shared_get(key) or _snapshot_get(key)
+        if found is None:
+            recorded = _validator(key)
+            value = build()
+            put(key, value, validator=recorded)
+            return value, None
+        entry = {'value': found[0], 'stored': found[1]}
+        _put_local(key, *found)
+
+    age = time.time() - entry['stored']
+    if age <= ttl:
+        return entry['value'], None
+
+    # Another worker may have refreshed it already
+    found = _shared_get(key)
+    if found is not None and found[1] > entry['stored']:
+        _put_local(key, *found)
+        age = time.time() - found[1]
+        if age <= ttl:
+            return found[0], None
+        entry = {'value': found[0], 'stored': found[1]}
+
+    _refresh(key, build)
+    return entry['value'], age
+
+
+def put(key, value, stored=None, validator=None):
+    """
+    Stores a payload. validator is what it was built from (see snapshots.validator()), recorded before the build;
+    it is taken now when None.
+    """
+    stored = time.time() if stored is None else stored
+    validator = _validator(key) if validator is None else validator
+    _put_local(key, value, stored, validator)
+    store = shared_store()
+    if store:
+        store.put(key, value, stored, validator)
+
+
+def invalidate(key):
+    with _lock:
+        _entries.pop(key, None)
+    store = shared_store()
+    if store:
+        store.invalidate(key)
+
+
+def invalidate_local(key):
+    """
+    Drops the in-process copy of key only, so the next get() takes the copy another worker shared, if any.
+    """
+    with _lock:
+        _entries.pop(key, None)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+    store = shared_store()
+    if store:
+        store.clear()
+
+
+def shared_store():
+    """
+    The store shared with the other workers, or None when there is none.
+    """
+    global _shared
+    if _shared is None:
+        try:
+            from . import shared_cache
+            store = shared_cache.default_store()
+        except Exception as e:
+            print('The shared cache is not available: {0}'.format(e))
+            store = False
+        with _lock:
+            if _shared is None:
+                _shared = store
+    return _shared or None
+
+
+def set_shared_store(store):
+    global _shared
+    _shared = store if store is not None else False
+
+
+def snapshots():
+    """
+    The cache snapshots, or None when there are none.
+    """
+    global _snapshots
+    if _snapshots is None:
+        try:
+            from . import snapshots as snapshots_module
+            value = snapshots_module.default_snapshots()
+        except Exception as e:
+            print('The cache snapshots are not available: {0}'.format(e))
+            value = False
+        with _lock:
+            if _snapshots is None:
+                _snapshots = value
+    return _snapshots or None
+
+
+def set_snapshots(value):
+    global _snapshots
+    _snapshots = value if value is not None else False
+
+
+def entries(*prefixes):
+    """
+    (key, payload, stored time, validator) of the in-process entries whose key is a tuple starting with one of
+    prefixes.
+    """
+    with _lock:
+        return [(key, entry['value'], entry['stored'], entry['validator']) for key, entry in _entries.items()
+                if isinstance(key, tuple) and key and key[0] in prefixes]
+
+
+def _put_local(key, value, stored, validator=None):
+    with _lock:
+        _entries[key] = {'value': value, 'stored': stored, 'validator': validator, 'touched': time.time()}
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def _shared_get(key):
+    store = shared_store()
+    return store.get(key) if store else None
+
+
+def _shared_touch(key):
+    store = shared_store()
+    if store:
+        store.touch(key)
+
+
+def _snapshot_get(key):
+    found = snapshots()
+    return found.lookup(key) if found else None
+
+
+def _validator(key):
+    found = snapshots()
+    return found.validator(key) if found else None
+
+
+def _refresh(key, build):
+    with _lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def refresh():
+        try:
+            recorded = _validator(key)
+            put(key, build(), validator=recorded)
+        except Exception as e:
+            print('Refreshing {0} failed: {1}'.format(key, e))
+        finally:
+            with _lock:
+                _refreshing.discard(key)
+
+    _executor.submit(refresh)
@@ -0,0 +1,225 @@
+"""
+Flow climatology of the LIS and HIWAT reaches and the anomaly of their latest flows.
+
+The Qout file is streamed in blocks of at most BLOCK_VALUES flows and every block is folded into per-reach
+accumulators, so the (time, reach) matrix is never held in memory:
+
+- the count and sum of the flows, for the mean;
+- a log-spaced histogram of the flows (SKETCH_BINS bins per reach, about 12% wide) from which the percentiles and
+  the percentile rank of a flow are read;
+- the sum and count of the flows per calendar day (month and day, so 1 March is the same day in leap years), kept
+  only for the days the file covers.
+
+The table kept per file (see qout_tables.py) holds the mean, the PERCENTILES and the means of the calendar days
+covered, plus the flow of the last time step with the mean flow of its day and its percentile rank, so the anomalies
+of one reach or of the whole watershed are answered from the table alone.
+"""
+import numpy as np
+
+from . import qout
+from .qout_tables import FileTables, time_blocks
+
+PERCENTILES = (10, 25, 50, 75, 90)
+BLOCK_VALUES = 2 * 1024 * 1024
+# The histogram covers 10^LOG_MIN to 10^LOG_MAX m3/s; bin 0 holds the flows below, the last bin the flows above
+LOG_MIN = -3.0
+LOG_MAX = 6.0
+SKETCH_BINS = 182
+# Calendar days are numbered 0 to 365 as in a leap year, 29 February being day 59
+DAYS = 366
+_MONTH_STARTS = np.cumsum([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+
+
+class Accumulator(object):
+    """
+    Streaming per-reach statistics of (time, reach) blocks of flows. NaNs are ignored.
+    """
+
+    def __init__(self, n_reaches):
+        self.n_reaches = n_reaches
+        self.count = np.zeros(n_reaches, dtype='i8')
+        self.total = np.zeros(n_reaches)
+        self.sketch = np.zeros((n_reaches, SKETCH_BINS), dtype='i8')
+        # Row of every calendar day in day_total and day_count, -1 for the days not seen yet
+        self.day_rows = np.full(DAYS, -1)
+        self.day_total = np.zeros((0, n_reaches))
+        self.day_count = np.zeros((0, n_reaches), dtype='i4')
+
+    def add(self, times, flows):
+        """
+        Folds a block of flows in: times as datetime64 and a (time, reach) float array.
+        """
+        valid = ~np.isnan(flows)
+        zeroed = np.where(valid, flows, 0.0)
+        self.count += valid.sum(axis=0)
+        self.total += zeroed.sum(axis=0)
+
+        bins = sketch_bins(flows)
+        reaches = np.broadcast_to(np.arange(self.n_reaches), flows.shape)
+        flat = reaches[valid] * SKETCH_BINS + bins[valid]
+        self.sketch += np.bincount(flat, minlength=self.n_reaches * SKETCH_BINS).reshape(self.sketch.shape)
+
+        days = calendar_day(times)
+        starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        rows = self._rows(days[starts])
+        np.add.at(self.day_total, rows, np.add.reduceat(zeroed, starts, axis=0))
+        np.add.at(self.day_count, rows, np.add.reduceat(valid.astype('i4'), starts, axis=0))
+
+    def _rows(self, days):
+        new = np.unique(days[self.day_rows[days] < 0])
+        if len(new):
+            self.day_rows[new] = len(self.day_total) + np.arange(len(new))
+            self.day_total = np.concatenate([self.day_total, np.zeros((len(new), self.n_reaches))])
+            self.day_count = np.concatenate([self.day_count, np.zeros((len(new), self.n_reaches), dtype='i4')])
+        return self.day_rows[days]
+
+    def table(self, rivids, current_time, current):
+        days = np.flatnonzero(self.day_rows >= 0)
+        rows = self.day_rows[days]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.total / self.count
+            day_mean = self.day_total[rows] / self.day_count[rows]
+        normal = day_mean[np.searchsorted(days, calendar_day(np.array([current_time]))[0])]
+        return {
+            'rivid': rivids,
+            'mean': mean.astype('f4'),
+            'percentiles': np.array([sketch_percentile(self.sketch, p) for p in PERCENTILES], dtype='f4'),
+            'days': days.astype('i2'),
+            'day_mean': day_mean.astype('f4'),
+            'current_time': np.array(current_time, dtype='datetime64[s]').astype('i8'),
+            'current': current.astype('f4'),
+            'normal': normal.astype('f4'),
+            'rank': percentile_rank(self.sketch, current).astype('f4'),
+        }
+
+
+def calendar_day(times):
+    """
+    Calendar day, 0 to 365, of datetime64 times, from their month and day: a date after February falls on the same
+    day in leap and common years.
+    """
+    times = np.asarray(times)
+    months = times.astype('datetime64[M]')
+    month = (months - times.astype('datetime64[Y]')).astype(int)
+    return _MONTH_STARTS[month] + (times.astype('datetime64[D]') - months).astype(int)
+
+
+def calendar_label(day):
+    """
+    MM-DD of a calendar day.
+    """
+    return str(np.datetime64('2000-01-01') + int(day))[5:]
+
+
+def sketch_bins(flows):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        position = (np.log10(flows) - LOG_MIN) / (LOG_MAX - LOG_MIN) * (SKETCH_BINS - 2)
+    bins = np.floor(np.nan_to_num(position, nan=-1.0, neginf=-1.0, posinf=SKETCH_BINS)) + 1
+    return np.clip(bins, 0, SKETCH_BINS - 1).astype('i8')
+
+
+def _bin_edges():
+    inner = np.logspace(LOG_MIN, LOG_MAX, SKETCH_BINS - 1)
+    # Bin 0 spans 0 to 10^LOG_MIN and the last bin is closed at 10^LOG_MAX
+    return np.r_[0.0, inner, inner[-1]]
+
+
+def sketch_percentile(sketch, percentile):
+    """
+    The percentile of every reach of a (reach, bin) histogram, interpolated within its bin. NaN for empty rows.
+    """
+    cumulative = sketch.cumsum(axis=1)
+    total = cumulative[:, -1]
+    target = percentile / 100.0 * total
+    index = np.minimum((cumulative < target[:, np.newaxis]).sum(axis=1), SKETCH_BINS - 1)
+    rows = np.arange(len(sketch))
+    before = cumulative[rows, index] - sketch[rows, index]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = np.clip((target - before) / sketch[rows, index], 0.0, 1.0)
+    edges = _bin_edges()
+    values = edges[index] + fraction * (edges[index + 1] - edges[index])
+    return np.where(total > 0, values, np.nan)
+
+
+def percentile_rank(sketch, flows):
+    """
+    Percentage of the flows of every reach's histogram below the given flows. NaN for NaN flows and empty rows.
+    """
+    bins = sketch_bins(flows)
+    cumulative = sketch.cumsum(axis=1)
+    rows = np.arange(len(sketch))
+    below = cumulative[rows, bins] - sketch[rows, bins] / 2.0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rank = 100.0 * below / cumulative[:, -1]
+    return np.where(np.isnan(flows), np.nan, rank)
+
+
+def compute_table(path, block_values=BLOCK_VALUES):
+    """
+    The climatology table of a Qout file, computed in one pass over the file.
+    """
+    with qout.dataset(path) as res:
+        with qout.HDF5_LOCK:
+            rivids = np.asarray(res.variables['rivid'][:])
+            times = np.asarray(res.variables['time'][:]).astype('datetime64[s]')
+            blocks = time_blocks(res, block_values)
+        if not len(times):
+            return None
+        stats = Accumulator(len(rivids))
+        qout_var = res.variables['Qout']
+        for lo, hi in blocks:
+            with qout.HDF5_LOCK:
+                block = qout_var[lo:hi, :]
+            block = np.ma.filled(block.astype(float), np.nan)
+            stats.add(times[lo:hi], block)
+        current = block[-1]
+    return stats.table(rivids, times[-1], current)
+
+
+def anomalies(model, watershed, subbasin, comid=None):
+    """
+    The latest flows of a watershed's reaches against their climatology, for one reach when comid is given. None
+    while the climatology of the Qout file is being computed.
+    """
+    table = tables.get(qout.qout_path(model, watershed, subbasin))
+    if table is None:
+        return None
+
+    if comid is None:
+        positions = np.arange(len(table['rivid']))
+    else:
+        positions = qout.reach_positions(table['rivid'], [int(comid)])
+        if positions[0] < 0:
+            raise ValueError('Reach {0} not found in the {1} Qout file of {2}-{3}'.format(comid, model, watershed,
+                                                                                       subbasin))
+    current = table['current'][positions].astype(float)
+    normal = table['normal'][positions].astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = current / normal
+    payload = {
+        'time': str(np.datetime64(int(table['current_time']), 's'))[:16],
+        'comids': table['rivid'][positions].tolist(),
+        'flow': _json_values(current),
+        'normal': _json_values(normal),
+        'anomaly': _json_values(current - normal),
+        'ratio': _json_values(ratio),
+        'percentile_rank': _json_values(table['rank'][positions].astype(float)),
+    }
+    if comid is not None:
+        payload['mean'] = _json_values(table['mean'][positions].astype(float))[0]
+        payload['percentiles'] = {str(p): v for p, v in
+                                  zip(PERCENTILES, _json_values(table['percentiles'][:, positions[0]].astype(float)))}
+        payload['day_mean'] = dict(zip([calendar_label(day) for day in table['days']],
+                                       _json_values(table['day_mean'][:, positions[0]].astype(float))))
+    return payload
+
+
+def _json_values(values):
+    values = np.asarray(values, dtype=float)
+    rounded = np.round(values, 3).astype(object)
+    rounded[~np.isfinite(values)] = None
+    return rounded.tolist()
+
+
+# Layout 2: day means of the calendar days covered only
+tables = FileTables('climatology', compute_table, layout=2)
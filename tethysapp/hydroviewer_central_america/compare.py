@@ -0,0 +1,98 @@
+"""
+Side by side comparison of the ECMWF, LIS and HIWAT flows of one reach.
+
+The three sources are read concurrently, each through the payload cache, and resampled onto one regular time axis
+with np.interp so the browser gets a single compact payload. The ECMWF flows are cut from the forecast stats frame the
+charts cache for the newest announced cycle; the LIS and HIWAT series are keyed by the version of their Qout file.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import cache, events, http_cache, qout
+
+MODELS = ('ECMWF-RAPID', 'LIS-RAPID', 'HIWAT-RAPID')
+ECMWF_COLUMN = 'flow_avg_m^3/s'
+SOURCE_TTL = 30 * 60
+DEFAULT_STEP = 3 * 3600
+# The step is widened when the common axis would have more points than this
+MAX_POINTS = 5000
+
+_executor = ThreadPoolExecutor(max_workers=6)
+
+
+def read_source(model, comid, watershed=None, subbasin=None):
+    """
+    Returns (times in seconds since the epoch, flows) of one model for a reach, cached.
+    """
+    if model == 'ECMWF-RAPID':
+        from .controllers import forecast_stats_frame
+
+        stats = forecast_stats_frame(comid, events.announced_cycle())
+        return stats.index.values.astype('datetime64[s]').astype('i8'), stats[ECMWF_COLUMN].values.astype(float)
+
+    def build():
+        times, flows = qout.read_series(model, watershed, subbasin, comid)
+        return np.asarray(times, dtype='i8'), np.asarray(flows, dtype=float)
+
+    tag, _ = http_cache.file_validators(qout.qout_path(model, watershed, subbasin))
+    key = ('compare_source', model, watershed, subbasin, comid, tag)
+    value, _ = cache.get(key, build, SOURCE_TTL)
+    return value
+
+
+def align(sources, step=DEFAULT_STEP):
+    """
+    Resamples {model: (times, flows)} onto a regular axis covering all sources. Returns (axis, {model: flows}) with
+    NaN where a source has no data.
+    """
+    spans = [(t[0], t[-1]) for t, _ in sources.values() if len(t)]
+    if not spans:
+        return np.array([], dtype='i8'), {model: np.array([]) for model in sources}
+    start = min(s for s, _ in spans) // step * step
+    end = max(e for _, e in spans)
+    step = max(step, -(-(end - start) // MAX_POINTS))
+    axis = np.arange(start, end + 1, step, dtype='i8')
+
+    aligned = {}
+    for model, (times, flows) in sources.items():
+        valid = ~np.isnan(flows)
+        if valid.sum() < 2:
+            aligned[model] = np.full(len(axis), np.nan)
+            continue
+        aligned[model] = np.interp(axis, times[valid], flows[valid], left=np.nan, right=np.nan)
+    return axis, aligned
+
+
+def compare(comid, watershed=None, subbasin=None, models=MODELS, step=DEFAULT_STEP):
+    """
+    The comparison payload of a reach. LIS and HIWAT need the watershed and subbasin of their Qout file; models that
+    fail are reported under errors.
+    """
+    futures = {}
+    for model in models:
+        if model != 'ECMWF-RAPID' and not (watershed and subbasin):
+            continue
+        futures[model] = _executor.submit(read_source, model, comid, watershed, subbasin)
+
+    sources, errors = {}, {}
+    for model, future in futures.items():
+        try:
+            sources[model] = future.result()
+        except Exception as e:
+            errors[model] = str(e)
+
+    axis, aligned = align(sources, step)
+    return {
+        'comid': int(comid),
+        'step': int(axis[1] - axis[0]) if len(axis) > 1 else step,
+        'times': [str(t)[:16] for t in axis.astype('datetime64[s]')],
+        'series': {model: _json_values(flows) for model, flows in aligned.items()},
+        'errors': errors,
+    }
+
+
+def _json_values(flows):
+    values = np.round(flows, 3).astype(object)
+    values[np.isnan(flows)] = None
+    return values.tolist()
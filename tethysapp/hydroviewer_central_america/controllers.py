@@ -1,24 +1,32 @@
 import datetime as dt
 import json
-import os
 from csv import writer as csv_writer
 
-import netCDF4 as nc
-import numpy as np
-import plotly.graph_objs as go
-import requests
-from django.http import HttpResponse, JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
-from requests.auth import HTTPBasicAuth
 from tethys_sdk.gizmos import *
 from tethys_sdk.permissions import has_permission
-import geoglows
 
+from . import cache, events, forecast_cycles, http_cache, profiling, upstream
 from .app import Hydroviewer as app
 from .helpers import *
+from .metrics import instrumented, log_error, prometheus_text, span
+from .page_context import bump_settings_version, get_shared_context
 
 base_name = __package__.split('.')[-1]
 
+# Seconds before a cached payload is rebuilt in the background; stale payloads are served meanwhile.
+FORECAST_TTL = 30 * 60
+HISTORIC_TTL = 24 * 60 * 60
+WARNING_TTL = 30 * 60
+
+# Seconds a client waits before asking again for a table that is being computed.
+COMPUTING_RETRY_SECONDS = 10
+
+# Bytes read from the upstream per chunk when proxying csv downloads.
+CSV_CHUNK_SIZE = 64 * 1024
+
 
 def set_custom_setting(defaultModelName, defaultWSName):
     from tethys_apps.models import TethysApp
@@ -34,9 +42,10 @@ def set_custom_setting(defaultModelName, defaultWSName):
     return
 
 
+@instrumented
 def home(request):
     # Check if we have a default model. If we do, then redirect the user to the default model's page
-    default_model = app.get_custom_setting('default_model_type')
+    default_model = get_shared_context('home')['default_model']
     if default_model:
         model_func = switch_model(default_model)
         if model_func is not 'invalid':
@@ -48,6 +57,8 @@ def home(request):
 
 
 def home_standard(request):
+    shared = get_shared_context('home')
+
     model_input = SelectInput(display_text='',
                               name='model',
                               multiple=False,
@@ -56,50 +67,27 @@ def home_standard(request):
                               initial=['Select Model'],
                               original=True)
 
-    zoom_info = TextInput(display_text='',
-                          initial=json.dumps(app.get_custom_setting('zoom_info')),
-                          name='zoom_info',
-                          disabled=True)
-
-    region_index = json.load(open(os.path.join(os.path.dirname(__file__), 'public', 'geojson', 'index.json')))
-    regions = SelectInput(
-        display_text='Zoom to a Region:',
-        name='regions',
-        multiple=False,
-        original=True,
-        options=[(region_index[opt]['name'], opt) for opt in region_index]
-    )
-
-    # Retrieve a geoserver engine and geoserver credentials.
-    geoserver_engine = app.get_spatial_dataset_service(
-        name='main_geoserver', as_engine=True)
-
-    my_geoserver = geoserver_engine.endpoint.replace('rest', '')
-
-    geoserver_base_url = my_geoserver
-    geoserver_workspace = app.get_custom_setting('workspace')
-    region = app.get_custom_setting('region')
-    extra_feature = app.get_custom_setting('extra_feature')
-    layer_name = app.get_custom_setting('layer_name')
-
-    geoserver_endpoint = TextInput(display_text='',
-                                   initial=json.dumps(
-                                       [geoserver_base_url, geoserver_workspace, region, extra_feature, layer_name]),
-                                   name='geoserver_endpoint',
-                                   disabled=True)
-
     context = {
         "base_name": base_name,
         "model_input": model_input,
-        "zoom_info": zoom_info,
-        "regions": regions,
-        "geoserver_endpoint": geoserver_endpoint
+        "zoom_info": shared['zoom_info'],
+        "regions": shared['regions'],
+        "geoserver_endpoint": shared['geoserver_endpoint']
     }
 
-    return render(request, '{0}/home.html'.format(base_name), context)
+    with span('render'):
+        return render(request, '{0}/home.html'.format(base_name), context)
 
 
-def ecmwf(request):
+def model_page_context(request, model, watershed_onchange):
+    """
+    Combines the cached page context of a model with the gizmos that depend on the request (user permissions and
+    the selected model).
+    """
+    with span('page_context'):
+        shared = get_shared_context(model)
+    hiddenAttr = shared['hidden_attr']
+
     # Can Set Default permissions : Only allowed for admin users
     can_update_default = has_permission(request, 'update_default')
 
@@ -116,15 +104,7 @@ def ecmwf(request):
     else:
         defaultUpdateButton = False
 
-    # Check if we need to hide the WS options dropdown.
-    hiddenAttr = ""
-    if app.get_custom_setting('show_dropdown') and app.get_custom_setting(
-            'default_model_type') and app.get_custom_setting('default_watershed_name'):
-        hiddenAttr = "hidden"
-
-    default_model = app.get_custom_setting('default_model_type')
-    init_model_val = request.GET.get('model', False) or default_model or 'Select Model'
-    init_ws_val = app.get_custom_setting('default_watershed_name') or 'Select Watershed'
+    init_model_val = request.GET.get('model', False) or shared['default_model'] or 'Select Model'
 
     model_input = SelectInput(display_text='',
                               name='model',
@@ -135,344 +115,381 @@ def ecmwf(request):
                               classes=hiddenAttr,
                               original=True)
 
-    # uncomment for displaying watersheds in the SPT
-    # res = requests.get(app.get_custom_setting('api_source') + '/apps/streamflow-prediction-tool/api/GetWatersheds/',
-    #                    headers={'Authorization': 'Token ' + app.get_custom_setting('spt_token')})
-    #
-    # watershed_list_raw = json.loads(res.content)
-    #
-    # app.get_custom_setting('keywords').lower().replace(' ', '').split(',')
-    # watershed_list = [value for value in watershed_list_raw if
-    #                   any(val in value[0].lower().replace(' ', '') for
-    #                       val in app.get_custom_setting('keywords').lower().replace(' ', '').split(','))]
-
-    # Retrieve a geoserver engine and geoserver credentials.
-    geoserver_engine = app.get_spatial_dataset_service(
-        name='main_geoserver', as_engine=True)
-
-    geos_username = geoserver_engine.username
-    geos_password = geoserver_engine.password
-    my_geoserver = geoserver_engine.endpoint.replace('rest', '')
-
-    watershed_list = [['Select Watershed', '']]  # + watershed_list
-    res2 = requests.get(my_geoserver + 'rest/workspaces/' + app.get_custom_setting('workspace') + '/featuretypes.json',
-                        auth=HTTPBasicAuth(geos_username, geos_password), verify=False)
-
-    for i in range(len(json.loads(res2.content)['featureTypes']['featureType'])):
-        raw_feature = json.loads(res2.content)['featureTypes']['featureType'][i]['name']
-        if 'drainage_line' in raw_feature and any(
-                n in raw_feature for n in app.get_custom_setting('keywords').replace(' ', '').split(',')):
-            feat_name = raw_feature.split('-')[0].replace('_', ' ').title() + ' (' + \
-                        raw_feature.split('-')[1].replace('_', ' ').title() + ')'
-            if feat_name not in str(watershed_list):
-                watershed_list.append([feat_name, feat_name])
-
-    # Add the default WS if present and not already in the list
-    if default_model == 'ECMWF-RAPID' and init_ws_val and init_ws_val not in str(watershed_list):
-        watershed_list.append([init_ws_val, init_ws_val])
-
     watershed_select = SelectInput(display_text='',
                                    name='watershed',
-                                   options=watershed_list,
-                                   initial=[init_ws_val],
+                                   options=shared['watershed_list'],
+                                   initial=[shared['init_ws_val']],
                                    original=True,
                                    classes=hiddenAttr,
-                                   attributes={'onchange': "javascript:view_watershed();" + hiddenAttr}
+                                   attributes={'onchange': watershed_onchange}
                                    )
 
-    zoom_info = TextInput(display_text='',
-                          initial=json.dumps(app.get_custom_setting('zoom_info')),
-                          name='zoom_info',
-                          disabled=True)
-
-    # Retrieve a geoserver engine and geoserver credentials.
-    geoserver_engine = app.get_spatial_dataset_service(
-        name='main_geoserver', as_engine=True)
-
-    my_geoserver = geoserver_engine.endpoint.replace('rest', '')
-
-    geoserver_base_url = my_geoserver
-    geoserver_workspace = app.get_custom_setting('workspace')
-    region = ''
-    extra_feature = app.get_custom_setting('extra_feature')
-    layer_name = app.get_custom_setting('layer_name')
-
-    geoserver_endpoint = TextInput(display_text='',
-                                   initial=json.dumps(
-                                       [geoserver_base_url, geoserver_workspace, region, extra_feature, layer_name]),
-                                   name='geoserver_endpoint',
-                                   disabled=True)
-
-    region_index = json.load(open(os.path.join(os.path.dirname(__file__), 'public', 'geojson', 'index.json')))
-    regions = SelectInput(
-        display_text='Zoom to a Region:',
-        name='regions',
-        multiple=False,
-        original=True,
-        options=[(region_index[opt]['name'], opt) for opt in region_index]
-    )
-
-    context = {
+    return {
         "base_name": base_name,
         "model_input": model_input,
         "watershed_select": watershed_select,
-        "zoom_info": zoom_info,
-        "geoserver_endpoint": geoserver_endpoint,
-        "defaultUpdateButton": defaultUpdateButton,
-        "regions": regions
+        "zoom_info": shared['zoom_info'],
+        "geoserver_endpoint": shared['geoserver_endpoint'],
+        "defaultUpdateButton": defaultUpdateButton
     }
 
-    return render(request, '{0}/ecmwf.html'.format(base_name), context)
+
+@instrumented
+def ecmwf(request):
+    shared = get_shared_context('ecmwf')
+    context = model_page_context(request, 'ecmwf', "javascript:view_watershed();" + shared['hidden_attr'])
+    context['regions'] = shared['regions']
+
+    with span('render'):
+        return render(request, '{0}/ecmwf.html'.format(base_name), context)
 
 
+@instrumented
 def lis(request):
-    # Can Set Default permissions : Only allowed for admin users
-    can_update_default = has_permission(request, 'update_default')
+    context = model_page_context(request, 'lis', "javascript:view_watershed();")
 
-    if (can_update_default):
-        defaultUpdateButton = Button(
-            display_text='Save',
-            name='update_button',
-            style='success',
-            attributes={
-                'data-toggle': 'tooltip',
-                'data-placement': 'bottom',
-                'title': 'Save as Default Options for WS'
-            })
-    else:
-        defaultUpdateButton = False
+    with span('render'):
+        return render(request, '{0}/lis.html'.format(base_name), context)
 
-    # Check if we need to hide the WS options dropdown.
-    hiddenAttr = ""
-    if app.get_custom_setting('show_dropdown') and app.get_custom_setting(
-            'default_model_type') and app.get_custom_setting('default_watershed_name'):
-        hiddenAttr = "hidden"
 
-    default_model = app.get_custom_setting('default_model_type')
-    init_model_val = request.GET.get('model', False) or default_model or 'Select Model'
-    init_ws_val = app.get_custom_setting('default_watershed_name') or 'Select Watershed'
+@instrumented
+def hiwat(request):
+    context = model_page_context(request, 'hiwat', "javascript:view_watershed();")
 
-    model_input = SelectInput(display_text='',
-                              name='model',
-                              multiple=False,
-                              options=[('Select Model', ''), ('ECMWF-RAPID', 'ecmwf'), ('LIS-RAPID', 'lis'),
-                                       ('HIWAT-RAPID', 'hiwat')],
-                              initial=[init_model_val],
-                              classes=hiddenAttr,
-                              original=True)
+    with span('render'):
+        return render(request, '{0}/hiwat.html'.format(base_name), context)
 
-    watershed_list = [['Select Watershed', '']]
 
-    if app.get_custom_setting('lis_path'):
-        res = os.listdir(app.get_custom_setting('lis_path'))
+def cached_json_response(request, key, build, ttl, modified=None):
+    """
+    JSON response for a payload served from the stale-while-revalidate cache. The payload is cached serialized, so a
+    conditional request for an unchanged payload is answered with a 304 without building a body. Stale payloads
+    are marked with "stale": true and their "age" in seconds, under an ETag of their own and no Last-Modified.
+    modified is the Last-Modified time of what the payload is built from (e.g. its forecast cycle), the build time
+    when None.
+    """
+    def build_body():
+        return http_cache.Body(json.dumps(build(), cls=DjangoJSONEncoder).encode('utf-8'), modified=modified)
 
-        for i in res:
-            feat_name = i.split('-')[0].replace('_', ' ').title() + ' (' + \
-                        i.split('-')[1].replace('_', ' ').title() + ')'
-            if feat_name not in str(watershed_list):
-                watershed_list.append([feat_name, i])
+    body, stale_age = cache.get(key, build_body, ttl)
+    if stale_age is None:
+        return http_cache.body_response(request, body)
+    response = http_cache.not_modified(request, body.etag, None)
+    if response is None:
+        payload = dict(json.loads(body.content.decode('utf-8')), stale=True, age=int(stale_age))
+        response = http_cache.set_validators(JsonResponse(payload), http_cache.stale_etag(body.etag, stale_age), None)
+    return response
 
-    # Add the default WS if present and not already in the list
-    if default_model == 'LIS-RAPID' and init_ws_val and init_ws_val not in str(watershed_list):
-        watershed_list.append([init_ws_val, init_ws_val])
 
-    watershed_select = SelectInput(display_text='',
-                                   name='watershed',
-                                   options=watershed_list,
-                                   initial=[init_ws_val],
-                                   original=True,
-                                   classes=hiddenAttr,
-                                   attributes={'onchange': "javascript:view_watershed();"}
-                                   )
+def window_json_response(request, key, build, ttl, start, end, modified=None):
+    """
+    JSON response for a chart between start and end. Only the full range chart is cached: the windows of zooming and
+    panning are rarely asked twice and would push the full range payloads out of the caches and snapshots, so they
+    are built from the cached frames for every request.
+    """
+    if start is None and end is None:
+        return cached_json_response(request, key, build, ttl, modified)
+    body = http_cache.Body(json.dumps(build(), cls=DjangoJSONEncoder).encode('utf-8'), modified=modified)
+    return http_cache.body_response(request, body)
 
-    zoom_info = TextInput(display_text='',
-                          initial=json.dumps(app.get_custom_setting('zoom_info')),
-                          name='zoom_info',
-                          disabled=True)
 
-    # Retrieve a geoserver engine and geoserver credentials.
-    geoserver_engine = app.get_spatial_dataset_service(
-        name='main_geoserver', as_engine=True)
+@instrumented
+def get_warning_points(request):
+    """
+    Warning points of an ECMWF watershed per return period. Optional parameters: bbox (minx,miny,maxx,maxy in
+    EPSG:3857) selects the points of the viewport and zoom clusters them at low zoom levels (see warning_index.py).
+    """
+    from . import warning_index
 
-    my_geoserver = geoserver_engine.endpoint.replace('rest', '')
+    get_data = request.GET
+    if get_data['model'] == 'ECMWF-RAPID':
+        try:
+            watershed = get_data['watershed']
+            subbasin = get_data['subbasin']
+            bbox = get_data.get('bbox')
+            if bbox:
+                bbox = [float(value) for value in bbox.split(',')]
+                if len(bbox) != 4:
+                    raise ValueError('Invalid bbox {0}'.format(get_data['bbox']))
+            level = warning_index.zoom_level(get_data.get('zoom') or None)
+
+            index = warning_index.index(watershed, subbasin)
+            cell_range = index.cell_range(bbox or None)
+            key = ('warning_points', watershed, subbasin, index.built, cell_range,
+                   level if level is not None and level < warning_index.CLUSTER_ZOOM else None)
+            return cached_json_response(request, key, lambda: index.payload(cell_range, level), WARNING_TTL)
+        except Exception as e:
+            log_error(e)
+            return JsonResponse({'error': 'No data found for the selected reach.'})
+    else:
+        pass
 
-    geoserver_base_url = my_geoserver
-    geoserver_workspace = app.get_custom_setting('workspace')
-    region = app.get_custom_setting('region')
-    extra_feature = app.get_custom_setting('extra_feature')
-    layer_name = app.get_custom_setting('layer_name')
 
-    geoserver_endpoint = TextInput(display_text='',
-                                   initial=json.dumps(
-                                       [geoserver_base_url, geoserver_workspace, region, extra_feature, layer_name]),
-                                   name='geoserver_endpoint',
-                                   disabled=True)
+@instrumented
+def ecmwf_get_time_series(request):
+    import geoglows
 
-    context = {
-        "base_name": base_name,
-        "model_input": model_input,
-        "watershed_select": watershed_select,
-        "zoom_info": zoom_info,
-        "geoserver_endpoint": geoserver_endpoint,
-        "defaultUpdateButton": defaultUpdateButton
-    }
+    from . import downsample
 
-    return render(request, '{0}/lis.html'.format(base_name), context)
+    get_data = request.GET
+    try:
+        comid = get_data['comid']
+        title = {'Upstream Drainage Area': get_data['tot_drain_area']}
+        points = downsample.points_param(get_data.get('points'))
+        start = downsample.time_param(get_data.get('start'))
+        end = downsample.time_param(get_data.get('end'))
+
+        # Keyed by the newest cycle the events watcher has seen, so a new cycle is not served from an old plot
+        cycle = events.announced_cycle()
+
+        def build():
+            stats = downsample.frame(forecast_stats_frame(comid, cycle), points, start, end)
+            rperiods = return_periods_frame(comid)
+            with span('plot'):
+                return {'plot': geoglows.plots.forecast_stats(stats, rperiods, titles=title,
+                                                              outformat='plotly_html')}
+
+        key = ('forecast_stats_plot', comid, get_data['tot_drain_area'], points, cycle)
+        return window_json_response(request, key, build, FORECAST_TTL, start, end, forecast_cycles.cycle_time(cycle))
+    except Exception as e:
+        log_error(e)
+        return JsonResponse({'error': 'No data found for the selected reach.'})
 
 
-def hiwat(request):
-    # Can Set Default permissions : Only allowed for admin users
-    can_update_default = has_permission(request, 'update_default')
+def forecast_stats_frame(comid, cycle=None):
+    """
+    The ForecastStats frame of a reach, fetched (and archived) once per FORECAST_TTL and cycle (see
+    events.announced_cycle()); the charts of every time window are cut from it.
+    """
+    def build():
+        stats = upstream.forecast_stats(comid)
+        archive_forecast(comid, stats)
+        return stats
 
-    if (can_update_default):
-        defaultUpdateButton = Button(
-            display_text='Save',
-            name='update_button',
-            style='success',
-            attributes={
-                'data-toggle': 'tooltip',
-                'data-placement': 'bottom',
-                'title': 'Save as Default Options for WS'
-            })
-    else:
-        defaultUpdateButton = False
+    return cache.get(('forecast_stats', comid, cycle), build, FORECAST_TTL)[0]
 
-    # Check if we need to hide the WS options dropdown.
-    hiddenAttr = ""
-    if app.get_custom_setting('show_dropdown') and app.get_custom_setting(
-            'default_model_type') and app.get_custom_setting('default_watershed_name'):
-        hiddenAttr = "hidden"
 
-    default_model = app.get_custom_setting('default_model_type')
-    init_model_val = request.GET.get('model', False) or default_model or 'Select Model'
-    init_ws_val = app.get_custom_setting('default_watershed_name') or 'Select Watershed'
+def historic_frame(comid):
+    """
+    The HistoricSimulation frame of a reach, fetched once per HISTORIC_TTL.
+    """
+    return cache.get(('historic_simulation', comid), lambda: upstream.historic_simulation(comid), HISTORIC_TTL)[0]
 
-    model_input = SelectInput(display_text='',
-                              name='model',
-                              multiple=False,
-                              options=[('Select Model', ''), ('ECMWF-RAPID', 'ecmwf'), ('LIS-RAPID', 'lis'),
-                                       ('HIWAT-RAPID', 'hiwat')],
-                              initial=[init_model_val],
-                              classes=hiddenAttr,
-                              original=True)
 
-    watershed_list = [['Select Watershed', '']]
+def return_periods_frame(comid):
+    return cache.get(('return_periods', comid), lambda: upstream.return_periods(comid), HISTORIC_TTL)[0]
 
-    if app.get_custom_setting('hiwat_path'):
-        res = os.listdir(app.get_custom_setting('hiwat_path'))
 
-        for i in res:
-            feat_name = i.split('-')[0].replace('_', ' ').title() + ' (' + \
-                        i.split('-')[1].replace('_', ' ').title() + ')'
-            if feat_name not in str(watershed_list):
-                watershed_list.append([feat_name, i])
+def archive_forecast(comid, stats):
+    from . import forecast_archive
 
-    # Add the default WS if present and not already in the list
-    if default_model == 'HIWAT-RAPID' and init_ws_val and init_ws_val not in str(watershed_list):
-        watershed_list.append([init_ws_val, init_ws_val])
+    try:
+        with span('archive'):
+            forecast_archive.append(comid, stats)
+    except Exception as e:
+        log_error(e)
 
-    watershed_select = SelectInput(display_text='',
-                                   name='watershed',
-                                   options=watershed_list,
-                                   initial=[init_ws_val],
-                                   classes=hiddenAttr,
-                                   original=True,
-                                   attributes={'onchange': "javascript:view_watershed();"}
-                                   )
 
-    zoom_info = TextInput(display_text='',
-                          initial=json.dumps(app.get_custom_setting('zoom_info')),
-                          name='zoom_info',
-                          disabled=True)
+@instrumented
+def get_forecast_archive(request):
+    """
+    The forecast stats of the last n (default 10) archived cycles of a reach (comid), oldest first.
+    """
+    from . import forecast_archive
+    import numpy as np
 
-    # Retrieve a geoserver engine and geoserver credentials.
-    geoserver_engine = app.get_spatial_dataset_service(
-        name='main_geoserver', as_engine=True)
+    get_data = request.GET
 
-    my_geoserver = geoserver_engine.endpoint.replace('rest', '')
+    try:
+        n = min(int(get_data.get('n', 10)), forecast_archive.MAX_CYCLES)
+        cycles = forecast_archive.last_cycles(int(get_data['comid']), n)
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Provide a comid and the number of cycles n.'})
 
-    geoserver_base_url = my_geoserver
-    geoserver_workspace = app.get_custom_setting('workspace')
-    region = app.get_custom_setting('region')
-    extra_feature = app.get_custom_setting('extra_feature')
-    layer_name = app.get_custom_setting('layer_name')
+    if not cycles:
+        return JsonResponse({'error': 'No archived forecasts found for the selected reach.'})
+    return JsonResponse({
+        'comid': int(get_data['comid']),
+        'columns': list(forecast_archive.COLUMNS),
+        'cycles': [{
+            'cycle': str(cycle)[:16].replace('T', ' '),
+            'times': [str(t)[:16] for t in times],
+            'values': [[None if np.isnan(v) else round(float(v), 3) for v in column] for column in values.T],
+        } for cycle, times, values in cycles],
+    })
 
-    geoserver_endpoint = TextInput(display_text='',
-                                   initial=json.dumps(
-                                       [geoserver_base_url, geoserver_workspace, region, extra_feature, layer_name]),
-                                   name='geoserver_endpoint',
-                                   disabled=True)
 
-    context = {
-        "base_name": base_name,
-        "model_input": model_input,
-        "watershed_select": watershed_select,
-        "zoom_info": zoom_info,
-        "geoserver_endpoint": geoserver_endpoint,
-        "defaultUpdateButton": defaultUpdateButton
-    }
+@instrumented
+def get_model_comparison(request):
+    """
+    The ECMWF forecast and the LIS and HIWAT series of a reach (comid) on one time axis. LIS and HIWAT are included
+    when watershed and subbasin are given; models=ECMWF-RAPID,LIS-RAPID limits the models and step sets the axis
+    step in hours.
+    """
+    from . import compare
+
+    get_data = request.GET
 
-    return render(request, '{0}/hiwat.html'.format(base_name), context)
+    try:
+        comid = int(get_data['comid'])
+        models = [m for m in get_data.get('models', ','.join(compare.MODELS)).split(',') if m in compare.MODELS]
+        step = int(float(get_data.get('step', compare.DEFAULT_STEP / 3600)) * 3600)
+        if step <= 0:
+            raise ValueError('step must be positive')
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Provide a comid and a step in hours.'})
+
+    with span('compare'):
+        payload = compare.compare(comid, get_data.get('watershed'), get_data.get('subbasin'), models, step)
+    if not payload['times']:
+        log_error(ValueError('No model data for reach {0}: {1}'.format(comid, payload['errors'])))
+        return JsonResponse({'error': 'No data found for the selected reach.'})
+    return JsonResponse(payload)
 
 
-def get_warning_points(request):
+@instrumented
+def get_anomalies(request):
+    """
+    Latest LIS or HIWAT flows against their climatology (see climatology.py): for one reach when comid is given,
+    otherwise for every reach of the watershed.
+    """
+    from . import climatology
+
     get_data = request.GET
-    if get_data['model'] == 'ECMWF-RAPID':
-        try:
-            watershed = get_data['watershed']
-            subbasin = get_data['subbasin']
 
-            res20 = requests.get(
-                app.get_custom_setting(
-                    'api_source') + '/apps/streamflow-prediction-tool/api/GetWarningPoints/?watershed_name=' +
-                watershed + '&subbasin_name=' + subbasin + '&return_period=20',
-                headers={'Authorization': 'Token ' + app.get_custom_setting('spt_token')}, verify=False)
-
-            res10 = requests.get(
-                app.get_custom_setting(
-                    'api_source') + '/apps/streamflow-prediction-tool/api/GetWarningPoints/?watershed_name=' +
-                watershed + '&subbasin_name=' + subbasin + '&return_period=10',
-                headers={'Authorization': 'Token ' + app.get_custom_setting('spt_token')}, verify=False)
-
-            res2 = requests.get(
-                app.get_custom_setting(
-                    'api_source') + '/apps/streamflow-prediction-tool/api/GetWarningPoints/?watershed_name=' +
-                watershed + '&subbasin_name=' + subbasin + '&return_period=2',
-                headers={'Authorization': 'Token ' + app.get_custom_setting('spt_token')}, verify=False)
-
-            return JsonResponse({
-                "success": "Data analysis complete!",
-                "warning20": json.loads(res20.content)["features"],
-                "warning10": json.loads(res10.content)["features"],
-                "warning2": json.loads(res2.content)["features"]
-            })
-        except Exception as e:
-            print(str(e))
-            return JsonResponse({'error': 'No data found for the selected reach.'})
-    else:
-        pass
+    try:
+        model = get_data['model']
+        if model not in ('LIS-RAPID', 'HIWAT-RAPID'):
+            return JsonResponse({'error': 'Anomalies are only available for LIS-RAPID and HIWAT-RAPID.'})
+        with span('climatology'):
+            payload = climatology.anomalies(model, get_data['watershed'], get_data['subbasin'],
+                                            get_data.get('comid') or None)
+    except Exception as e:
+        log_error(e)
+        return JsonResponse({'error': 'No climatology found for the selected watershed.'})
+    if payload is None:
+        return JsonResponse({'error': 'The climatology of this watershed is being computed. Try again shortly.'})
+    return JsonResponse(payload)
 
 
-def ecmwf_get_time_series(request):
+@instrumented
+def get_peak_flows(request):
+    """
+    GeoJSON layer of the peak flow, time of peak and exceeded return period of the LIS or HIWAT reaches of a
+    watershed whose peak exceeds a return period (see peak_flows.py). Answered with a 202 and a Retry-After header
+    while the peak table is being computed.
+    """
+    from . import peak_flows
+
     get_data = request.GET
+
     try:
-        comid = get_data['comid']
+        model = get_data['model']
+        if model not in ('LIS-RAPID', 'HIWAT-RAPID'):
+            return JsonResponse({'error': 'Peak flows are only available for LIS-RAPID and HIWAT-RAPID.'})
+        with span('peak_layer'):
+            body = peak_flows.layer(model, get_data['watershed'], get_data['subbasin'])
+    except Exception as e:
+        log_error(e)
+        return JsonResponse({'error': 'No peak flows found for the selected watershed.'})
+    if body is None:
+        response = JsonResponse({'error': 'The peak flows of this watershed are being computed. Try again shortly.'},
+                                status=202)
+        response['Retry-After'] = str(COMPUTING_RETRY_SECONDS)
+        return response
+    return http_cache.body_response(request, body)
 
-        stats = geoglows.streamflow.forecast_stats(comid)
-        rperiods = geoglows.streamflow.return_periods(comid)
-        title = {'Upstream Drainage Area': get_data['tot_drain_area']}
-        return JsonResponse({'plot': geoglows.plots.forecast_stats(
-            stats, rperiods, titles=title, outformat='plotly_html')})
+
+@instrumented
+def get_drainage_lines(request):
+    """
+    Drainage lines of a LIS or HIWAT watershed from its local shapefile (see networks.py). Optional parameters:
+    bbox (minx,miny,maxx,maxy in EPSG:3857) and zoom select the reaches of the viewport, simplified for the zoom;
+    comid selects a single reach.
+    """
+    from . import networks
+
+    get_data = request.GET
+
+    try:
+        model = get_data['model']
+        if model not in ('LIS-RAPID', 'HIWAT-RAPID'):
+            return JsonResponse({'error': 'Drainage lines are only available for LIS-RAPID and HIWAT-RAPID.'})
+        bbox = get_data.get('bbox')
+        if bbox:
+            bbox = [float(value) for value in bbox.split(',')]
+            if len(bbox) != 4:
+                raise ValueError('Invalid bbox {0}'.format(get_data['bbox']))
+        with span('drainage_lines'):
+            body = networks.layer(model, get_data['watershed'], get_data['subbasin'], bbox or None,
+                                  get_data.get('zoom') or None, get_data.get('comid') or None)
     except Exception as e:
-        print(str(e))
-        return JsonResponse({'error': 'No data found for the selected reach.'})
+        log_error(e)
+        return JsonResponse({'error': 'No drainage lines found for the selected watershed.'})
+    return http_cache.body_response(request, body)
+
+
+@instrumented
+def get_events(request):
+    """
+    New forecast cycles, warning points and LIS/HIWAT files after last_id (see events.py), answered at once; the
+    browser asks again after the returned "poll" seconds, or opens the event stream when "stream" is true. ECMWF
+    watersheds are watched while they are polled.
+    """
+    try:
+        after_id = _events_request(request, request.GET.get('last_id'))
+    except (KeyError, ValueError) as e:
+        log_error(e)
+        return JsonResponse({'error': 'Provide a watershed and subbasin made of letters, digits and underscores.'})
+
+    response = JsonResponse(dict(events.poll(after_id), stream=events.can_stream(request)))
+    response['Cache-Control'] = 'no-cache'
+    return response
 
 
+async def get_event_stream(request):
+    """
+    Server-sent event stream of the events get_events polls for (see events.stream()), after the Last-Event-ID or
+    last_id. Only served where events.can_stream() holds; otherwise answered with a 204, which stops EventSource from
+    reconnecting, and the browser keeps polling. Not instrumented: the decorator is synchronous and a stream's
+    latency is its lifetime.
+    """
+    from asgiref.sync import sync_to_async
+
+    if not events.can_stream(request):
+        return HttpResponse(status=204)
+    try:
+        last_id = request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('last_id')
+        after_id = await sync_to_async(_events_request)(request, last_id)
+    except (KeyError, ValueError) as e:
+        log_error(e)
+        return JsonResponse({'error': 'Provide a watershed and subbasin made of letters, digits and underscores.'})
+
+    response = StreamingHttpResponse(events.stream(after_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _events_request(request, last_id):
+    # Watches the ECMWF watershed of an events request and returns the id to send the events after
+    get_data = request.GET
+    if get_data.get('model', 'ECMWF-RAPID') == 'ECMWF-RAPID' and get_data.get('watershed'):
+        events.subscribe(get_data['watershed'], get_data['subbasin'])
+    return int(last_id) if last_id else None
+
+
+@instrumented
 def get_time_series(request):
     return ecmwf_get_time_series(request)
 
 
+@instrumented
 def lis_get_time_series(request):
+    import plotly.graph_objs as go
+
+    from . import downsample, local_return_periods, qout
+
     get_data = request.GET
 
     try:
@@ -481,23 +498,27 @@ def lis_get_time_series(request):
         subbasin = get_data['subbasin']
         comid = get_data['comid']
         units = 'metric'
-
-        path = os.path.join(app.get_custom_setting('lis_path'), '-'.join([watershed, subbasin]))
-        filename = [f for f in os.listdir(path) if 'Qout' in f]
-        res = nc.Dataset(os.path.join(app.get_custom_setting('lis_path'), '-'.join([watershed, subbasin]), filename[0]),
-                         'r')
-
-        dates_raw = res.variables['time'][:]
-        dates = []
-        for d in dates_raw:
-            dates.append(dt.datetime.fromtimestamp(d))
-
-        comid_list = res.variables['rivid'][:]
-        comid_index = int(np.where(comid_list == int(comid))[0])
-
-        values = []
-        for l in list(res.variables['Qout'][:]):
-            values.append(float(l[comid_index]))
+        points = downsample.points_param(get_data.get('points'))
+        start = downsample.time_param(get_data.get('start'))
+        end = downsample.time_param(get_data.get('end'))
+
+        # Bands from the return periods of the Qout file, once they have been computed
+        thresholds = local_return_periods.thresholds('LIS-RAPID', watershed, subbasin, comid)
+        tag, modified = http_cache.file_validators(qout.qout_path('LIS-RAPID', watershed, subbasin), comid, points,
+                                                   start, end, thresholds is not None)
+        response = http_cache.not_modified(request, tag, modified)
+        if response is not None:
+            return response
+
+        with span('qout_read'):
+            times, flows = qout.read_series('LIS-RAPID', watershed, subbasin, comid)
+            times, flows = downsample.series(times, flows, points, start, end)
+        dates = [dt.datetime.fromtimestamp(d) for d in times]
+        values = [float(v) for v in flows]
+
+        shapes, annotations = [], []
+        if thresholds is not None and dates:
+            shapes, annotations = return_period_bands(thresholds, dates[0], dates[-1], max(values))
 
         # --------------------------------------
         # Chart Section
@@ -517,26 +538,36 @@ def lis_get_time_series(request):
             yaxis=dict(
                 title='Streamflow ({}<sup>3</sup>/s)'
                     .format(get_units_title(units))
-            )
+            ),
+            shapes=shapes,
+            annotations=annotations,
         )
 
-        chart_obj = PlotlyView(
-            go.Figure(data=[series],
-                      layout=layout)
-        )
+        with span('plot'):
+            chart_obj = PlotlyView(
+                go.Figure(data=[series],
+                          layout=layout)
+            )
 
         context = {
             'gizmo_object': chart_obj,
         }
 
-        return render(request, '{0}/gizmo_ajax.html'.format(base_name), context)
+        with span('render'):
+            response = render(request, '{0}/gizmo_ajax.html'.format(base_name), context)
+        return http_cache.set_validators(response, tag, modified)
 
     except Exception as e:
-        print(str(e))
+        log_error(e)
         return JsonResponse({'error': 'No LIS data found for the selected reach.'})
 
 
+@instrumented
 def hiwat_get_time_series(request):
+    import plotly.graph_objs as go
+
+    from . import downsample, local_return_periods, qout
+
     get_data = request.GET
 
     try:
@@ -545,23 +576,27 @@ def hiwat_get_time_series(request):
         subbasin = get_data['subbasin']
         comid = get_data['comid']
         units = 'metric'
-
-        path = os.path.join(app.get_custom_setting('hiwat_path'), '-'.join([watershed, subbasin]))
-        filename = [f for f in os.listdir(path) if 'Qout' in f]
-        res = nc.Dataset(
-            os.path.join(app.get_custom_setting('hiwat_path'), '-'.join([watershed, subbasin]), filename[0]), 'r')
-
-        dates_raw = res.variables['time'][:]
-        dates = []
-        for d in dates_raw:
-            dates.append(dt.datetime.fromtimestamp(d))
-
-        comid_list = res.variables['rivid'][:]
-        comid_index = int(np.where(comid_list == int(comid))[0])
-
-        values = []
-        for l in list(res.variables['Qout'][:]):
-            values.append(float(l[comid_index]))
+        points = downsample.points_param(get_data.get('points'))
+        start = downsample.time_param(get_data.get('start'))
+        end = downsample.time_param(get_data.get('end'))
+
+        # Bands from the return periods of the Qout file, once they have been computed
+        thresholds = local_return_periods.thresholds('HIWAT-RAPID', watershed, subbasin, comid)
+        tag, modified = http_cache.file_validators(qout.qout_path('HIWAT-RAPID', watershed, subbasin), comid, points,
+                                                   start, end, thresholds is not None)
+        response = http_cache.not_modified(request, tag, modified)
+        if response is not None:
+            return response
+
+        with span('qout_read'):
+            times, flows = qout.read_series('HIWAT-RAPID', watershed, subbasin, comid)
+            times, flows = downsample.series(times, flows, points, start, end)
+        dates = [dt.datetime.fromtimestamp(d) for d in times]
+        values = [float(v) for v in flows]
+
+        shapes, annotations = [], []
+        if thresholds is not None and dates:
+            shapes, annotations = return_period_bands(thresholds, dates[0], dates[-1], max(values))
 
         # --------------------------------------
         # Chart Section
@@ -581,25 +616,31 @@ def hiwat_get_time_series(request):
             yaxis=dict(
                 title='Streamflow ({}<sup>3</sup>/s)'
                     .format(get_units_title(units))
-            )
+            ),
+            shapes=shapes,
+            annotations=annotations,
         )
 
-        chart_obj = PlotlyView(
-            go.Figure(data=[series],
-                      layout=layout)
-        )
+        with span('plot'):
+            chart_obj = PlotlyView(
+                go.Figure(data=[series],
+                          layout=layout)
+            )
 
         context = {
             'gizmo_object': chart_obj,
         }
 
-        return render(request, '{0}/gizmo_ajax.html'.format(base_name), context)
+        with span('render'):
+            response = render(request, '{0}/gizmo_ajax.html'.format(base_name), context)
+        return http_cache.set_validators(response, tag, modified)
 
     except Exception as e:
-        print(str(e))
+        log_error(e)
         return JsonResponse({'error': 'No HIWAT data found for the selected reach.'})
 
 
+@instrumented
 def get_available_dates(request):
     get_data = request.GET
 
@@ -607,23 +648,10 @@ def get_available_dates(request):
     subbasin = get_data['subbasin']
     comid = get_data['comid']
 
-    res = requests.get(
-        app.get_custom_setting(
-            'api_source') + '/apps/streamflow-prediction-tool/api/GetAvailableDates/?watershed_name=' +
-        watershed + '&subbasin_name=' + subbasin, verify=False,
-        headers={'Authorization': 'Token ' + app.get_custom_setting('spt_token')})
-
-    dates = []
-    for date in eval(res.content):
-        if len(date) == 10:
-            date_mod = date + '000'
-            date_f = dt.datetime.strptime(date_mod, '%Y%m%d.%H%M').strftime('%Y-%m-%d %H:%M')
-        else:
-            date_f = dt.datetime.strptime(date, '%Y%m%d.%H%M').strftime('%Y-%m-%d %H:%M')
-        dates.append([date_f, date, watershed, subbasin, comid])
+    cycles = forecast_cycles.catalogue(watershed, subbasin, events.announced_cycle(watershed, subbasin))
 
-    dates.append(['Select Date', dates[-1][1]])
-    dates.reverse()
+    dates = [[label, name, watershed, subbasin, comid] for label, name in cycles.between()]
+    dates.insert(0, ['Select Date', cycles.latest()])
 
     return JsonResponse({
         "success": "Data analysis complete!",
@@ -631,52 +659,94 @@ def get_available_dates(request):
     })
 
 
+@instrumented
+def get_forecast_cycles(request):
+    """
+    Forecast cycles of a watershed/subbasin between start and end (YYYYMMDD or YYYYMMDDHHMM, both optional and
+    inclusive), newest first, at most limit of them.
+    """
+    get_data = request.GET
+
+    try:
+        start = get_data.get('start')
+        end = get_data.get('end')
+        limit = get_data.get('limit')
+        watershed, subbasin = get_data['watershed'], get_data['subbasin']
+        cycles = forecast_cycles.catalogue(watershed, subbasin, events.announced_cycle(watershed, subbasin))
+        return JsonResponse({
+            'latest': cycles.latest(),
+            'cycles': cycles.between(int(start) if start else None, int(end) if end else None,
+                                     int(limit) if limit else None),
+        })
+    except ValueError:
+        return JsonResponse({'error': 'start and end must be dates as YYYYMMDD and limit a number.'})
+    except Exception as e:
+        log_error(e)
+        return JsonResponse({'error': 'No forecast cycles found for the selected watershed.'})
+
+
+@instrumented
 def get_return_periods(request):
     get_data = request.GET
 
     comid = get_data['comid']
 
-    res = requests.get(
-        app.get_custom_setting(
-            'api_source') + '/apps/streamflow-prediction-tool/api/GetReturnPeriods/?watershed_name=' +
-        watershed + '&subbasin_name=' + subbasin + '&reach_id=' + comid,
-        headers={'Authorization': 'Token ' + app.get_custom_setting('spt_token')}, verify=False)
+    res = upstream.spt_get('GetReturnPeriods', {'watershed_name': watershed, 'subbasin_name': subbasin,
+                                                'reach_id': comid})
 
     return eval(res.content)
 
 
+@instrumented
 def get_historic_data(request):
     """""
     Returns ERA Interim hydrograph
     """""
+    import geoglows
+
+    from . import downsample
 
     get_data = request.GET
 
     try:
         comid = get_data['comid']
-        hist = geoglows.streamflow.historic_simulation(comid)
-        rperiods = geoglows.streamflow.return_periods(comid)
         title = {'Upstream Drainage Area': get_data['tot_drain_area']}
-        return JsonResponse({'plot': geoglows.plots.historic_simulation(
-            hist, rperiods, titles=title, outformat='plotly_html')})
+        points = downsample.points_param(get_data.get('points'))
+        start = downsample.time_param(get_data.get('start'))
+        end = downsample.time_param(get_data.get('end'))
+
+        def build():
+            hist = downsample.frame(historic_frame(comid), points, start, end)
+            rperiods = return_periods_frame(comid)
+            with span('plot'):
+                return {'plot': geoglows.plots.historic_simulation(hist, rperiods, titles=title,
+                                                                   outformat='plotly_html')}
+
+        key = ('historic_plot', comid, get_data['tot_drain_area'], points)
+        return window_json_response(request, key, build, HISTORIC_TTL, start, end)
 
     except Exception as e:
-        print(str(e))
+        log_error(e)
         return JsonResponse({'error': 'No historic data found for the selected reach.'})
 
 
+@instrumented
 def get_flow_duration_curve(request):
+    import geoglows
+
     get_data = request.GET
 
     try:
         comid = get_data['comid']
 
-        hist = geoglows.streamflow.historic_simulation(comid)
+        hist = historic_frame(comid)
         title = {'Upstream Drainage Area': get_data['tot_drain_area']}
-        return JsonResponse({'plot': geoglows.plots.flow_duration_curve(hist, titles=title, outformat='plotly_html')})
+        with span('plot'):
+            plot = geoglows.plots.flow_duration_curve(hist, titles=title, outformat='plotly_html')
+        return JsonResponse({'plot': plot})
 
     except Exception as e:
-        print(str(e))
+        log_error(e)
         return JsonResponse({'error': 'No historic data found for calculating flow duration curve.'})
 
 
@@ -688,6 +758,13 @@ def get_return_period_ploty_info(request, datetime_start, datetime_end,
 
     # Return Period Section
     return_period_data = get_return_periods(request)
+    return return_period_bands(return_period_data, datetime_start, datetime_end, band_alt_max)
+
+
+def return_period_bands(return_period_data, datetime_start, datetime_end, band_alt_max=-9999):
+    """
+    Shapes and annotations of the 2, 10 and 20 year bands for a dict with max, twenty, ten and two flows
+    """
     return_max = float(return_period_data["max"])
     return_20 = float(return_period_data["twenty"])
     return_10 = float(return_period_data["ten"])
@@ -778,6 +855,7 @@ def get_return_period_ploty_info(request, datetime_start, datetime_end,
     return shapes, annotations
 
 
+@instrumented
 def get_historic_data_csv(request):
     """""
     Returns ERA Interim data as csv
@@ -791,34 +869,27 @@ def get_historic_data_csv(request):
         subbasin = get_data['subbasin_name']
         comid = get_data['reach_id']
 
-        era_res = requests.get(
-            app.get_custom_setting(
-                'api_source') + '/apps/streamflow-prediction-tool/api/GetHistoricData/?watershed_name=' +
-            watershed + '&subbasin_name=' + subbasin + '&reach_id=' + comid + '&return_format=csv',
-            headers={'Authorization': 'Token ' + app.get_custom_setting('spt_token')}, verify=False)
+        era_res = upstream.spt_get('GetHistoricData', {'watershed_name': watershed, 'subbasin_name': subbasin,
+                                                       'reach_id': comid, 'return_format': 'csv'}, stream=True)
 
-        qout_data = era_res.content.decode('utf-8').splitlines()
-        qout_data.pop(0)
+        first_row, rows = replace_csv_header(era_res.iter_content(chunk_size=CSV_CHUNK_SIZE),
+                                             'datetime,streamflow (m3/s)', on_close=era_res.close)
+        if not first_row:
+            era_res.close()
+            raise ValueError('Empty historic data for reach {0}'.format(comid))
 
-        response = HttpResponse(content_type='text/csv')
+        response = StreamingHttpResponse(rows, content_type='text/csv')
         response['Content-Disposition'] = 'attachment; filename=historic_streamflow_{0}_{1}_{2}.csv'.format(watershed,
                                                                                                             subbasin,
                                                                                                             comid)
-
-        writer = csv_writer(response)
-
-        writer.writerow(['datetime', 'streamflow (m3/s)'])
-
-        for row_data in qout_data:
-            writer.writerow(row_data.split(','))
-
         return response
 
     except Exception as e:
-        print(str(e))
+        log_error(e)
         return JsonResponse({'error': 'No historic data found.'})
 
 
+@instrumented
 def get_forecast_data_csv(request):
     """""
     Returns Forecast data as csv
@@ -836,42 +907,39 @@ def get_forecast_data_csv(request):
         else:
             startdate = 'most_recent'
 
-        res = requests.get(
-            app.get_custom_setting('api_source') + '/apps/streamflow-prediction-tool/api/GetForecast/?watershed_name=' +
-            watershed + '&subbasin_name=' + subbasin + '&reach_id=' + comid + '&forecast_folder=' +
-            startdate + '&return_format=csv',
-            headers={'Authorization': 'Token ' + app.get_custom_setting('spt_token')}, verify=False)
-
-        qout_data = res.content.decode('utf-8').splitlines()
-        qout_data.pop(0)
-
-        init_time = qout_data[0].split(',')[0].split(' ')[0]
-        response = HttpResponse(content_type='text/csv')
+        res = upstream.spt_get('GetForecast', {'watershed_name': watershed, 'subbasin_name': subbasin,
+                                               'reach_id': comid, 'forecast_folder': startdate,
+                                               'return_format': 'csv'}, stream=True)
+
+        first_row, rows = replace_csv_header(
+            res.iter_content(chunk_size=CSV_CHUNK_SIZE),
+            'datetime,high_res (m3/s),max (m3/s),mean (m3/s),min (m3/s),std_dev_range_lower (m3/s),'
+            'std_dev_range_upper (m3/s)',
+            on_close=res.close)
+        if not first_row:
+            res.close()
+            raise ValueError('Empty forecast for reach {0}'.format(comid))
+
+        init_time = first_row.split(',')[0].split(' ')[0]
+        response = StreamingHttpResponse(rows, content_type='text/csv')
         response['Content-Disposition'] = 'attachment; filename=streamflow_forecast_{0}_{1}_{2}_{3}.csv'.format(
             watershed,
             subbasin,
             comid,
             init_time)
-
-        writer = csv_writer(response)
-        writer.writerow(
-            ['datetime', 'high_res (m3/s)', 'max (m3/s)', 'mean (m3/s)', 'min (m3/s)', 'std_dev_range_lower (m3/s)',
-             'std_dev_range_upper (m3/s)'])
-
-        for row_data in qout_data:
-            writer.writerow(row_data.split(','))
-
         return response
 
     except Exception as e:
-        print(str(e))
+        log_error(e)
         return JsonResponse({'error': 'No forecast data found.'})
 
 
+@instrumented
 def get_lis_data_csv(request):
     """""
     Returns LIS data as csv
     """""
+    from . import qout
 
     get_data = request.GET
 
@@ -885,22 +953,15 @@ def get_lis_data_csv(request):
         else:
             startdate = 'most_recent'
 
-        path = os.path.join(app.get_custom_setting('lis_path'), '-'.join([watershed, subbasin]))
-        filename = [f for f in os.listdir(path) if 'Qout' in f]
-        res = nc.Dataset(os.path.join(app.get_custom_setting('lis_path'), '-'.join([watershed, subbasin]), filename[0]),
-                         'r')
-
-        dates_raw = res.variables['time'][:]
-        dates = []
-        for d in dates_raw:
-            dates.append(dt.datetime.fromtimestamp(d).strftime('%Y-%m-%d %H:%M:%S'))
-
-        comid_list = res.variables['rivid'][:]
-        comid_index = int(np.where(comid_list == int(comid))[0])
+        tag, modified = http_cache.file_validators(qout.qout_path('LIS-RAPID', watershed, subbasin), comid)
+        response = http_cache.not_modified(request, tag, modified)
+        if response is not None:
+            return response
 
-        values = []
-        for l in list(res.variables['Qout'][:]):
-            values.append(float(l[comid_index]))
+        with span('qout_read'):
+            times, flows = qout.read_series('LIS-RAPID', watershed, subbasin, comid)
+        dates = [dt.datetime.fromtimestamp(d).strftime('%Y-%m-%d %H:%M:%S') for d in times]
+        values = [float(v) for v in flows]
 
         pairs = [list(a) for a in zip(dates, values)]
 
@@ -917,17 +978,19 @@ def get_lis_data_csv(request):
         for row_data in pairs:
             writer.writerow(row_data)
 
-        return response
+        return http_cache.set_validators(response, tag, modified)
 
     except Exception as e:
-        print(str(e))
+        log_error(e)
         return JsonResponse({'error': 'No forecast data found.'})
 
 
+@instrumented
 def get_hiwat_data_csv(request):
     """""
     Returns HIWAT data as csv
     """""
+    from . import qout
 
     get_data = request.GET
 
@@ -941,22 +1004,15 @@ def get_hiwat_data_csv(request):
         else:
             startdate = 'most_recent'
 
-        path = os.path.join(app.get_custom_setting('hiwat_path'), '-'.join([watershed, subbasin]))
-        filename = [f for f in os.listdir(path) if 'Qout' in f]
-        res = nc.Dataset(
-            os.path.join(app.get_custom_setting('hiwat_path'), '-'.join([watershed, subbasin]), filename[0]), 'r')
-
-        dates_raw = res.variables['time'][:]
-        dates = []
-        for d in dates_raw:
-            dates.append(dt.datetime.fromtimestamp(d).strftime('%Y-%m-%d %H:%M:%S'))
+        tag, modified = http_cache.file_validators(qout.qout_path('HIWAT-RAPID', watershed, subbasin), comid)
+        response = http_cache.not_modified(request, tag, modified)
+        if response is not None:
+            return response
 
-        comid_list = res.variables['rivid'][:]
-        comid_index = int(np.where(comid_list == int(comid))[0])
-
-        values = []
-        for l in list(res.variables['Qout'][:]):
-            values.append(float(l[comid_index]))
+        with span('qout_read'):
+            times, flows = qout.read_series('HIWAT-RAPID', watershed, subbasin, comid)
+        dates = [dt.datetime.fromtimestamp(d).strftime('%Y-%m-%d %H:%M:%S') for d in times]
+        values = [float(v) for v in flows]
 
         pairs = [list(a) for a in zip(dates, values)]
 
@@ -973,16 +1029,18 @@ def get_hiwat_data_csv(request):
         for row_data in pairs:
             writer.writerow(row_data)
 
-        return response
+        return http_cache.set_validators(response, tag, modified)
 
     except Exception as e:
-        print(str(e))
+        log_error(e)
         return JsonResponse({'error': 'No forecast data found.'})
 
 
+@instrumented
 def setDefault(request):
     get_data = request.GET
     set_custom_setting(get_data.get('ws_name'), get_data.get('model_name'))
+    bump_settings_version()
     return JsonResponse({'success': True})
 
 
@@ -996,11 +1054,109 @@ def get_units_title(unit_type):
     return units_title
 
 
+@instrumented
 def forecastpercent(request):
+    """
+    Percent of the ensemble members exceeding the 2 to 100 year return period flows on each forecast day.
+    """
+    from . import ensemble_store, probabilities
+
     # Check if its an ajax post request
     if request.is_ajax() and request.method == 'GET':
         comid = request.GET.get('comid')
-        stats = geoglows.streamflow.forecast_stats(comid)
-        ensems = geoglows.streamflow.forecast_ensembles(comid)
-        rperiods = geoglows.streamflow.return_periods(comid)
-        return JsonResponse({'table': geoglows.plots.probabilities_table(stats, ensems, rperiods)})
+        try:
+            cycle = events.announced_cycle()
+
+            def build():
+                _, times, flows = ensemble_store.load(comid, cycle)
+                rperiods = return_periods_frame(comid)
+                with span('probabilities'):
+                    return probabilities.probabilities_payload(times, flows, rperiods)
+
+            return cached_json_response(request, ('forecast_probabilities', comid, cycle), build, FORECAST_TTL,
+                                        forecast_cycles.cycle_time(cycle))
+        except Exception as e:
+            log_error(e)
+            return JsonResponse({'error': 'No forecast data found for the selected reach.'})
+
+
+@instrumented
+def export_start(request):
+    """
+    Queues a bulk export of a COMID list (comids=1,2,3), a watershed (watershed, subbasin) or a region (region) and
+    returns the job status to poll with export_status. Admins only.
+    """
+    from . import exports
+
+    if not has_permission(request, 'update_default'):
+        return JsonResponse({'error': 'Exports are only available to administrators.'})
+
+    get_data = request.GET
+
+    try:
+        comids = [int(c) for c in get_data.get('comids', '').split(',') if c.strip()]
+        status = exports.submit(get_data.get('model', 'ECMWF-RAPID'),
+                                get_data.get('product', 'forecast'),
+                                get_data.get('format', 'csv'),
+                                comids=comids or None,
+                                watershed=get_data.get('watershed'),
+                                subbasin=get_data.get('subbasin'),
+                                region=get_data.get('region'))
+        return JsonResponse(status)
+    except ValueError:
+        return JsonResponse({'error': 'comids must be a comma separated list of reach ids.'})
+    except exports.ExportError as e:
+        return JsonResponse({'error': str(e)})
+
+
+@instrumented
+def export_status(request):
+    from . import exports
+
+    if not has_permission(request, 'update_default'):
+        return JsonResponse({'error': 'Exports are only available to administrators.'})
+
+    status = exports.job_status(request.GET.get('job_id'))
+    if status is None:
+        return JsonResponse({'error': 'No export job found.'})
+    return JsonResponse(status)
+
+
+@instrumented
+def export_download(request):
+    from . import exports
+
+    if not has_permission(request, 'update_default'):
+        return JsonResponse({'error': 'Exports are only available to administrators.'})
+
+    status = exports.job_status(request.GET.get('job_id'))
+    if status is None or status['state'] != 'done':
+        return JsonResponse({'error': 'The export is not available.'})
+    return FileResponse(open(exports.result_path(status), 'rb'), as_attachment=True, filename=status['filename'])
+
+
+def get_metrics(request):
+    """
+    Per-endpoint and per-upstream latency histograms and error counts summed over the workers of the host, and
+    circuit breaker states, in the Prometheus text format.
+    """
+    gauges = [('upstream_circuit_open', {'upstream': name}, int(state != 'closed'))
+              for name, state in sorted(upstream.breaker_states().items())]
+    return HttpResponse(prometheus_text(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def get_profile(request):
+    """
+    Lists the saved request profiles, or downloads one with name=<file> (the X-Profile header of a profiled
+    response). Add ?profile=1 to a request to profile it. Admins only.
+    """
+    if not has_permission(request, 'update_default'):
+        return JsonResponse({'error': 'Profiles are only available to administrators.'})
+
+    name = request.GET.get('name')
+    if not name:
+        return JsonResponse({'profiles': profiling.list_profiles()})
+    path = profiling.profile_path(name)
+    if path is None:
+        return JsonResponse({'error': 'No profile found.'})
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name)
@@ -0,0 +1,90 @@
+"""
+Peak-preserving downsampling of long hydrographs.
+
+A series is split into equal buckets of time steps and only the minimum and the maximum of every bucket are kept
+(plus the first and last step), so a chart of a few thousand points still shows every flood peak and low flow of the
+full series. A zoomed chart asks again for its time window, which comes back at full resolution once the window
+holds fewer steps than the target point count.
+"""
+import numpy as np
+
+DEFAULT_POINTS = 2000
+MAX_POINTS = 20000
+
+
+def points_param(value):
+    """
+    Target point count from a request parameter: DEFAULT_POINTS when missing, 0 for the full resolution.
+    """
+    if value in (None, ''):
+        return DEFAULT_POINTS
+    return min(max(int(value), 0), MAX_POINTS)
+
+
+def time_param(value):
+    """
+    datetime64[s] from a request parameter such as 2020-01-31, 2020-01-31T06:00 or a Plotly axis range
+    (2020-01-31 06:00:00.123), None when missing.
+    """
+    if value in (None, ''):
+        return None
+    return np.datetime64(value.strip().replace(' ', 'T')[:19], 's')
+
+
+def window(times, start=None, end=None):
+    """
+    (lo, hi) bounds of the sorted times between start and end, inclusive.
+    """
+    times = np.asarray(times)
+    lo = np.searchsorted(times, np.asarray(start).astype(times.dtype), 'left') if start is not None else 0
+    hi = np.searchsorted(times, np.asarray(end).astype(times.dtype), 'right') if end is not None else len(times)
+    return int(lo), int(hi)
+
+
+def minmax_indices(values, points):
+    """
+    Sorted indices of the steps to keep from a (time,) or (time, column) array: the first and last step and the
+    minimum and maximum of each bucket of every column. NaNs are ignored. All steps are kept when there are no more
+    than points of them, or points is 0.
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, np.newaxis]
+    n = len(values)
+    if points <= 0 or n <= max(points, 2):
+        return np.arange(n)
+
+    interior = values[1:-1]
+    # Two steps per bucket and column
+    buckets = max((points - 2) // (2 * values.shape[1]), 1)
+    size = -(-len(interior) // buckets)
+    padded = np.full((buckets * size, values.shape[1]), np.nan)
+    padded[:len(interior)] = interior
+    padded = padded.reshape(buckets, size, values.shape[1])
+
+    missing = np.isnan(padded)
+    highest = np.where(missing, -np.inf, padded).argmax(axis=1)
+    lowest = np.where(missing, np.inf, padded).argmin(axis=1)
+    offsets = (np.arange(buckets) * size)[:, np.newaxis]
+    keep = np.concatenate([(offsets + highest).ravel(), (offsets + lowest).ravel()]) + 1
+    keep = keep[keep < n - 1]
+    return np.unique(np.concatenate([[0, n - 1], keep]))
+
+
+def series(times, flows, points=DEFAULT_POINTS, start=None, end=None):
+    """
+    Windowed and downsampled (times, flows) arrays.
+    """
+    lo, hi = window(times, start, end)
+    times, flows = np.asarray(times)[lo:hi], np.asarray(flows)[lo:hi]
+    keep = minmax_indices(flows, points)
+    return times[keep], flows[keep]
+
+
+def frame(df, points=DEFAULT_POINTS, start=None, end=None):
+    """
+    Windowed and downsampled rows of a DataFrame with a time index, keeping the peaks of every column.
+    """
+    lo, hi = window(df.index.values.astype('datetime64[s]'), start, end)
+    df = df.iloc[lo:hi]
+    return df.iloc[minmax_indices(df.values, points)]
@@ -0,0 +1,120 @@
+"""
+On-disk store of GEOGLOWS ensemble forecasts, partitioned by forecast cycle.
+
+Each reach fetched from the ForecastEnsembles API is saved as a float32 (time, member) .npy array, with its time
+axis in seconds since the epoch, under <workspace>/ensembles/<cycle>/, the cycle as YYYYMMDDHHMM. Every worker process shares the store and
+reads it memory-mapped, so a repeat request maps a small binary file, usually already in the page cache, instead of
+downloading and parsing the csv again.
+
+A reach is served from the newest cycle in the store for up to MAX_AGE seconds after it was written; after that it is
+fetched again, which stores it under the next cycle once GEOGLOWS has published it. Cycles older than
+RETENTION_DAYS are deleted whenever a new cycle directory is created.
+"""
+import datetime as dt
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from . import upstream
+from .forecast_cycles import cycle_key
+from .app import Hydroviewer as app
+from .metrics import span
+
+MAX_AGE = 6 * 60 * 60
+RETENTION_DAYS = 3
+
+_CYCLE_PATTERN = re.compile(r'^[0-9]{12}$')
+# Directories of the earlier store, partitioned by day only; deleted by evict()
+_DAY_PATTERN = re.compile(r'^[0-9]{8}$')
+_lock = threading.Lock()
+
+
+def store_dir():
+    return os.path.join(app.get_app_workspace().path, 'ensembles')
+
+
+def cycles():
+    """
+    Cycle directory names (YYYYMMDDHHMM) in the store, newest first.
+    """
+    directory = store_dir()
+    if not os.path.isdir(directory):
+        return []
+    return sorted((c for c in os.listdir(directory) if _CYCLE_PATTERN.match(c)), reverse=True)
+
+
+def load(comid, announced=None):
+    """
+    Returns (cycle, times, flows) for a reach: the cycle as YYYYMMDDHHMM, times as datetime64[s] and a memory-mapped
+    float32 (time, member) array. Served from the store when the newest cycle holds a recent copy of the reach and is
+    not older than the announced cycle (an SPT cycle name, see events.announced_cycle()), otherwise fetched and
+    stored.
+    """
+    comid = int(comid)
+    stored = _read(comid)
+    if stored is not None and (announced is None or int(stored[0]) >= cycle_key(announced)):
+        return stored
+
+    frame = upstream.forecast_ensembles(comid)
+    times = frame.index.values.astype('datetime64[s]').astype('i8')
+    cycle = str(frame.index[0].strftime('%Y%m%d%H%M'))
+    _write(cycle, comid, times, frame.values.astype('f4'))
+    return _read(comid, cycle)
+
+
+def _paths(cycle, comid):
+    directory = os.path.join(store_dir(), cycle)
+    return os.path.join(directory, '{0}.npy'.format(comid)), os.path.join(directory, '{0}.times.npy'.format(comid))
+
+
+def _read(comid, cycle=None):
+    check_age = cycle is None
+    if cycle is None:
+        newest = cycles()
+        if not newest:
+            return None
+        cycle = newest[0]
+
+    flows_path, times_path = _paths(cycle, comid)
+    try:
+        if check_age and time.time() - os.path.getmtime(flows_path) > MAX_AGE:
+            return None
+        with span('ensemble_store'):
+            flows = np.load(flows_path, mmap_mode='r')
+            times = np.load(times_path).astype('datetime64[s]')
+    except (IOError, OSError, ValueError):
+        return None
+    return cycle, times, flows
+
+
+def _write(cycle, comid, times, flows):
+    directory = os.path.join(store_dir(), cycle)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+        evict()
+
+    flows_path, times_path = _paths(cycle, comid)
+    # Write the time axis first so a reader that sees the flows always finds it
+    for path, array in ((times_path, times), (flows_path, flows)):
+        tmp = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex[:8])
+        with open(tmp, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+
+
+def evict(now=None):
+    """
+    Deletes the cycles older than RETENTION_DAYS, and the day directories of the earlier store.
+    """
+    oldest = ((now or dt.datetime.utcnow()) - dt.timedelta(days=RETENTION_DAYS)).strftime('%Y%m%d%H%M')
+    with _lock:
+        directory = store_dir()
+        days = [d for d in os.listdir(directory) if _DAY_PATTERN.match(d)] if os.path.isdir(directory) else []
+        for cycle in cycles() + days:
+            if len(cycle) == 8 or cycle < oldest:
+                shutil.rmtree(os.path.join(directory, cycle), ignore_errors=True)
@@ -0,0 +1,395 @@
+"""
+Events announcing new forecast cycles, new warning points and new LIS/HIWAT files, pushed to the browser as
+server-sent events where the deployment can hold streams cheaply and polled otherwise.
+
+One watcher per host polls the upstreams and the Qout folders every POLL_SECONDS and appends what changed to
+<workspace>/events/events.log, one JSON event per line with an increasing id. Worker processes elect the watcher
+with a non-blocking lock on events/watcher.lock, so whichever process holds it does the polling and another takes
+over when it exits.
+
+The browser first asks any worker for the events (poll()); the request is answered from the log at once. When the
+app is served over ASGI by Django 4.2 or later (see can_stream()), the reply tells the browser to open a
+server-sent event stream instead (stream()): an async generator tailing the log, which waits on the event loop and
+holds no worker thread. A stream closes after STREAM_SECONDS and EventSource reconnects with its Last-Event-ID.
+Under WSGI a stream would hold a synchronous worker for its whole life, so the browser keeps polling every
+CLIENT_POLL_SECONDS, and falls back to polling as well when a stream cannot be opened.
+
+The newest cycle and warning points the watcher has seen per watershed are kept in its state file, which every
+worker reads again when it changes (see announced_cycle() and warnings_version()). Cached ECMWF products are keyed
+or checked against them, so a refresh after an event is built from the new cycle in whichever worker answers it.
+
+A new Qout file also starts the computation of its return period, climatology and peak flow tables, so they are
+ready before the first request asks for them.
+
+ECMWF watersheds are only polled while a browser polls for their events: requests touch a file under
+events/subscriptions/ and the watcher polls the pairs touched in the last SUBSCRIPTION_SECONDS. Events carry diffs
+only (the added warning features and the keys of the removed ones).
+"""
+import asyncio
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+
+from . import forecast_cycles, upstream
+from .app import Hydroviewer as app
+
+POLL_SECONDS = 60
+WARNING_POLL_SECONDS = 10 * 60
+SUBSCRIPTION_SECONDS = 60 * 60
+# Seconds between two event requests of a browser
+CLIENT_POLL_SECONDS = 30
+# Events sent at most per request; a browser further behind gets the latest ones
+MAX_EVENTS = 100
+# A stream is closed after this long; EventSource reconnects with its Last-Event-ID
+STREAM_SECONDS = 5 * 60
+STREAM_POLL_SECONDS = 2
+HEARTBEAT_SECONDS = 15
+MAX_LOG_BYTES = 1024 * 1024
+KEEP_EVENTS = 200
+WARNING_RETURN_PERIODS = (2, 10, 20)
+LOCAL_MODELS = ('LIS-RAPID', 'HIWAT-RAPID')
+
+_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_]+$')
+_lock = threading.Lock()
+_watcher = None
+# (mtime, state) of the last watcher state file read by this process
+_state = (None, {})
+
+
+def events_dir():
+    return os.path.join(app.get_app_workspace().path, 'events')
+
+
+def _log_path():
+    return os.path.join(events_dir(), 'events.log')
+
+
+def _state_path():
+    return os.path.join(events_dir(), 'state.json')
+
+
+def subscribe(watershed, subbasin):
+    """
+    Marks an ECMWF watershed/subbasin as watched. Names are restricted to letters, digits and underscores.
+    """
+    if not (_NAME_PATTERN.match(watershed) and _NAME_PATTERN.match(subbasin)):
+        raise ValueError('Invalid watershed {0} ({1})'.format(watershed, subbasin))
+    directory = os.path.join(events_dir(), 'subscriptions')
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, '{0}--{1}'.format(watershed, subbasin))
+    with open(path, 'a'):
+        os.utime(path, None)
+
+
+def subscriptions(now=None):
+    """
+    (watershed, subbasin) pairs subscribed to in the last SUBSCRIPTION_SECONDS.
+    """
+    directory = os.path.join(events_dir(), 'subscriptions')
+    if not os.path.isdir(directory):
+        return []
+    now = now or time.time()
+    pairs = []
+    for name in sorted(os.listdir(directory)):
+        watershed, _, subbasin = name.partition('--')
+        try:
+            recent = now - os.path.getmtime(os.path.join(directory, name)) < SUBSCRIPTION_SECONDS
+        except OSError:
+            continue
+        if recent and subbasin:
+            pairs.append((watershed, subbasin))
+    return pairs
+
+
+def read_events(after_id=0):
+    """
+    Events of the log with an id above after_id, oldest first.
+    """
+    try:
+        with open(_log_path(), 'r') as f:
+            lines = f.readlines()
+    except (IOError, OSError):
+        return []
+    events = []
+    for line in lines:
+        try:
+            event = json.loads(line)
+        except ValueError:
+            # A line still being written
+            continue
+        if event['id'] > after_id:
+            events.append(event)
+    return events
+
+
+def last_event_id():
+    events = read_events()
+    return events[-1]['id'] if events else 0
+
+
+def append_event(name, data):
+    """
+    Appends an event to the log and returns its id. Only the watcher writes to the log.
+    """
+    event = {'id': last_event_id() + 1, 'event': name, 'data': data, 'time': int(time.time())}
+    directory = events_dir()
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    path = _log_path()
+    with open(path, 'a') as f:
+        f.write(json.dumps(event) + '\n')
+    if os.path.getsize(path) > MAX_LOG_BYTES:
+        kept = read_events()[-KEEP_EVENTS:]
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.writelines(json.dumps(e) + '\n' for e in kept)
+        os.replace(tmp, path)
+    return event['id']
+
+
+def poll(after_id=None):
+    """
+    {'events', 'last_id', 'poll'} of the events after after_id (none when None, the browser's first request), at
+    most MAX_EVENTS of them, and the seconds until the next request.
+    """
+    ensure_watcher()
+    if after_id is None:
+        found = []
+        last_id = last_event_id()
+    else:
+        found = read_events(after_id)[-MAX_EVENTS:]
+        last_id = found[-1]['id'] if found else after_id
+    return {'events': [{'id': e['id'], 'event': e['event'], 'data': e['data']} for e in found],
+            'last_id': last_id, 'poll': CLIENT_POLL_SECONDS}
+
+
+def can_stream(request):
+    """
+    True when request is served over ASGI by Django 4.2 or later, which streams async generators without holding a
+    worker thread.
+    """
+    import django
+
+    try:
+        from django.core.handlers.asgi import ASGIRequest
+    except ImportError:
+        return False
+    return django.VERSION >= (4, 2) and isinstance(request, ASGIRequest)
+
+
+def format_event(event):
+    """
+    An event in the text/event-stream format.
+    """
+    return 'id: {0}\nevent: {1}\ndata: {2}\n\n'.format(event['id'], event['event'], json.dumps(event['data']))
+
+
+async def stream(after_id=None, duration=STREAM_SECONDS):
+    """
+    Async generator of the text/event-stream of the events after after_id (all new events when None). Stops after
+    duration seconds. The log is only read again when its size changes, in a thread.
+    """
+    from asgiref.sync import sync_to_async
+
+    await sync_to_async(ensure_watcher)()
+    path = await sync_to_async(_log_path)()
+    if after_id is None:
+        after_id = await sync_to_async(last_event_id)()
+    yield 'retry: {0}\n\n'.format(int(STREAM_POLL_SECONDS * 1000))
+
+    started = last_sent = time.time()
+    size = None
+    while time.time() - started < duration:
+        try:
+            current = os.path.getsize(path)
+        except OSError:
+            current = 0
+        if current != size:
+            size = current
+            for event in (await sync_to_async(read_events)(after_id))[-MAX_EVENTS:]:
+                after_id = event['id']
+                last_sent = time.time()
+                yield format_event(event)
+        if time.time() - last_sent >= HEARTBEAT_SECONDS:
+            last_sent = time.time()
+            yield ': heartbeat\n\n'
+        await asyncio.sleep(STREAM_POLL_SECONDS)
+        await sync_to_async(ensure_watcher)()
+
+
+def watcher_state():
+    """
+    The state last saved by the watcher, read again only when the file changes.
+    """
+    global _state
+    try:
+        mtime = os.path.getmtime(_state_path())
+    except OSError:
+        return {}
+    if _state[0] != mtime:
+        try:
+            with open(_state_path()) as f:
+                _state = (mtime, json.load(f))
+        except (IOError, OSError, ValueError):
+            return _state[1]
+    return _state[1]
+
+
+def announced_cycle(watershed=None, subbasin=None):
+    """
+    The newest forecast cycle the watcher has seen for a watershed/subbasin, or over every watched one (GEOGLOWS
+    runs all reaches in the same cycle) when watershed is None. None when it has seen none.
+    """
+    cycles = watcher_state().get('cycles', {})
+    if watershed is not None:
+        return cycles.get('{0}--{1}'.format(watershed, subbasin))
+    return max(cycles.values(), key=forecast_cycles.cycle_key) if cycles else None
+
+
+def warnings_version(watershed, subbasin):
+    """
+    Id of the last warnings event of a watershed/subbasin, None before the first one.
+    """
+    return watcher_state().get('warnings_event', {}).get('{0}--{1}'.format(watershed, subbasin))
+
+
+def ensure_watcher():
+    """
+    Starts the watcher thread in this process if no process on the host runs one.
+    """
+    global _watcher
+    with _lock:
+        if _watcher is not None:
+            return
+        directory = events_dir()
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        lock_file = open(os.path.join(directory, 'watcher.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            lock_file.close()
+            return
+        # The lock is held, through lock_file, for the life of the process
+        _watcher = Watcher(lock_file)
+        threading.Thread(target=_watcher.run, name='events-watcher', daemon=True).start()
+
+
+class Watcher(object):
+    """
+    Polls the subscribed ECMWF watersheds and the LIS/HIWAT folders and logs what changed since the last poll. The
+    state is saved after every poll, so a watcher taking over from another one continues from there.
+    """
+
+    def __init__(self, lock_file=None):
+        self.lock_file = lock_file
+        self.state_path = _state_path()
+        try:
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.state = {}
+        for name in ('cycles', 'warnings', 'warnings_checked', 'warnings_event', 'files'):
+            self.state.setdefault(name, {})
+
+    def run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                print('Polling for events failed: {0}'.format(e))
+            time.sleep(POLL_SECONDS)
+
+    def poll(self):
+        for watershed, subbasin in subscriptions():
+            try:
+                self.poll_ecmwf(watershed, subbasin)
+            except Exception as e:
+                print('Polling {0} ({1}) for events failed: {2}'.format(watershed, subbasin, e))
+        for model in LOCAL_MODELS:
+            self.poll_files(model)
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_path)
+
+    def poll_ecmwf(self, watershed, subbasin):
+        key = '{0}--{1}'.format(watershed, subbasin)
+        catalogue = forecast_cycles.refresh(watershed, subbasin)
+        latest = catalogue.latest()
+        new_cycle = latest is not None and latest != self.state['cycles'].get(key)
+        if new_cycle:
+            if key in self.state['cycles']:
+                append_event('cycle', {'model': 'ECMWF-RAPID', 'watershed': watershed, 'subbasin': subbasin,
+                                       'cycle': latest, 'label': catalogue.labels[-1]})
+            self.state['cycles'][key] = latest
+
+        if new_cycle or time.time() - self.state['warnings_checked'].get(key, 0) > WARNING_POLL_SECONDS:
+            self.poll_warnings(key, watershed, subbasin)
+
+    def poll_warnings(self, key, watershed, subbasin):
+        previous = self.state['warnings'].get(key)
+        current, diff, changed = {}, {}, False
+        for return_period in WARNING_RETURN_PERIODS:
+            features = upstream.warning_points(watershed, subbasin, return_period)
+            keyed = {warning_key(feature): feature for feature in features}
+            current[str(return_period)] = sorted(keyed)
+            old = set(previous.get(str(return_period), [])) if previous is not None else set()
+            added = [keyed[k] for k in sorted(set(keyed) - old)]
+            removed = sorted(old - set(keyed))
+            diff[str(return_period)] = {'added': added, 'removed': removed}
+            changed = changed or bool(added or removed)
+        if previous is not None and changed:
+            self.state['warnings_event'][key] = append_event(
+                'warnings', {'model': 'ECMWF-RAPID', 'watershed': watershed, 'subbasin': subbasin,
+                             'return_periods': diff})
+        self.state['warnings'][key] = current
+        self.state['warnings_checked'][key] = time.time()
+
+    def poll_files(self, model):
+        from . import qout
+
+        root = app.get_custom_setting(qout.MODEL_PATH_SETTINGS[model])
+        if not root or not os.path.isdir(root):
+            return
+        for folder in sorted(os.listdir(root)):
+            watershed, _, subbasin = folder.partition('-')
+            try:
+                path = qout.qout_path(model, watershed, subbasin)
+                stat = os.stat(path)
+            except (IndexError, OSError):
+                continue
+            key = '{0}:{1}'.format(model, folder)
+            version = [os.path.basename(path), stat.st_mtime, stat.st_size]
+            if version != self.state['files'].get(key):
+                precompute(path)
+                if key in self.state['files']:
+                    append_event('file', {'model': model, 'watershed': watershed, 'subbasin': subbasin,
+                                          'file': version[0], 'modified': int(stat.st_mtime)})
+                self.state['files'][key] = version
+
+
+def precompute(path):
+    """
+    Starts computing the per-file tables of a new Qout file in the background, ahead of the first request.
+    """
+    from . import climatology, local_return_periods, peak_flows
+
+    for tables in (local_return_periods.tables, climatology.tables, peak_flows.tables):
+        tables.get(path)
+
+
+def warning_key(feature):
+    """
+    Identifies a warning point by its comid, or by its coordinates when it has none.
+    """
+    properties = feature.get('properties') or {}
+    for name in ('comid', 'COMID', 'rivid'):
+        if name in properties:
+            return str(properties[name])
+    lon, lat = feature['geometry']['coordinates'][:2]
+    return '{0:.5f},{1:.5f}'.format(lon, lat)
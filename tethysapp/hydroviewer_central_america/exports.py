@@ -0,0 +1,407 @@
+"""
+Bulk export jobs.
+
+A job exports the ECMWF forecast or historic simulation, or the LIS/HIWAT Qout series, of every reach in a COMID
+list, a watershed or a region into a single file in the app workspace: a zip of csv files, one NetCDF file or one
+Parquet table. Jobs run on a small worker pool and write their status next to their output, so any worker process
+can report progress and serve the result. Jobs are removed RETENTION_SECONDS after they finished (or, for jobs that
+never finished, after they were created) by the sweep that runs whenever a job is submitted.
+"""
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+import netCDF4 as nc
+import numpy as np
+import pandas as pd
+from requests.auth import HTTPBasicAuth
+
+from . import qout, upstream
+from .app import Hydroviewer as app
+
+FORMAT_EXTENSIONS = {'csv': 'zip', 'netcdf': 'nc', 'parquet': 'parquet'}
+MODEL_PRODUCTS = {
+    'ECMWF-RAPID': ('forecast', 'historic'),
+    'LIS-RAPID': ('forecast',),
+    'HIWAT-RAPID': ('forecast',),
+}
+MAX_REACHES = 20000
+JOB_WORKERS = 2
+FETCH_WORKERS = 8
+# Reaches written per Parquet row group
+PARQUET_BATCH = 200
+# Minimum seconds between two progress updates of the status file
+STATUS_INTERVAL = 1.0
+RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+_jobs = ThreadPoolExecutor(max_workers=JOB_WORKERS)
+
+
+class ExportError(Exception):
+    pass
+
+
+def exports_dir():
+    return os.path.join(app.get_app_workspace().path, 'exports')
+
+
+def submit(model, product, fmt, comids=None, watershed=None, subbasin=None, region=None):
+    """
+    Validates an export request, queues it and returns the initial job status. Raises ExportError for invalid
+    requests.
+    """
+    if model not in MODEL_PRODUCTS:
+        raise ExportError('Unknown model {0}.'.format(model))
+    if product not in MODEL_PRODUCTS[model]:
+        raise ExportError('{0} exports support the products: {1}.'.format(model, ', '.join(MODEL_PRODUCTS[model])))
+    if fmt not in FORMAT_EXTENSIONS:
+        raise ExportError('Unknown format {0}, use one of: {1}.'.format(fmt, ', '.join(sorted(FORMAT_EXTENSIONS))))
+    if fmt == 'parquet':
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise ExportError('Parquet exports require pyarrow to be installed.')
+    if not comids and not region and not (watershed and subbasin):
+        raise ExportError('Provide comids, a region, or a watershed and subbasin.')
+    if region and model != 'ECMWF-RAPID':
+        raise ExportError('Region exports are only available for ECMWF-RAPID.')
+    if comids and len(comids) > MAX_REACHES:
+        raise ExportError('Exports are limited to {0} reaches.'.format(MAX_REACHES))
+
+    sweep()
+    job_id = uuid.uuid4().hex
+    status = {
+        'job_id': job_id,
+        'state': 'queued',
+        'model': model,
+        'product': product,
+        'format': fmt,
+        'total': len(comids) if comids else None,
+        'completed': 0,
+        'failed': 0,
+        'created': time.time(),
+        'finished': None,
+        'error': None,
+        'filename': None,
+    }
+    os.makedirs(os.path.join(exports_dir(), job_id))
+    _write_status(status)
+
+    spec = {'model': model, 'product': product, 'format': fmt, 'comids': comids,
+            'watershed': watershed, 'subbasin': subbasin, 'region': region}
+    _jobs.submit(_run, status, spec)
+    return status
+
+
+def job_status(job_id):
+    """
+    Returns the status of a job, or None if there is no such job.
+    """
+    if not re.match(r'^[0-9a-f]{32}$', job_id or ''):
+        return None
+    try:
+        with open(os.path.join(exports_dir(), job_id, 'status.json')) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def sweep(max_age=RETENTION_SECONDS, now=None):
+    """
+    Removes the jobs that finished, or were created if they never finished, more than max_age seconds ago. Returns
+    the ids of the removed jobs.
+    """
+    now = time.time() if now is None else now
+    try:
+        job_ids = [name for name in os.listdir(exports_dir()) if re.match(r'^[0-9a-f]{32}$', name)]
+    except OSError:
+        return []
+    removed = []
+    for job_id in job_ids:
+        directory = os.path.join(exports_dir(), job_id)
+        status = job_status(job_id)
+        if status is not None:
+            since = status['finished'] or status['created']
+        else:
+            # A job whose status was never written or cannot be read
+            since = os.path.getmtime(directory)
+        if now - since > max_age:
+            shutil.rmtree(directory, ignore_errors=True)
+            removed.append(job_id)
+    return removed
+
+
+def result_path(status):
+    return os.path.join(exports_dir(), status['job_id'], status['filename'])
+
+
+def _write_status(status):
+    path = os.path.join(exports_dir(), status['job_id'], 'status.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(status, f)
+    os.replace(path + '.tmp', path)
+
+
+def _run(status, spec):
+    status['state'] = 'running'
+    _write_status(status)
+    filename = 'export_{0}_{1}.{2}'.format(spec['model'].split('-')[0].lower(), spec['product'],
+                                          FORMAT_EXTENSIONS[spec['format']])
+    path = os.path.join(exports_dir(), status['job_id'], filename)
+    try:
+        comids = spec['comids'] or _resolve_comids(spec)
+        if len(comids) > MAX_REACHES:
+            raise ExportError('The selection has {0} reaches; exports are limited to {1}.'.format(len(comids),
+                                                                                                 MAX_REACHES))
+        status['total'] = len(comids)
+        _write_status(status)
+
+        writer = WRITERS[spec['format']](path + '.part')
+        last_update = time.time()
+        try:
+            for comid, frame in _iter_frames(spec, comids, status):
+                writer.write(comid, frame)
+                status['completed'] += 1
+                if time.time() - last_update > STATUS_INTERVAL:
+                    _write_status(status)
+                    last_update = time.time()
+        finally:
+            writer.close()
+
+        if not status['completed']:
+            raise ExportError('No data found for the selected reaches.')
+        os.replace(path + '.part', path)
+        status.update({'state': 'done', 'filename': filename})
+    except Exception as e:
+        print(str(e))
+        status.update({'state': 'failed', 'error': str(e)})
+        if os.path.exists(path + '.part'):
+            os.remove(path + '.part')
+    status['finished'] = time.time()
+    _write_status(status)
+
+
+def _resolve_comids(spec):
+    if spec['model'] != 'ECMWF-RAPID':
+        return [int(r) for r in qout.read_rivids(qout.qout_path(spec['model'], spec['watershed'], spec['subbasin']))]
+    if spec['region']:
+        return _geoserver_comids(bbox=_region_bbox(spec['region']))
+    return _geoserver_comids(layer=_watershed_layer(spec['watershed'], spec['subbasin']))
+
+
+def _watershed_layer(watershed, subbasin):
+    """
+    Name of the drainage line feature type of an ECMWF watershed/subbasin in the app's Geoserver workspace, found as
+    the watershed list of the ECMWF page finds them.
+    """
+    geoserver_engine = app.get_spatial_dataset_service(name='main_geoserver', as_engine=True)
+    workspace = app.get_custom_setting('workspace')
+    res = upstream.geoserver_get(geoserver_engine.endpoint.replace('rest', '') + 'rest/workspaces/' + workspace +
+                                 '/featuretypes.json',
+                                 auth=HTTPBasicAuth(geoserver_engine.username, geoserver_engine.password))
+    prefix = '{0}-{1}'.format(watershed, subbasin).lower()
+    for feature_type in json.loads(res.content)['featureTypes']['featureType']:
+        name = feature_type['name']
+        if 'drainage_line' in name and name.lower().startswith(prefix):
+            return name
+    raise ExportError('No drainage lines found for {0} ({1}).'.format(watershed, subbasin))
+
+
+def _region_bbox(region):
+    """
+    Bounding box (minx, miny, maxx, maxy) of the geojsons of a region in public/geojson/index.json.
+    """
+    geojson_dir = os.path.join(os.path.dirname(__file__), 'public', 'geojson')
+    with open(os.path.join(geojson_dir, 'index.json')) as f:
+        region_index = json.load(f)
+    if region not in region_index:
+        raise ExportError('Unknown region {0}.'.format(region))
+
+    xs, ys = [], []
+    for geojson in region_index[region]['geojsons']:
+        with open(os.path.join(geojson_dir, geojson)) as f:
+            data = json.load(f)
+        features = data['features'] if data.get('type') == 'FeatureCollection' else [data]
+        for feature in features:
+            coords = np.array(list(_flatten_coordinates(feature['geometry']['coordinates'])))
+            xs.extend((coords[:, 0].min(), coords[:, 0].max()))
+            ys.extend((coords[:, 1].min(), coords[:, 1].max()))
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _flatten_coordinates(coordinates):
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        yield coordinates[:2]
+    else:
+        for part in coordinates:
+            for point in _flatten_coordinates(part):
+                yield point
+
+
+def _geoserver_comids(bbox=None, layer=None):
+    """
+    COMIDs of a drainage line layer (the layer_name setting by default), optionally only those within a lon/lat
+    bounding box.
+    """
+    geoserver_engine = app.get_spatial_dataset_service(name='main_geoserver', as_engine=True)
+    params = {
+        'service': 'WFS',
+        'version': '1.1.0',
+        'request': 'GetFeature',
+        'typeName': app.get_custom_setting('workspace') + ':' + (layer or app.get_custom_setting('layer_name')),
+        'propertyName': 'COMID',
+        'outputFormat': 'application/json',
+    }
+    if bbox:
+        params['bbox'] = ','.join(str(v) for v in bbox) + ',EPSG:4326'
+    res = upstream.geoserver_get(geoserver_engine.endpoint.replace('rest', '') + 'wfs', params=params)
+    return sorted({int(f['properties']['COMID']) for f in res.json()['features']})
+
+
+def _iter_frames(spec, comids, status):
+    """
+    Yields (comid, DataFrame indexed by datetime) for every reach that could be read.
+    """
+    if spec['model'] != 'ECMWF-RAPID':
+        path = qout.qout_path(spec['model'], spec['watershed'], spec['subbasin'])
+        found, index = 0, None
+        for times, rivids, flows in qout.read_reach_blocks(path, comids):
+            if index is None:
+                index = pd.DatetimeIndex(pd.to_datetime(times, unit='s'), name='datetime')
+            found += len(rivids)
+            for j, rivid in enumerate(rivids):
+                yield int(rivid), pd.DataFrame({'flow (m3/s)': flows[:, j]}, index=index)
+        status['failed'] = len(comids) - found
+        return
+
+    fetch = upstream.forecast_stats if spec['product'] == 'forecast' else upstream.historic_simulation
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        # Keep a bounded window of requests in flight so finished frames do not pile up in memory
+        pending = {}
+        remaining = iter(comids)
+        for comid in islice(remaining, FETCH_WORKERS * 2):
+            pending[pool.submit(fetch, comid)] = comid
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                comid = pending.pop(future)
+                for next_comid in islice(remaining, 1):
+                    pending[pool.submit(fetch, next_comid)] = next_comid
+                try:
+                    frame = future.result()
+                except Exception as e:
+                    print('Export of reach {0} failed: {1}'.format(comid, e))
+                    status['failed'] += 1
+                    continue
+                frame.index.name = 'datetime'
+                yield comid, frame
+
+
+class CsvZipWriter(object):
+    """
+    One csv file per reach in a zip archive.
+    """
+
+    def __init__(self, path):
+        self.archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+
+    def write(self, comid, frame):
+        self.archive.writestr('{0}.csv'.format(comid), frame.to_csv())
+
+    def close(self):
+        self.archive.close()
+
+
+class NetcdfWriter(object):
+    """
+    A single NetCDF file with one (rivid, time) variable per data column. The time axis is taken from the first
+    reach written; later reaches are aligned to it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dataset = None
+        self.row = 0
+
+    def write(self, comid, frame):
+        # See qout.HDF5_LOCK
+        with qout.HDF5_LOCK:
+            if self.dataset is None:
+                self._create(frame)
+            frame = frame.reindex(self.index)
+            self.dataset.variables['rivid'][self.row] = int(comid)
+            for column, name in self.columns:
+                self.dataset.variables[name][self.row, :] = frame[column].values.astype('f4')
+        self.row += 1
+
+    def _create(self, frame):
+        self.index = frame.index
+        self.dataset = nc.Dataset(self.path, 'w', format='NETCDF4')
+        self.dataset.createDimension('rivid', None)
+        self.dataset.createDimension('time', len(self.index))
+
+        rivid = self.dataset.createVariable('rivid', 'i8', ('rivid',))
+        rivid.long_name = 'unique identifier for each river reach'
+        time_var = self.dataset.createVariable('time', 'i8', ('time',))
+        time_var.units = 'seconds since 1970-01-01 00:00:00'
+        time_var[:] = self.index.values.astype('datetime64[s]').astype('i8')
+
+        self.columns = []
+        for column in frame.columns:
+            name = re.sub(r'[^0-9a-zA-Z_]+', '_', str(column)).strip('_')
+            variable = self.dataset.createVariable(name, 'f4', ('rivid', 'time'), zlib=True, fill_value=np.nan)
+            variable.long_name = str(column)
+            self.columns.append((column, name))
+
+    def close(self):
+        if self.dataset is not None:
+            with qout.HDF5_LOCK:
+                self.dataset.close()
+
+
+class ParquetWriter(object):
+    """
+    A single long-format Parquet table (comid, datetime, data columns), written one row group per batch of reaches.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.batch = []
+        self.writer = None
+
+    def write(self, comid, frame):
+        frame = frame.reset_index()
+        frame.insert(0, 'comid', int(comid))
+        self.batch.append(frame)
+        if len(self.batch) >= PARQUET_BATCH:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self.batch:
+            return
+        table = pa.Table.from_pandas(pd.concat(self.batch, ignore_index=True), preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema, compression='snappy')
+        self.writer.write_table(table.cast(self.writer.schema))
+        self.batch = []
+
+    def close(self):
+        self._flush()
+        if self.writer is not None:
+            self.writer.close()
+
+
+WRITERS = {
+    'csv': CsvZipWriter,
+    'netcdf': NetcdfWriter,
+    'parquet': ParquetWriter,
+}
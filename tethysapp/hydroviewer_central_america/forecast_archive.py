@@ -0,0 +1,143 @@
+"""
+Append-only archive of the GEOGLOWS forecast stats of each reach, one record per forecast cycle.
+
+Every ForecastStats response fetched for a reach is appended to <workspace>/forecast_archive/<bucket>/<comid>.dat
+as a zlib-compressed record (the time offsets from the cycle start as int32 and the stats as float32), unless that
+cycle is already archived. <comid>.idx holds one fixed-size (cycle, offset, length) entry per record, so the last N
+cycles of a reach are located from the end of the index and read from the data file in a single read.
+
+Cycles older than RETENTION_DAYS are dropped by rewriting the files once at least COMPACT_MIN of them have expired.
+Appends and compactions hold an exclusive lock on the index file, so several worker processes can share the
+archive.
+"""
+import fcntl
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from .app import Hydroviewer as app
+
+COLUMNS = ('flow_max_m^3/s', 'flow_75%_m^3/s', 'flow_avg_m^3/s', 'flow_25%_m^3/s', 'flow_min_m^3/s',
+           'high_res_m^3/s')
+RETENTION_DAYS = 90
+COMPACT_MIN = 7
+MAX_CYCLES = 60
+# Reach files are spread over this many directories
+BUCKETS = 256
+
+_INDEX_ENTRY = struct.Struct('<qqq')
+_RECORD_HEADER = struct.Struct('<qii')
+
+
+def archive_dir():
+    return os.path.join(app.get_app_workspace().path, 'forecast_archive')
+
+
+def _paths(comid):
+    directory = os.path.join(archive_dir(), '{0:03d}'.format(comid % BUCKETS))
+    base = os.path.join(directory, str(comid))
+    return directory, base + '.idx', base + '.dat'
+
+
+def append(comid, stats):
+    """
+    Archives a forecast_stats DataFrame of a reach. Returns False when its cycle was already archived.
+    """
+    comid = int(comid)
+    times = stats.index.values.astype('datetime64[s]').astype('i8')
+    if not len(times):
+        return False
+    cycle = int(times[0])
+    values = stats.reindex(columns=list(COLUMNS)).values.astype('f4')
+    record = zlib.compress(_RECORD_HEADER.pack(cycle, len(times), len(COLUMNS)) +
+                           (times - cycle).astype('<i4').tobytes() + values.astype('<f4').tobytes(), 6)
+
+    directory, index_path, data_path = _paths(comid)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    with open(index_path, 'a+b') as index:
+        fcntl.flock(index, fcntl.LOCK_EX)
+        entries = _entries(index)
+        if entries and entries[-1][0] >= cycle:
+            return False
+        # Drop a partial entry left by an interrupted append
+        index.truncate(len(entries) * _INDEX_ENTRY.size)
+        with open(data_path, 'ab') as data:
+            offset = data.tell()
+            data.write(record)
+        index.write(_INDEX_ENTRY.pack(cycle, offset, len(record)))
+        index.flush()
+
+        expired = [e for e in entries if e[0] < time.time() - RETENTION_DAYS * 86400]
+        if len(expired) >= COMPACT_MIN:
+            _compact(index, data_path, len(expired))
+    return True
+
+
+def last_cycles(comid, n):
+    """
+    Returns the last n archived cycles of a reach, oldest first, as a list of (cycle, times, values): the cycle
+    start as datetime64[s], the times as datetime64[s] and a float32 (time, column) array of the COLUMNS.
+    """
+    directory, index_path, data_path = _paths(int(comid))
+    try:
+        with open(index_path, 'rb') as index:
+            # A shared lock keeps a compaction from swapping the files between the two reads
+            fcntl.flock(index, fcntl.LOCK_SH)
+            size = index.seek(0, os.SEEK_END)
+            count = min(n, size // _INDEX_ENTRY.size)
+            if count <= 0:
+                return []
+            index.seek(size - size % _INDEX_ENTRY.size - count * _INDEX_ENTRY.size)
+            entries = list(_INDEX_ENTRY.iter_unpack(index.read(count * _INDEX_ENTRY.size)))
+            with open(data_path, 'rb') as data:
+                start = entries[0][1]
+                data.seek(start)
+                chunk = data.read(entries[-1][1] + entries[-1][2] - start)
+    except (IOError, OSError):
+        return []
+
+    cycles = []
+    for cycle, offset, length in entries:
+        raw = zlib.decompress(chunk[offset - start:offset - start + length])
+        _, n_steps, n_columns = _RECORD_HEADER.unpack_from(raw)
+        offsets = np.frombuffer(raw, dtype='<i4', count=n_steps, offset=_RECORD_HEADER.size)
+        values = np.frombuffer(raw, dtype='<f4', offset=_RECORD_HEADER.size + 4 * n_steps).reshape(n_steps,
+                                                                                                   n_columns)
+        cycles.append((np.datetime64(cycle, 's'), np.datetime64(cycle, 's') + offsets.astype('timedelta64[s]'),
+                       values))
+    return cycles
+
+
+def _entries(index):
+    index.seek(0)
+    raw = index.read()
+    raw = raw[:len(raw) - len(raw) % _INDEX_ENTRY.size]
+    return list(_INDEX_ENTRY.iter_unpack(raw))
+
+
+def _compact(index, data_path, n_expired):
+    """
+    Rewrites the data and index files without the first n_expired records. The caller holds the index lock.
+    """
+    entries = _entries(index)[n_expired:]
+    with open(data_path, 'rb') as data:
+        records = []
+        for _, offset, length in entries:
+            data.seek(offset)
+            records.append(data.read(length))
+
+    tmp = data_path + '.tmp'
+    new_entries = []
+    with open(tmp, 'wb') as data:
+        for (cycle, _, length), record in zip(entries, records):
+            new_entries.append(_INDEX_ENTRY.pack(cycle, data.tell(), length))
+            data.write(record)
+    os.replace(tmp, data_path)
+    index.seek(0)
+    index.truncate()
+    index.write(b''.join(new_entries))
+    index.flush()
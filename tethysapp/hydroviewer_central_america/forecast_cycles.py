@@ -0,0 +1,111 @@
+"""
+Catalogue of the forecast cycles the SPT API has for a watershed/subbasin.
+
+The SPT GetAvailableDates response is parsed once into a sorted index and kept in the payload cache; the date
+dropdown and range queries are then answered from memory with a binary search. An expired catalogue keeps being
+served while it is rebuilt in the background, which is how a newly published cycle appears.
+"""
+import calendar
+import time
+from bisect import bisect_left, bisect_right
+
+from . import cache, upstream
+
+CATALOGUE_TTL = 10 * 60
+
+
+class CycleCatalogue(object):
+    """
+    Sorted forecast cycles: keys are the cycles as YYYYMMDDHHMM integers, names the SPT folder names
+    (e.g. 20200101.0 or 20200101.1200) and labels the cycles as 'YYYY-MM-DD HH:MM'.
+    """
+
+    def __init__(self, names):
+        entries = sorted((cycle_key(name), name) for name in set(names))
+        self.keys = [key for key, _ in entries]
+        self.names = [name for _, name in entries]
+        self.labels = [cycle_label(key) for key in self.keys]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, name):
+        try:
+            key = cycle_key(name)
+        except ValueError:
+            return False
+        i = bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def latest(self):
+        return self.names[-1] if self.names else None
+
+    def between(self, start=None, end=None, limit=None):
+        """
+        Returns [(label, name)] of the cycles from start to end (inclusive, as YYYYMMDD[HHMM] integers), newest
+        first, at most limit of them.
+        """
+        lo = bisect_left(self.keys, _bound(start, 0)) if start is not None else 0
+        hi = bisect_right(self.keys, _bound(end, 2359)) if end is not None else len(self.keys)
+        if limit is not None:
+            lo = max(lo, hi - limit)
+        return [(self.labels[i], self.names[i]) for i in range(hi - 1, lo - 1, -1)]
+
+
+def cycle_key(name):
+    """
+    YYYYMMDDHHMM integer of an SPT folder name: 20200101.0 -> 202001010000, 20200101.1200 -> 202001011200.
+    """
+    day, _, hour = str(name).partition('.')
+    if len(day) != 8 or not day.isdigit() or not hour.isdigit():
+        raise ValueError('Invalid forecast cycle {0}'.format(name))
+    return int(day) * 10000 + int(hour.ljust(4, '0')[:4])
+
+
+def cycle_time(name):
+    """
+    Seconds since the epoch (UTC) at which a forecast cycle starts, None when name is None.
+    """
+    if name is None:
+        return None
+    return calendar.timegm(time.strptime(str(cycle_key(name)), '%Y%m%d%H%M'))
+
+
+def cycle_label(key):
+    text = str(key)
+    return '{0}-{1}-{2} {3}:{4}'.format(text[:4], text[4:6], text[6:8], text[8:10], text[10:12])
+
+
+def _bound(value, default_time):
+    value = int(value)
+    return value * 10000 + default_time if value < 10 ** 8 else value
+
+
+def catalogue(watershed, subbasin, announced=None):
+    """
+    The CycleCatalogue of a watershed/subbasin, from the cache when possible. announced is the newest cycle known to
+    be published (see events.announced_cycle()): a cached catalogue without it is replaced by the copy the events
+    watcher shared, or fetched again.
+    """
+    key = ('forecast_cycles', watershed, subbasin)
+    value, _ = cache.get(key, lambda: _build(watershed, subbasin), CATALOGUE_TTL)
+    if announced is not None and announced not in value:
+        cache.invalidate_local(key)
+        value, _ = cache.get(key, lambda: _build(watershed, subbasin), CATALOGUE_TTL)
+        if announced not in value:
+            value = refresh(watershed, subbasin)
+    return value
+
+
+def refresh(watershed, subbasin):
+    """
+    Fetches the catalogue of a watershed/subbasin now, replacing the cached one, and returns it.
+    """
+    value = _build(watershed, subbasin)
+    cache.put(('forecast_cycles', watershed, subbasin), value)
+    return value
+
+
+def _build(watershed, subbasin):
+    res = upstream.spt_get('GetAvailableDates', {'watershed_name': watershed, 'subbasin_name': subbasin})
+    return CycleCatalogue(res.json())
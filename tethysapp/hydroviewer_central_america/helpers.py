@@ -6,3 +6,35 @@ def switch_model(x):
     }.get(x, 'invalid') 
 
 
+
+
+def replace_csv_header(chunks, header, on_close=None):
+    """
+    Reads a csv byte stream only as far as its first data row and returns (first_row, stream), where stream yields
+    the new header line (terminated like the original one) followed by the original body, chunk by chunk. on_close
+    is called once the stream is done or abandoned.
+    """
+    chunks = iter(chunks)
+    buffered = b''
+    for chunk in chunks:
+        buffered += chunk
+        if buffered.count(b'\n') >= 2:
+            break
+
+    header_end = buffered.find(b'\n')
+    body = buffered[header_end + 1:] if header_end >= 0 else b''
+    newline = b'\r\n' if buffered[header_end - 1:header_end] == b'\r' else b'\n'
+    first_row = body.split(b'\n', 1)[0].rstrip(b'\r').decode('utf-8', 'replace')
+
+    def stream():
+        try:
+            yield header.encode('utf-8') + newline
+            if body:
+                yield body
+            for chunk in chunks:
+                yield chunk
+        finally:
+            if on_close is not None:
+                on_close()
+
+    return first_row, stream()
@@ -0,0 +1,174 @@
+"""
+Validators and compression of the data responses.
+
+Payloads kept in the payload cache are serialized once, when they are built, into a Body holding the content hash
+(the ETag) and the build time (the Last-Modified date). A request whose If-None-Match or If-Modified-Since still
+matches is answered with a 304 before any response body is assembled. Charts drawn from a Qout file use validators
+derived from the file's mtime and size instead, which are known before the file is read.
+
+Bodies of at least MIN_COMPRESS_SIZE bytes are sent brotli (when the brotli package is installed) or gzip
+compressed, as the client accepts; a Body keeps its compressed copies so a cached payload is only compressed once.
+"""
+import gzip
+import hashlib
+import os
+import time
+from email.utils import formatdate, mktime_tz, parsedate_tz
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_SIZE = 1024
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+# Browsers keep the responses but revalidate them on every use
+CACHE_CONTROL = 'private, no-cache'
+
+
+class Body(object):
+    """
+    A serialized response body with its validators and compressed copies.
+    """
+
+    def __init__(self, content, content_type='application/json', modified=None):
+        self.content = content
+        self.content_type = content_type
+        self.etag = etag(hashlib.sha1(content).hexdigest())
+        self.modified = time.time() if modified is None else modified
+        self._encoded = {}
+
+    def __getstate__(self):
+        # Compressed copies are cheap to redo and would not compress again in a snapshot
+        return dict(self.__dict__, _encoded={})
+
+    def encoded(self, encoding):
+        if encoding is None or len(self.content) < MIN_COMPRESS_SIZE:
+            return self.content, None
+        if encoding not in self._encoded:
+            self._encoded[encoding] = _compress(self.content, encoding)
+        return self._encoded[encoding], encoding
+
+
+def etag(*parts):
+    """
+    Weak ETag of the given parts. Weak because the same ETag is sent for every content encoding.
+    """
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:24]
+    return 'W/"{0}"'.format(digest)
+
+
+def stale_etag(tag, age):
+    """
+    ETag of a stale-flagged copy of the body tagged tag, served age seconds after it expired. It never matches the
+    ETag of the body itself, so a client holding the flagged copy gets the refreshed body instead of a 304.
+    """
+    return '{0}-stale-{1}"'.format(tag[:-1], int(age))
+
+
+def file_validators(path, *parts):
+    """
+    (ETag, Last-Modified time) of a response computed from a file and the given request parts.
+    """
+    stat = os.stat(path)
+    return etag(path, stat.st_mtime, stat.st_size, *parts), stat.st_mtime
+
+
+def is_not_modified(request, tag, modified):
+    """
+    True when the request's If-None-Match, or If-Modified-Since if there is no If-None-Match, still matches.
+    """
+    meta = getattr(request, 'META', {})
+    if_none_match = meta.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        opaque = _opaque(tag)
+        return any(t == '*' or _opaque(t) == opaque for t in (t.strip() for t in if_none_match.split(',')))
+    if_modified_since = meta.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since and modified is not None:
+        parsed = parsedate_tz(if_modified_since)
+        return parsed is not None and int(modified) <= mktime_tz(parsed)
+    return False
+
+
+def not_modified(request, tag, modified):
+    """
+    A 304 response when the request's validators match, otherwise None.
+    """
+    if not is_not_modified(request, tag, modified):
+        return None
+    from django.http import HttpResponseNotModified
+    return set_validators(HttpResponseNotModified(), tag, modified)
+
+
+def set_validators(response, tag, modified):
+    response['ETag'] = tag
+    if modified is not None:
+        response['Last-Modified'] = formatdate(modified, usegmt=True)
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+def body_response(request, body):
+    """
+    The response of a Body: a 304 when the client's copy is current, otherwise the body in the best encoding the
+    client accepts.
+    """
+    response = not_modified(request, body.etag, body.modified)
+    if response is not None:
+        return response
+    from django.http import HttpResponse
+    content, encoding = body.encoded(accepted_encoding(request))
+    response = HttpResponse(content, content_type=body.content_type)
+    if encoding is not None:
+        response['Content-Encoding'] = encoding
+    _vary(response)
+    return set_validators(response, body.etag, body.modified)
+
+
+def compress(request, response):
+    """
+    Compresses a complete (not streaming) successful response of a compressible type in place.
+    """
+    if (getattr(response, 'streaming', True) or response.status_code != 200 or response.has_header('Content-Encoding')
+            or not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES)):
+        return response
+    _vary(response)
+    encoding = accepted_encoding(request)
+    if encoding is None or len(response.content) < MIN_COMPRESS_SIZE:
+        return response
+    response.content = _compress(response.content, encoding)
+    response['Content-Encoding'] = encoding
+    response['Content-Length'] = str(len(response.content))
+    return response
+
+
+def accepted_encoding(request):
+    """
+    'br' or 'gzip' as accepted by the request's Accept-Encoding header, None for neither.
+    """
+    accepted = set()
+    for item in getattr(request, 'META', {}).get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = item.strip().partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(name.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def _compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=5)
+    return gzip.compress(content, 6)
+
+
+def _opaque(tag):
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def _vary(response):
+    vary = [v.strip() for v in response.get('Vary', '').split(',') if v.strip()]
+    if 'accept-encoding' not in (v.lower() for v in vary):
+        response['Vary'] = ', '.join(vary + ['Accept-Encoding'])
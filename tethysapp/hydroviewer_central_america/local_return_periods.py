@@ -0,0 +1,122 @@
+"""
+Return periods of the LIS and HIWAT reaches, estimated from their own Qout files.
+
+A Gumbel distribution is fitted by the method of moments to the annual maxima of every reach of a file at once: the
+file is read in blocks of CHUNK_STEPS time steps, each block is reduced to per-year maxima with np.fmax.reduceat, and
+the 2, 10 and 20 year flows follow from the mean and standard deviation of the (year, reach) maxima. Only calendar
+years the file covers from start to end are fitted, since the maximum of a partial year is biased low; a file
+needs MIN_YEARS of them.
+
+The resulting table (rivid, max, 2, 10 and 20 year flows) is kept per file (see qout_tables.py), so a chart request
+only looks up its reach. Until the table of a file has been computed, thresholds() returns None and charts have no
+bands.
+"""
+import math
+
+import numpy as np
+
+from . import qout
+from .qout_tables import FileTables
+
+RETURN_PERIODS = (2, 10, 20)
+# Complete calendar years of data needed to fit a distribution
+MIN_YEARS = 2
+CHUNK_STEPS = 2048
+
+
+def gumbel_factor(return_period):
+    """
+    Frequency factor K of the Gumbel distribution: x_T = mean + K * std.
+    """
+    return -math.sqrt(6) / math.pi * (0.5772 + math.log(math.log(return_period / (return_period - 1.0))))
+
+
+def gumbel_flows(annual_maxima, return_periods=RETURN_PERIODS):
+    """
+    Method of moments Gumbel fit per column of a (year, reach) array of annual maxima. Returns a
+    (return period, reach) array of flows.
+    """
+    mean = np.nanmean(annual_maxima, axis=0)
+    std = np.nanstd(annual_maxima, axis=0, ddof=1)
+    factors = np.array([gumbel_factor(rp) for rp in return_periods])
+    return mean[np.newaxis, :] + factors[:, np.newaxis] * std[np.newaxis, :]
+
+
+def complete_years(times):
+    """
+    Boolean mask over the distinct calendar years of a sorted datetime64[s] array: True for the years covered from
+    their first to their last time step.
+    """
+    years = np.unique(times.astype('datetime64[Y]'))
+    if len(times) < 2:
+        return np.zeros(len(years), dtype=bool)
+    step = np.median(np.diff(times.astype('i8')))
+    starts = years.astype('datetime64[s]').astype('i8')
+    ends = (years + 1).astype('datetime64[s]').astype('i8')
+    return (times[0].astype('i8') <= starts + step) & (times[-1].astype('i8') >= ends - step)
+
+
+def annual_maxima(path, chunk_steps=CHUNK_STEPS):
+    """
+    Reads a Qout file in time blocks and returns (rivids, (complete year, reach) annual maxima, overall maxima).
+    """
+    with qout.dataset(path) as res:
+        with qout.HDF5_LOCK:
+            rivids = np.asarray(res.variables['rivid'][:])
+            times = np.asarray(res.variables['time'][:]).astype('datetime64[s]')
+        years = times.astype('datetime64[Y]').astype(int) + 1970
+        all_years = np.unique(years)
+        maxima = np.full((len(all_years), len(rivids)), np.nan)
+
+        qout_var = res.variables['Qout']
+        for lo in range(0, len(times), chunk_steps):
+            hi = min(lo + chunk_steps, len(times))
+            with qout.HDF5_LOCK:
+                block = qout_var[lo:hi, :]
+            block = np.ma.filled(block.astype(float), np.nan)
+            block_years = years[lo:hi]
+            starts = np.flatnonzero(np.r_[True, block_years[1:] != block_years[:-1]])
+            rows = np.searchsorted(all_years, block_years[starts])
+            with np.errstate(invalid='ignore'):
+                maxima[rows] = np.fmax(maxima[rows], np.fmax.reduceat(block, starts, axis=0))
+
+    with np.errstate(invalid='ignore'):
+        overall = np.nanmax(maxima, axis=0) if len(all_years) else np.full(len(rivids), np.nan)
+    return rivids, maxima[complete_years(times)], overall
+
+
+def compute_table(path):
+    """
+    Returns the return period table of a Qout file as a dict of arrays, or None when the file covers fewer than
+    MIN_YEARS complete years.
+    """
+    rivids, maxima, overall = annual_maxima(path)
+    if maxima.shape[0] < MIN_YEARS:
+        return None
+    flows = gumbel_flows(maxima)
+    table = {'rivid': rivids, 'max': overall}
+    for rp, values in zip(RETURN_PERIODS, flows):
+        table['rp{0}'.format(rp)] = values
+    return table
+
+
+def thresholds(model, watershed, subbasin, comid):
+    """
+    Returns {'max', 'two', 'ten', 'twenty'} flows of a reach (the keys of the SPT GetReturnPeriods response), or
+    None when the table of its file is not available yet, cannot be computed or does not hold the reach.
+    """
+    table = tables.get(qout.qout_path(model, watershed, subbasin))
+    if table is None:
+        return None
+    position = qout.reach_positions(table['rivid'], [int(comid)])[0]
+    if position < 0 or np.isnan(table['rp2'][position]):
+        return None
+    return {
+        'max': float(max(table['max'][position], table['rp20'][position])),
+        'twenty': float(table['rp20'][position]),
+        'ten': float(table['rp10'][position]),
+        'two': float(table['rp2'][position]),
+    }
+
+
+tables = FileTables('return_periods', compute_table)
@@ -0,0 +1,366 @@
+"""
+Request timing and in-process metrics.
+
+Controllers decorated with instrumented() are timed as a whole and collect the spans opened with span() while they
+run (upstream calls, file reads, computations, rendering). The spans are returned to the browser in a Server-Timing
+header, and per-endpoint latency histograms and error counts are exposed in the Prometheus text format by
+prometheus_text().
+
+Histograms and counters live in each worker process. So that a scrape answered by any worker reports the whole
+host, every worker writes its series to <workspace>/metrics/<pid>.json at most every EXPORT_SECONDS (after a
+request) and prometheus_text() sums the files of the workers still running. The series are not labelled by pid;
+when a worker exits its file is dropped and its counts leave the sums, which Prometheus reads as a counter reset.
+Without a workspace (e.g. in tests) only the series of the current process are reported.
+"""
+import functools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the histogram buckets; the last bucket catches everything slower.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+METRIC_PREFIX = 'hydroviewer_'
+# Query parameter asking for a profile of the request (see profiling.py)
+PROFILE_PARAM = 'profile'
+# Seconds between two exports of the series of a worker
+EXPORT_SECONDS = 15
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_local = threading.local()
+# Directory of the per-worker series; None until looked up, False when there is none
+_directory = None
+_exported = 0
+
+
+class Histogram(object):
+    """
+    Cumulative-bucket histogram, safe to share between threads.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """
+        Returns the cumulative count of observations per bucket upper bound, the total count and the sum.
+        """
+        with self._lock:
+            cumulative = []
+            running = 0
+            for bound, count in zip(self.buckets, self.counts):
+                running += count
+                cumulative.append((bound, running))
+            return {'buckets': cumulative, 'count': self.count, 'sum': self.sum}
+
+
+class Counter(object):
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+def histogram(name, **labels):
+    """
+    Returns the histogram registered under name and labels, creating it on first use.
+    """
+    key = (name, tuple(sorted(labels.items())))
+    hist = _histograms.get(key)
+    if hist is None:
+        with _lock:
+            hist = _histograms.setdefault(key, Histogram())
+    return hist
+
+
+def histograms():
+    """
+    Returns a list of (name, labels, snapshot) for every registered histogram.
+    """
+    with _lock:
+        items = list(_histograms.items())
+    return [(name, dict(labels), hist.snapshot()) for (name, labels), hist in sorted(items, key=lambda i: i[0])]
+
+
+def counter(name, **labels):
+    """
+    Returns the counter registered under name and labels, creating it on first use.
+    """
+    key = (name, tuple(sorted(labels.items())))
+    count = _counters.get(key)
+    if count is None:
+        with _lock:
+            count = _counters.setdefault(key, Counter())
+    return count
+
+
+@contextmanager
+def span(name):
+    """
+    Times a block as a span of the current request. Outside of an instrumented request this only runs the block.
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        spans = getattr(_local, 'spans', None)
+        if spans is not None:
+            spans.append((name, time.time() - start))
+
+
+def current_endpoint():
+    return getattr(_local, 'endpoint', None)
+
+
+def log_error(e):
+    """
+    Reports an error handled by a controller and counts it against the current endpoint.
+    """
+    print(str(e))
+    endpoint = current_endpoint()
+    if endpoint is not None:
+        counter('request_errors', endpoint=endpoint).inc()
+
+
+def instrumented(controller):
+    """
+    Decorator timing a controller: records its latency and errors per endpoint and adds a Server-Timing header
+    with the spans of the request. Complete responses are compressed when the client accepts it (see
+    http_cache.py). Controllers called from another instrumented controller are neither timed nor profiled again.
+    """
+
+    @functools.wraps(controller)
+    def wrapper(request, *args, **kwargs):
+        if getattr(_local, 'spans', None) is not None:
+            # Already timed, and profiled when asked, by the outermost controller
+            return controller(request, *args, **kwargs)
+
+        endpoint = controller.__name__
+        _local.spans = []
+        _local.endpoint = endpoint
+        start = time.time()
+        try:
+            response = _call(controller, request, args, kwargs)
+        except Exception:
+            counter('request_errors', endpoint=endpoint).inc()
+            raise
+        finally:
+            elapsed = time.time() - start
+            spans = _local.spans
+            _local.spans = None
+            _local.endpoint = None
+            histogram('request_seconds', endpoint=endpoint).observe(elapsed)
+            _export_due()
+
+        if response is not None:
+            if response.status_code >= 500:
+                counter('request_errors', endpoint=endpoint).inc()
+            response['Server-Timing'] = server_timing(spans, elapsed)
+            if not getattr(response, 'streaming', True):
+                from .http_cache import compress
+                response = compress(request, response)
+        return response
+
+    return wrapper
+
+
+def _call(controller, request, args, kwargs):
+    # Requests without the profile flag pay for a single dictionary lookup
+    if PROFILE_PARAM in getattr(request, 'GET', ()):
+        from . import profiling
+        if profiling.wants_profile(request):
+            return profiling.run_profiled(controller, request, *args, **kwargs)
+    return controller(request, *args, **kwargs)
+
+
+def server_timing(spans, total):
+    """
+    Server-Timing header value for a list of (name, seconds) spans and the total request time.
+    """
+    entries = ['{0};dur={1:.1f}'.format(re.sub(r'[^0-9A-Za-z_-]', '_', name), 1000 * seconds)
+               for name, seconds in spans]
+    entries.append('total;dur={0:.1f}'.format(1000 * total))
+    return ', '.join(entries)
+
+
+def directory():
+    """
+    The directory the workers export their series to, or None when there is none.
+    """
+    global _directory
+    if _directory is None:
+        try:
+            from .app import Hydroviewer as app
+            path = os.path.join(app.get_app_workspace().path, 'metrics')
+            os.makedirs(path, exist_ok=True)
+        except Exception as e:
+            print('Metrics are only reported per worker: {0}'.format(e))
+            path = False
+        _directory = path
+    return _directory or None
+
+
+def set_directory(path):
+    global _directory
+    _directory = path if path is not None else False
+
+
+def export():
+    """
+    Writes the series of this process to its file in directory().
+    """
+    global _exported
+    path = directory()
+    if path is None:
+        return
+    _exported = time.time()
+    with _lock:
+        counters = sorted(_counters.items(), key=lambda i: i[0])
+    series = {
+        'histograms': [[name, labels, snapshot] for name, labels, snapshot in histograms()],
+        'counters': [[name, dict(labels), count.value] for (name, labels), count in counters],
+    }
+    target = os.path.join(path, '{0}.json'.format(os.getpid()))
+    tmp = '{0}.{1}.tmp'.format(target, threading.get_ident())
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(series, f)
+        os.replace(tmp, target)
+    except OSError as e:
+        print('Exporting the metrics failed: {0}'.format(e))
+
+
+def _export_due():
+    if time.time() - _exported >= EXPORT_SECONDS:
+        export()
+
+
+def collect():
+    """
+    (histograms, counters) summed over the running workers: lists of (name, labels, snapshot) and of
+    (name, labels, value), sorted by name and labels. Only this process when there is no directory().
+    """
+    with _lock:
+        counters = [(name, dict(labels), count.value) for (name, labels), count in _counters.items()]
+    path = directory()
+    if path is None:
+        return histograms(), sorted(counters, key=_series_key)
+
+    export()
+    merged_histograms = {}
+    merged_counters = {}
+    for filename in os.listdir(path):
+        pid, ext = os.path.splitext(filename)
+        if ext != '.json' or not pid.isdigit():
+            continue
+        if not _running(int(pid)):
+            _remove(os.path.join(path, filename))
+            continue
+        try:
+            with open(os.path.join(path, filename)) as f:
+                series = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, snapshot in series['histograms']:
+            key = (name, tuple(sorted(labels.items())))
+            merged = merged_histograms.setdefault(key, {'buckets': None, 'count': 0, 'sum': 0.0})
+            buckets = [(float(bound), count) for bound, count in snapshot['buckets']]
+            if merged['buckets'] is None:
+                merged['buckets'] = buckets
+            else:
+                merged['buckets'] = [(bound, count + other) for (bound, count), (_, other) in
+                                     zip(merged['buckets'], buckets)]
+            merged['count'] += snapshot['count']
+            merged['sum'] += snapshot['sum']
+        for name, labels, value in series['counters']:
+            key = (name, tuple(sorted(labels.items())))
+            merged_counters[key] = merged_counters.get(key, 0) + value
+
+    return ([(name, dict(labels), snapshot) for (name, labels), snapshot in sorted(merged_histograms.items())],
+            [(name, dict(labels), value) for (name, labels), value in sorted(merged_counters.items())])
+
+
+def _series_key(series):
+    return series[0], sorted(series[1].items())
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def prometheus_text(gauges=None):
+    """
+    All histograms and counters of the running workers in the Prometheus text exposition format. gauges is an
+    optional list of (name, labels, value) to include.
+    """
+    lines = []
+    seen = set()
+
+    def type_line(name, kind):
+        if name not in seen:
+            seen.add(name)
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+
+    merged_histograms, merged_counters = collect()
+    for name, labels, snapshot in merged_histograms:
+        name = METRIC_PREFIX + name
+        type_line(name, 'histogram')
+        for bound, count in snapshot['buckets']:
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('{0}_bucket{1} {2}'.format(name, _labels(labels, le=le), count))
+        lines.append('{0}_sum{1} {2!r}'.format(name, _labels(labels), snapshot['sum']))
+        lines.append('{0}_count{1} {2}'.format(name, _labels(labels), snapshot['count']))
+
+    for name, labels, value in merged_counters:
+        name = METRIC_PREFIX + name + '_total'
+        type_line(name, 'counter')
+        lines.append('{0}{1} {2}'.format(name, _labels(labels), value))
+
+    for name, labels, value in gauges or []:
+        name = METRIC_PREFIX + name
+        type_line(name, 'gauge')
+        lines.append('{0}{1} {2}'.format(name, _labels(labels), value))
+
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in sorted(labels.items())) + '}'
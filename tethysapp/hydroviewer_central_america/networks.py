@@ -0,0 +1,280 @@
+"""
+Drainage-line networks of the LIS and HIWAT watersheds, read from the shapefile next to each Qout file.
+
+The shapefile of a watershed (<lis_path or hiwat_path>/<watershed>-<subbasin>/*.shp, preferring a name with
+"drainage") is parsed once per mtime into a Network and kept in memory, so layers joined with the network never
+read it again.
+
+A Network indexes its reaches in a uniform grid of at most GRID_CELLS cells a side over its extent. The map asks
+for the reaches of its viewport at its zoom level: the response holds the reaches of the grid cells the viewport
+overlaps, simplified (Douglas-Peucker) to half a pixel of that zoom level, with coordinates rounded to the same
+precision and without the reaches smaller than a pixel. The Network serializes the reaches of a grid cell once per
+zoom level and keeps them, so a response only joins the features of the cells it covers: a pan re-serializes only
+the cells not served before at that zoom level, and nothing is kept per viewport.
+"""
+import json
+import math
+import os
+import threading
+
+import numpy as np
+
+from . import http_cache, shapefiles
+from .shapefiles import resolution
+from .app import Hydroviewer as app
+from .qout import MODEL_PATH_SETTINGS
+
+# Attribute holding the reach id, by order of preference
+COMID_FIELDS = ('COMID', 'comid', 'rivid', 'HydroID', 'LINKNO', 'ARCID')
+GRID_CELLS = 64
+# Lines are simplified to this fraction of a pixel; from FULL_DETAIL_ZOOM on they are sent as they are
+SIMPLIFY_PIXELS = 0.5
+FULL_DETAIL_ZOOM = 15
+
+_lock = threading.Lock()
+_networks = {}
+
+
+class Network(object):
+    """
+    The reaches of a drainage-line shapefile: comids (int array), lines (per reach, a list of (n, 2) EPSG:3857
+    arrays) and the attribute records.
+    """
+
+    def __init__(self, records, lines):
+        field = next((f for f in COMID_FIELDS if records and f in records[0]), None)
+        if field is None:
+            raise ValueError('No reach id field ({0}) in the drainage lines'.format(', '.join(COMID_FIELDS)))
+        self.comid_field = field
+        self.comids = np.array([r[field] if r[field] is not None else -1 for r in records], dtype='i8')
+        self.lines = lines
+        self.records = records
+        self.bounds = np.array([_bounds(parts) for parts in lines], dtype=float).reshape(-1, 4)
+        drawn = ~np.isnan(self.bounds[:, 0])
+        if drawn.any():
+            self.extent = [float(self.bounds[drawn, 0].min()), float(self.bounds[drawn, 1].min()),
+                           float(self.bounds[drawn, 2].max()), float(self.bounds[drawn, 3].max())]
+        else:
+            self.extent = [0.0, 0.0, 0.0, 0.0]
+        self.cell_size = max(self.extent[2] - self.extent[0], self.extent[3] - self.extent[1]) / GRID_CELLS or 1.0
+        self.cells = _grid(self.bounds[drawn], np.flatnonzero(drawn), self.extent, self.cell_size)
+        self._lock = threading.Lock()
+        self._simplified = {}
+        self._features = {}
+
+    def __len__(self):
+        return len(self.comids)
+
+    def cell_range(self, bbox=None):
+        """
+        (x0, y0, x1, y1) inclusive range of the grid cells overlapping a (minx, miny, maxx, maxy) bbox, the whole
+        grid when bbox is None, None when the bbox misses the network.
+        """
+        extent = self.extent
+        if bbox is None:
+            bbox = extent
+        elif bbox[0] > extent[2] or bbox[2] < extent[0] or bbox[1] > extent[3] or bbox[3] < extent[1]:
+            return None
+        last = GRID_CELLS - 1
+        x0, y0 = (_cell(bbox[0], extent[0], self.cell_size, last), _cell(bbox[1], extent[1], self.cell_size, last))
+        x1, y1 = (_cell(bbox[2], extent[0], self.cell_size, last), _cell(bbox[3], extent[1], self.cell_size, last))
+        return x0, y0, x1, y1
+
+    def query(self, cell_range):
+        """
+        Sorted positions of the reaches in a range of grid cells.
+        """
+        if cell_range is None:
+            return np.array([], dtype='i8')
+        x0, y0, x1, y1 = cell_range
+        found = [self.cells[(x, y)] for x in range(x0, x1 + 1) for y in range(y0, y1 + 1) if (x, y) in self.cells]
+        return np.unique(np.concatenate(found)) if found else np.array([], dtype='i8')
+
+    def features(self, cell_range, level):
+        """
+        Serialized GeoJSON features of the reaches in a range of grid cells at a zoom level, by position.
+        """
+        if cell_range is None:
+            return []
+        x0, y0, x1, y1 = cell_range
+        found = {}
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                if (x, y) in self.cells:
+                    found.update(self.cell_features((x, y), level))
+        return [found[position] for position in sorted(found)]
+
+    def cell_features(self, cell, level):
+        """
+        {position: serialized feature} of the reaches of a grid cell drawn at a zoom level, serialized once per cell
+        and level.
+        """
+        with self._lock:
+            done = self._features.setdefault(level, {})
+            features = done.get(cell)
+        if features is None:
+            positions = self.cells[cell]
+            if level is not None:
+                # Reaches smaller than a pixel are not drawn
+                size = self.bounds[positions, 2:] - self.bounds[positions, :2]
+                positions = positions[size.max(axis=1) >= resolution(level)]
+            serialized = ((int(position), self.feature(position, level)) for position in positions)
+            features = {position: feature for position, feature in serialized if feature is not None}
+            with self._lock:
+                done[cell] = features
+        return features
+
+    def feature(self, position, level):
+        """
+        A reach as a serialized GeoJSON feature, simplified for a zoom level (None for full detail), or None when
+        nothing of it is left to draw.
+        """
+        # Coordinates are rounded to the largest power of ten within the simplification tolerance
+        precision = 1 if level is None else \
+            10 ** max(0, int(math.floor(math.log10(resolution(level) * SIMPLIFY_PIXELS))))
+        parts = [(np.round(part / precision) * precision).astype('i8').tolist()
+                 for part in self.simplified(position, level) if len(part)]
+        if not parts:
+            return None
+        geometry = {'type': 'LineString', 'coordinates': parts[0]} if len(parts) == 1 else \
+            {'type': 'MultiLineString', 'coordinates': parts}
+        comid = int(self.comids[position])
+        return json.dumps({'type': 'Feature', 'id': comid, 'geometry': geometry, 'properties': {'COMID': comid}},
+                          separators=(',', ':'))
+
+    def simplified(self, position, level):
+        """
+        Parts of a reach simplified for a zoom level (None for full detail), computed once per reach and level.
+        """
+        if level is None:
+            return self.lines[position]
+        with self._lock:
+            done = self._simplified.setdefault(level, {})
+            parts = done.get(position)
+        if parts is None:
+            tolerance = resolution(level) * SIMPLIFY_PIXELS
+            parts = [simplify(part, tolerance) for part in self.lines[position]]
+            with self._lock:
+                done[position] = parts
+        return parts
+
+
+def shapefile_path(model, watershed, subbasin):
+    folder = os.path.join(app.get_custom_setting(MODEL_PATH_SETTINGS[model]), '-'.join([watershed, subbasin]))
+    names = sorted(f for f in os.listdir(folder) if f.lower().endswith('.shp'))
+    if not names:
+        raise ValueError('No drainage-line shapefile for {0}-{1}'.format(watershed, subbasin))
+    drainage = [f for f in names if 'drainage' in f.lower()]
+    return os.path.join(folder, (drainage or names)[0])
+
+
+def load(model, watershed, subbasin):
+    """
+    The Network of a watershed/subbasin, parsed once per shapefile version.
+    """
+    path = shapefile_path(model, watershed, subbasin)
+    stat = os.stat(path)
+    version = (stat.st_mtime, stat.st_size)
+    with _lock:
+        cached = _networks.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    network = Network(*shapefiles.read(path))
+    with _lock:
+        _networks[path] = (version, network)
+    return network
+
+
+def version(model, watershed, subbasin):
+    """
+    (path, mtime, size) of the shapefile of a watershed/subbasin, for cache keys.
+    """
+    path = shapefile_path(model, watershed, subbasin)
+    stat = os.stat(path)
+    return path, stat.st_mtime, stat.st_size
+
+
+def zoom_level(zoom):
+    """
+    The integer zoom level at which lines are simplified for a map zoom, None for full detail.
+    """
+    if zoom is None or not math.isfinite(float(zoom)):
+        return None
+    level = int(math.floor(float(zoom)))
+    return None if level >= FULL_DETAIL_ZOOM else max(level, 0)
+
+
+def simplify(points, tolerance):
+    """
+    Douglas-Peucker simplification of an (n, 2) line: keeps the end points and every point further than tolerance
+    from the simplified line.
+    """
+    n = len(points)
+    if n <= 2 or tolerance <= 0:
+        return points
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        inner = points[first + 1:last]
+        dx, dy = end - start
+        length = math.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(inner[:, 0] - start[0], inner[:, 1] - start[1])
+        else:
+            distances = np.abs(dx * (inner[:, 1] - start[1]) - dy * (inner[:, 0] - start[0])) / length
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            stack.append((first, middle))
+            stack.append((middle, last))
+    return points[keep]
+
+
+def layer(model, watershed, subbasin, bbox=None, zoom=None, comid=None):
+    """
+    The drainage lines of a watershed as an http_cache.Body of {'options': GeoJSON string, 'legend_extent'}: the
+    reaches of the grid cells overlapping bbox (all of them when None), simplified for the zoom level (full detail
+    when None), or the single reach comid at full detail.
+    """
+    network = load(model, watershed, subbasin)
+    if comid is None:
+        features = network.features(network.cell_range(bbox), zoom_level(zoom))
+    else:
+        features = [network.feature(i, None) for i in np.flatnonzero(network.comids == int(comid))]
+    return _body(network, [feature for feature in features if feature is not None],
+                 version(model, watershed, subbasin)[1])
+
+
+def _body(network, features, modified=None):
+    options = '{{"type":"FeatureCollection","features":[{0}]}}'.format(','.join(features))
+    content = json.dumps({'options': options, 'legend_extent': network.extent}, separators=(',', ':'))
+    return http_cache.Body(content.encode('utf-8'), modified=modified)
+
+
+def _bounds(parts):
+    points = [part for part in parts if len(part)]
+    if not points:
+        return [np.nan] * 4
+    points = np.concatenate(points)
+    return list(points.min(axis=0)) + list(points.max(axis=0))
+
+
+def _cell(value, origin, size, last):
+    return min(max(int((value - origin) // size), 0), last)
+
+
+def _grid(bounds, positions, extent, size):
+    # Every reach is listed in each cell its bounding box overlaps
+    last = GRID_CELLS - 1
+    cells = {}
+    for (minx, miny, maxx, maxy), position in zip(bounds, positions):
+        for x in range(_cell(minx, extent[0], size, last), _cell(maxx, extent[0], size, last) + 1):
+            for y in range(_cell(miny, extent[1], size, last), _cell(maxy, extent[1], size, last) + 1):
+                cells.setdefault((x, y), []).append(position)
+    return {cell: np.array(found, dtype='i8') for cell, found in cells.items()}
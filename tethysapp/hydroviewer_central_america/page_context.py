@@ -0,0 +1,179 @@
+"""
+Cached assembly of the request-independent parts of the page views.
+
+The settings, GeoServer endpoint, region index and watershed lists behind the home, ecmwf, lis and hiwat pages only
+change when an admin changes a custom setting, so they are built once per settings version and shared by every
+request. Only the permission- and query-dependent gizmos are built per request (see controllers.py).
+"""
+import json
+import os
+import threading
+import time
+
+from requests.auth import HTTPBasicAuth
+from tethys_sdk.gizmos import SelectInput, TextInput
+
+from . import upstream
+from .app import Hydroviewer as app
+
+# Settings edited from the Tethys admin pages do not bump the version, so cached contexts are also refreshed
+# (in the background) once they are older than this many seconds.
+CONTEXT_TTL = 300
+
+_lock = threading.Lock()
+_settings_version = 0
+_contexts = {}
+_refreshing = set()
+
+
+def settings_version():
+    return _settings_version
+
+
+def bump_settings_version():
+    """
+    Invalidate every cached page context. Must be called after the app changes one of its custom settings.
+    """
+    global _settings_version
+    with _lock:
+        _settings_version += 1
+        _contexts.clear()
+
+
+def get_shared_context(model):
+    """
+    Returns the request-independent context for a page ('home', 'ecmwf', 'lis' or 'hiwat').
+    A missing or outdated context is built synchronously; an expired one is served while it is rebuilt in the
+    background so page renders never wait on the database, the disk or GeoServer once warm.
+    """
+    entry = _contexts.get(model)
+    if entry is None or entry['version'] != _settings_version:
+        with _lock:
+            entry = _contexts.get(model)
+            if entry is None or entry['version'] != _settings_version:
+                entry = _build_entry(model)
+                _contexts[model] = entry
+    elif time.time() - entry['built'] > CONTEXT_TTL:
+        _refresh_in_background(model)
+    return entry['context']
+
+
+def _build_entry(model):
+    version = _settings_version
+    return {'version': version, 'built': time.time(), 'context': _build_context(model)}
+
+
+def _refresh_in_background(model):
+    with _lock:
+        if model in _refreshing:
+            return
+        _refreshing.add(model)
+
+    def refresh():
+        try:
+            entry = _build_entry(model)
+            with _lock:
+                if entry['version'] == _settings_version:
+                    _contexts[model] = entry
+        except Exception as e:
+            print(str(e))
+        finally:
+            with _lock:
+                _refreshing.discard(model)
+
+    threading.Thread(target=refresh, name='page-context-{0}'.format(model), daemon=True).start()
+
+
+def _build_context(model):
+    default_model = app.get_custom_setting('default_model_type')
+    default_ws = app.get_custom_setting('default_watershed_name')
+
+    # Check if we need to hide the WS options dropdown.
+    hidden_attr = ""
+    if app.get_custom_setting('show_dropdown') and default_model and default_ws:
+        hidden_attr = "hidden"
+
+    context = {
+        'default_model': default_model,
+        'init_ws_val': default_ws or 'Select Watershed',
+        'hidden_attr': hidden_attr,
+        'zoom_info': TextInput(display_text='',
+                               initial=json.dumps(app.get_custom_setting('zoom_info')),
+                               name='zoom_info',
+                               disabled=True),
+    }
+
+    # Retrieve a geoserver engine and geoserver credentials.
+    geoserver_engine = app.get_spatial_dataset_service(name='main_geoserver', as_engine=True)
+    my_geoserver = geoserver_engine.endpoint.replace('rest', '')
+
+    region = '' if model == 'ecmwf' else app.get_custom_setting('region')
+    context['geoserver_endpoint'] = TextInput(display_text='',
+                                              initial=json.dumps([my_geoserver,
+                                                                  app.get_custom_setting('workspace'),
+                                                                  region,
+                                                                  app.get_custom_setting('extra_feature'),
+                                                                  app.get_custom_setting('layer_name')]),
+                                              name='geoserver_endpoint',
+                                              disabled=True)
+
+    if model in ('home', 'ecmwf'):
+        context['regions'] = _regions_select()
+
+    if model == 'ecmwf':
+        context['watershed_list'] = _ecmwf_watersheds(geoserver_engine, my_geoserver, default_model,
+                                                      context['init_ws_val'])
+    elif model in ('lis', 'hiwat'):
+        context['watershed_list'] = _local_watersheds(model, default_model, context['init_ws_val'])
+
+    return context
+
+
+def _regions_select():
+    with open(os.path.join(os.path.dirname(__file__), 'public', 'geojson', 'index.json')) as f:
+        region_index = json.load(f)
+    return SelectInput(
+        display_text='Zoom to a Region:',
+        name='regions',
+        multiple=False,
+        original=True,
+        options=[(region_index[opt]['name'], opt) for opt in region_index]
+    )
+
+
+def _ecmwf_watersheds(geoserver_engine, my_geoserver, default_model, init_ws_val):
+    watershed_list = [['Select Watershed', '']]
+    res = upstream.geoserver_get(my_geoserver + 'rest/workspaces/' + app.get_custom_setting('workspace') +
+                                 '/featuretypes.json',
+                                 auth=HTTPBasicAuth(geoserver_engine.username, geoserver_engine.password))
+
+    keywords = app.get_custom_setting('keywords').replace(' ', '').split(',')
+    for feature_type in json.loads(res.content)['featureTypes']['featureType']:
+        raw_feature = feature_type['name']
+        if 'drainage_line' in raw_feature and any(n in raw_feature for n in keywords):
+            feat_name = raw_feature.split('-')[0].replace('_', ' ').title() + ' (' + \
+                        raw_feature.split('-')[1].replace('_', ' ').title() + ')'
+            if feat_name not in str(watershed_list):
+                watershed_list.append([feat_name, feat_name])
+
+    # Add the default WS if present and not already in the list
+    if default_model == 'ECMWF-RAPID' and init_ws_val and init_ws_val not in str(watershed_list):
+        watershed_list.append([init_ws_val, init_ws_val])
+    return watershed_list
+
+
+def _local_watersheds(model, default_model, init_ws_val):
+    watershed_list = [['Select Watershed', '']]
+
+    model_path = app.get_custom_setting('{0}_path'.format(model))
+    if model_path:
+        for i in os.listdir(model_path):
+            feat_name = i.split('-')[0].replace('_', ' ').title() + ' (' + \
+                        i.split('-')[1].replace('_', ' ').title() + ')'
+            if feat_name not in str(watershed_list):
+                watershed_list.append([feat_name, i])
+
+    # Add the default WS if present and not already in the list
+    if default_model == '{0}-RAPID'.format(model.upper()) and init_ws_val and init_ws_val not in str(watershed_list):
+        watershed_list.append([init_ws_val, init_ws_val])
+    return watershed_list
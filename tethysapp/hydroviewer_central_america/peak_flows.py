@@ -0,0 +1,116 @@
+"""
+Watershed-wide peak flows of the LIS and HIWAT forecasts.
+
+The peak flow and time of peak of every reach of a Qout file are found in one pass over the file, block by block, by
+keeping a running maximum and its time step (see qout_tables.py for how the table is kept per file). The table is
+joined with the watershed's drainage lines (networks.py) into a GeoJSON layer of every reach with its peak, time of
+peak and the highest return period it exceeds. The return periods are fitted on the Qout file itself (see
+local_return_periods.py), so a forecast file, which covers days rather than years, has none and its reaches are
+served unclassed (-1). The layer is serialized once per Qout file, shapefile and
+return period table, and served from the payload cache with its ETag until one of them changes.
+"""
+import json
+
+import numpy as np
+
+from . import cache, http_cache, local_return_periods, networks, qout
+from .qout_tables import FileTables, time_blocks
+
+BLOCK_VALUES = 2 * 1024 * 1024
+LAYER_TTL = 7 * 24 * 60 * 60
+
+
+def compute_table(path, block_values=BLOCK_VALUES):
+    """
+    rivid, peak flow and time of peak (seconds since the epoch) of every reach of a Qout file. Reaches without
+    flows have a NaN peak.
+    """
+    with qout.dataset(path) as res:
+        with qout.HDF5_LOCK:
+            rivids = np.asarray(res.variables['rivid'][:])
+            times = np.asarray(res.variables['time'][:]).astype('datetime64[s]').astype('i8')
+            blocks = time_blocks(res, block_values)
+        if not len(times):
+            return None
+        peak = np.full(len(rivids), -np.inf)
+        step = np.zeros(len(rivids), dtype='i8')
+        columns = np.arange(len(rivids))
+        qout_var = res.variables['Qout']
+        for lo, hi in blocks:
+            with qout.HDF5_LOCK:
+                block = qout_var[lo:hi, :]
+            block = np.ma.filled(block.astype(float), np.nan)
+            block = np.where(np.isnan(block), -np.inf, block)
+            highest = block.argmax(axis=0)
+            values = block[highest, columns]
+            higher = values > peak
+            peak[higher] = values[higher]
+            step[higher] = lo + highest[higher]
+    peak[np.isinf(peak)] = np.nan
+    return {'rivid': rivids, 'peak': peak, 'peak_time': times[step]}
+
+
+def classes(peak, rivids, return_periods):
+    """
+    Return period (2, 10 or 20) exceeded by each peak, 0 below the 2 year flow and -1 when unknown.
+    """
+    result = np.full(len(peak), -1, dtype='i8')
+    if return_periods is None:
+        return result
+    positions = qout.reach_positions(return_periods['rivid'], rivids)
+    known = positions >= 0
+    positions = np.maximum(positions, 0)
+    with np.errstate(invalid='ignore'):
+        result[known & ~np.isnan(return_periods['rp2'][positions])] = 0
+        for column, return_period in (('rp2', 2), ('rp10', 10), ('rp20', 20)):
+            result[known & (peak >= return_periods[column][positions])] = return_period
+    return result
+
+
+def layer(model, watershed, subbasin):
+    """
+    The peak-flow GeoJSON layer of a watershed as an http_cache.Body, or None while the peak table of its Qout file
+    is being computed.
+    """
+    path = qout.qout_path(model, watershed, subbasin)
+    peaks = tables.get(path)
+    if peaks is None:
+        return None
+    return_periods = local_return_periods.tables.get(path)
+    tag, modified = http_cache.file_validators(path)
+    key = ('peak_layer', model, watershed, subbasin, tag, networks.version(model, watershed, subbasin),
+           return_periods is not None)
+    body, _ = cache.get(key, lambda: _build(model, watershed, subbasin, peaks, return_periods, modified), LAYER_TTL)
+    return body
+
+
+def _build(model, watershed, subbasin, peaks, return_periods, modified):
+    network = networks.load(model, watershed, subbasin)
+    positions = qout.reach_positions(peaks['rivid'], network.comids)
+    found = positions >= 0
+    peak = np.where(found, peaks['peak'][np.maximum(positions, 0)], np.nan)
+    peak_time = peaks['peak_time'][np.maximum(positions, 0)]
+    rp_class = classes(peak, network.comids, return_periods)
+
+    features = []
+    for i in np.flatnonzero(found & ~np.isnan(peak)):
+        parts = [np.round(part).astype('i8').tolist() for part in network.lines[i]]
+        if not parts:
+            continue
+        geometry = {'type': 'LineString', 'coordinates': parts[0]} if len(parts) == 1 else \
+            {'type': 'MultiLineString', 'coordinates': parts}
+        features.append({
+            'type': 'Feature',
+            'geometry': geometry,
+            'properties': {
+                'COMID': int(network.comids[i]),
+                'peak': round(float(peak[i]), 3),
+                'peak_time': str(np.datetime64(int(peak_time[i]), 's'))[:16],
+                'return_period': int(rp_class[i]),
+            },
+        })
+    content = json.dumps({'type': 'FeatureCollection', 'features': features}, separators=(',', ':'))
+    return http_cache.Body(content.encode('utf-8'), modified=modified)
+
+
+tables = FileTables('peak_flows', compute_table)
@@ -0,0 +1,53 @@
+"""
+Ensemble exceedance probabilities for the forecastpercent table.
+
+For every forecast day and return period, the percent of ensemble members whose flow exceeds the return period
+flow at some time of that day. A day covers its own time steps and the step at midnight of the next day, as in
+geoglows.plots.probabilities_table, whose table this replaces.
+"""
+import numpy as np
+
+RETURN_PERIODS = (2, 5, 10, 25, 50, 100)
+
+
+def daily_max(times, flows):
+    """
+    Returns (days, maxima): the forecast days as datetime64[D] and the (day, member) maximum flow of each member
+    over the day, ignoring missing values. times must be sorted datetime64 values, flows a (time, member) array.
+    """
+    times = np.asarray(times, dtype='datetime64[s]')
+    days = times.astype('datetime64[D]')
+    if not len(times):
+        return days, np.empty((0, flows.shape[1]))
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    with np.errstate(invalid='ignore'):
+        maxima = np.fmax.reduceat(flows, starts, axis=0)
+        # Include the step at midnight of the next day
+        boundary = starts[1:][times[starts[1:]] == days[starts[1:]]]
+        at_midnight = np.searchsorted(starts, boundary) - 1
+        maxima[at_midnight] = np.fmax(maxima[at_midnight], flows[boundary])
+    return days[starts], maxima
+
+
+def exceedance_percent(maxima, thresholds):
+    """
+    Percent of members (rounded to integers) exceeding each threshold on each day, as a (threshold, day) array.
+    """
+    exceeds = maxima[np.newaxis, :, :] > np.asarray(thresholds, dtype=float)[:, np.newaxis, np.newaxis]
+    return np.rint(100.0 * exceeds.sum(axis=2) / maxima.shape[1]).astype(int)
+
+
+def probabilities_payload(times, flows, rperiods):
+    """
+    Compact JSON payload of the exceedance table from the ensemble (time, member) flows and the return_periods
+    DataFrame.
+    """
+    thresholds = [float(rperiods['return_period_{0}'.format(rp)].values[0]) for rp in RETURN_PERIODS]
+    days, maxima = daily_max(times, flows)
+    return {
+        'cycle': str(days[0]) if len(days) else None,
+        'days': [str(day) for day in days],
+        'return_periods': list(RETURN_PERIODS),
+        'thresholds': [round(t, 3) for t in thresholds],
+        'percent': exceedance_percent(maxima, thresholds).tolist(),
+    }
@@ -0,0 +1,106 @@
+"""
+On-demand profiling of single requests.
+
+An admin (update_default permission) adds ?profile=1 to any instrumented controller request to run it under
+cProfile. The profile is written to the app workspace as a .prof file (pstats format, e.g. for snakeviz) with a
+text summary next to it, and the response carries an X-Profile header naming the file to download from
+admin/profile. Requests without the flag are not affected.
+
+Only the thread handling the request is profiled; work done on the refresh or export worker threads is not.
+"""
+import cProfile
+import io
+import os
+import pstats
+import re
+import time
+import uuid
+
+from tethys_sdk.permissions import has_permission
+
+from .app import Hydroviewer as app
+from .metrics import PROFILE_PARAM
+
+# Profiles kept in the workspace; the oldest are deleted first
+MAX_PROFILES = 50
+# Functions listed in the text summary
+SUMMARY_LINES = 60
+
+_NAME_PATTERN = re.compile(r'^[0-9A-Za-z_]+_[0-9]{8}T[0-9]{6}_[0-9a-f]{8}\.(prof|txt)$')
+
+
+def profiles_dir():
+    return os.path.join(app.get_app_workspace().path, 'profiles')
+
+
+def wants_profile(request):
+    return PROFILE_PARAM in getattr(request, 'GET', ()) and has_permission(request, 'update_default')
+
+
+def run_profiled(controller, request, *args, **kwargs):
+    """
+    Calls controller under cProfile, saves the profile and returns the response with an X-Profile header.
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Another thread is being profiled (Python 3.12+ allows one profiler per interpreter)
+        print('Not profiling {0}: {1}'.format(controller.__name__, e))
+        return controller(request, *args, **kwargs)
+    try:
+        response = controller(request, *args, **kwargs)
+    finally:
+        profiler.disable()
+        name = save(profiler, controller.__name__)
+    if response is not None:
+        response['X-Profile'] = name
+    return response
+
+
+def save(profiler, endpoint):
+    """
+    Writes the .prof file and its text summary and returns the name of the .prof file.
+    """
+    directory = profiles_dir()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    name = '{0}_{1}_{2}'.format(endpoint, time.strftime('%Y%m%dT%H%M%S'), uuid.uuid4().hex[:8])
+
+    profiler.dump_stats(os.path.join(directory, name + '.prof'))
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    with open(os.path.join(directory, name + '.txt'), 'w') as f:
+        f.write(summary.getvalue())
+
+    _evict(directory)
+    return name + '.prof'
+
+
+def profile_path(name):
+    """
+    Path of a saved profile or summary, or None if name is not a valid profile file name.
+    """
+    if not _NAME_PATTERN.match(name or ''):
+        return None
+    path = os.path.join(profiles_dir(), name)
+    return path if os.path.exists(path) else None
+
+
+def list_profiles():
+    directory = profiles_dir()
+    if not os.path.isdir(directory):
+        return []
+    return sorted((f for f in os.listdir(directory) if f.endswith('.prof')),
+                  key=lambda f: os.path.getmtime(os.path.join(directory, f)), reverse=True)
+
+
+def _evict(directory):
+    profiles = sorted((f for f in os.listdir(directory) if f.endswith('.prof')),
+                      key=lambda f: os.path.getmtime(os.path.join(directory, f)))
+    for name in profiles[:max(len(profiles) - MAX_PROFILES, 0)]:
+        for path in (os.path.join(directory, name), os.path.join(directory, name[:-len('.prof')] + '.txt')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
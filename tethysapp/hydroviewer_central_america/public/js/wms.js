@@ -16,7 +16,13 @@ var default_extent,
     twenty_year_warning,
     map,
     wms_layers,
-    regionsLayer
+    regionsLayer,
+    event_poll,
+    current_reach,
+    peak_flow_layer,
+    drainage_zoom_listener,
+    warning_query,
+    warnings_clustered
 
 
 var $loading = $('#view-file-loading');
@@ -166,42 +172,17 @@ function init_map() {
 
     two_year_warning = new ol.layer.Vector({
         source: new ol.source.Vector(),
-        style: new ol.style.Style({
-            image: new ol.style.RegularShape({
-                fill: new ol.style.Fill({ color: 'yellow' }),
-                stroke: new ol.style.Stroke({ color: 'black', width: 0.5 }),
-                points: 3,
-                radius: 10,
-                angle: 0
-            })
-
-        })
+        style: warning_style('yellow')
     });
 
     ten_year_warning = new ol.layer.Vector({
         source: new ol.source.Vector(),
-        style: new ol.style.Style({
-            image: new ol.style.RegularShape({
-                fill: new ol.style.Fill({ color: 'red' }),
-                stroke: new ol.style.Stroke({ color: 'black', width: 0.5 }),
-                points: 3,
-                radius: 10,
-                angle: 0
-            })
-        })
+        style: warning_style('red')
     });
 
     twenty_year_warning = new ol.layer.Vector({
         source: new ol.source.Vector(),
-        style: new ol.style.Style({
-            image: new ol.style.RegularShape({
-                fill: new ol.style.Fill({ color: 'rgba(128,0,128,0.8)' }),
-                stroke: new ol.style.Stroke({ color: 'black', width: 0.5 }),
-                points: 3,
-                radius: 10,
-                angle: 0
-            })
-        })
+        style: warning_style('rgba(128,0,128,0.8)')
     });
 
 
@@ -241,6 +222,7 @@ function init_map() {
 function view_watershed() {
     map.removeInteraction(select_interaction);
     map.removeLayer(wmsLayer);
+    warning_query = null;
     $("#get-started").modal('hide');
     if ($('#model option:selected').text() === 'ECMWF-RAPID' && $('#watershedSelect option:selected').val() !== "") {
 
@@ -256,6 +238,8 @@ function view_watershed() {
         var subbasin_display_name = $('#watershedSelect option:selected').text().split(' (')[1].replace(')', '');
         var layer_name = JSON.parse($('#geoserver_endpoint').val())[4];
         $("#watershed-info").append('<h3>Current Watershed: ' + watershed_display_name + '</h3><h5>Subbasin Name: ' + subbasin_display_name);
+        listen_for_events(model, watershed, subbasin);
+        get_warning_points(model, watershed, subbasin);
 
         var layerName = workspace + ':' + layer_name;
         wmsLayer = new ol.layer.Image({
@@ -310,44 +294,10 @@ function view_watershed() {
         var subbasin_display_name = $('#watershedSelect option:selected').text().split(' (')[1].replace(')', '');
         var layer_name = JSON.parse($('#geoserver_endpoint').val())[4];
         $("#watershed-info").append('<h3>Current Watershed: ' + watershed_display_name + '</h3><h5>Subbasin Name: ' + subbasin_display_name);
+        listen_for_events(model, watershed, subbasin);
 
         var layerName = workspace + ':' + layer_name;
-        $.ajax({
-            type: 'GET',
-            url: 'get-lis-shp/',
-            dataType: 'json',
-            data: {
-                'model': model,
-                'watershed': watershed,
-                'subbasin': subbasin
-            },
-            beforeSend: function () {
-                $('#featureLoader').show();
-            },
-            success: function(result) {
-                wmsLayer = new ol.layer.Vector({
-                    renderMode: 'image',
-                    source: new ol.source.Vector({
-                        features: (new ol.format.GeoJSON()).readFeatures(result.options)
-                    }),
-                    style: new ol.style.Style({
-                        stroke: new ol.style.Stroke({
-                            color: 'blue',
-                            width: 1
-                        })
-                    })
-                });
-
-                map.addLayer(wmsLayer);
-
-                feature_layer = wmsLayer;
-
-                map.getView().fit(result.legend_extent, map.getSize())
-            },
-            complete: function(){
-                $('#featureLoader').hide();
-            }
-        });
+        add_drainage_layer('get-lis-shp/', model, watershed, subbasin);
 
     } else if ($('#model option:selected').text() === 'HIWAT-RAPID' && $('#watershedSelect option:selected').val() !== "") {
         $("#watershed-info").empty();
@@ -361,44 +311,10 @@ function view_watershed() {
         var subbasin_display_name = $('#watershedSelect option:selected').text().split(' (')[1].replace(')', '');
         var layer_name = JSON.parse($('#geoserver_endpoint').val())[4];
         $("#watershed-info").append('<h3>Current Watershed: ' + watershed_display_name + '</h3><h5>Subbasin Name: ' + subbasin_display_name);
+        listen_for_events(model, watershed, subbasin);
 
         var layerName = workspace + ':' + layer_name;
-        $.ajax({
-            type: 'GET',
-            url: 'get-hiwat-shp/',
-            dataType: 'json',
-            data: {
-                'model': model,
-                'watershed': watershed,
-                'subbasin': subbasin
-            },
-            beforeSend: function () {
-                $('#featureLoader').show();
-            },
-            success: function(result) {
-                wmsLayer = new ol.layer.Vector({
-                    renderMode: 'image',
-                    source: new ol.source.Vector({
-                        features: (new ol.format.GeoJSON()).readFeatures(result.options)
-                    }),
-                    style: new ol.style.Style({
-                        stroke: new ol.style.Stroke({
-                            color: 'blue',
-                            width: 1
-                        })
-                    })
-                });
-
-                map.addLayer(wmsLayer);
-
-                feature_layer = wmsLayer;
-
-                map.getView().fit(result.legend_extent, map.getSize())
-            },
-            complete: function(){
-                $('#featureLoader').hide();
-            }
-        });
+        add_drainage_layer('get-hiwat-shp/', model, watershed, subbasin);
 
     } else {
 
@@ -409,75 +325,357 @@ function view_watershed() {
     }
 }
 
+// Loads the warning points of the current ECMWF watershed in the viewport, clustered at low zoom levels, and
+// reloads them whenever the map moves
 function get_warning_points(model, watershed, subbasin) {
+    map.un('moveend', load_warning_points);
+    map.on('moveend', load_warning_points);
+    warning_query = {'model': model, 'watershed': watershed, 'subbasin': subbasin};
+    two_year_warning.setVisible($('#stp-2-toggle').prop('checked'));
+    ten_year_warning.setVisible($('#stp-10-toggle').prop('checked'));
+    twenty_year_warning.setVisible($('#stp-20-toggle').prop('checked'));
+    load_warning_points();
+}
+
+function load_warning_points() {
+    if (!warning_query) {
+        return;
+    }
+    var query = warning_query;
+    var view = map.getView();
     $.ajax({
         type: 'GET',
         url: 'get-warning-points/',
         dataType: 'json',
-        data: {
-            'model': model,
-            'watershed': watershed,
-            'subbasin': subbasin
-        },
+        data: $.extend({
+            'bbox': view.calculateExtent(map.getSize()).join(','),
+            'zoom': Math.floor(view.getZoom())
+        }, query),
         error: function(error) {
             console.log(error);
         },
         success: function(result) {
+            if (query !== warning_query || result.error) {
+                return;
+            }
+            warnings_clustered = result.clustered;
+            $.each({'warning2': two_year_warning, 'warning10': ten_year_warning, 'warning20': twenty_year_warning}, function(name, layer) {
+                var source = layer.getSource();
+                source.clear();
+                source.addFeatures((result[name] || []).map(warning_feature));
+            });
+        }
+    });
+}
+
+function warning_feature(warning) {
+    var feature = new ol.Feature({
+        geometry: new ol.geom.Point(ol.proj.transform(warning.geometry.coordinates.slice(0, 2), 'EPSG:4326', 'EPSG:3857')),
+        point_size: warning.properties.size,
+        count: warning.properties.count
+    });
+    if (!warning.properties.count) {
+        feature.setId(warning_key(warning));
+    }
+    return feature;
+}
+
+// Style of a warning layer: a triangle, with the number of points of a cluster
+function warning_style(color) {
+    var shape = new ol.style.RegularShape({
+        fill: new ol.style.Fill({ color: color }),
+        stroke: new ol.style.Stroke({ color: 'black', width: 0.5 }),
+        points: 3,
+        radius: 10,
+        angle: 0
+    });
+    var point = new ol.style.Style({ image: shape });
+    var clusters = {};
+    return function(feature) {
+        var count = feature.get('count');
+        if (!count) {
+            return point;
+        }
+        if (!clusters[count]) {
+            clusters[count] = new ol.style.Style({
+                image: new ol.style.RegularShape({
+                    fill: new ol.style.Fill({ color: color }),
+                    stroke: new ol.style.Stroke({ color: 'black', width: 0.5 }),
+                    points: 3,
+                    radius: 14,
+                    angle: 0
+                }),
+                text: new ol.style.Text({
+                    text: String(count),
+                    offsetY: 3,
+                    fill: new ol.style.Fill({ color: 'black' }),
+                    stroke: new ol.style.Stroke({ color: 'white', width: 2 })
+                })
+            });
+        }
+        return clusters[count];
+    };
+}
 
-            map.getLayers().item(1).getSource().clear();
-            map.getLayers().item(2).getSource().clear();
-            map.getLayers().item(3).getSource().clear();
-
-            if (result.warning2 != 'undefined') {
-                var warLen2 = result.warning2.length;
-                for (var i = 0; i < warLen2; ++i) {
-                    var geometry = new ol.geom.Point(ol.proj.transform([result.warning2[i].geometry.coordinates[0],
-                            result.warning2[i].geometry.coordinates[1]
-                        ],
-                        'EPSG:4326', 'EPSG:3857'));
-                    var feature = new ol.Feature({
-                        geometry: geometry,
-                        point_size: result.warning2[i].properties.size
-                    });
-                    map.getLayers().item(1).getSource().addFeature(feature);
+// Draws a LIS or HIWAT drainage network, loading the reaches of the viewport simplified for the zoom level and
+// reloading them when the zoom level changes
+function add_drainage_layer(url, model, watershed, subbasin) {
+    var view = map.getView();
+    var fitted = false;
+    var source = new ol.source.Vector({
+        strategy: ol.loadingstrategy.bbox,
+        loader: function(extent) {
+            $('#featureLoader').show();
+            $.ajax({
+                type: 'GET',
+                url: url,
+                dataType: 'json',
+                data: {
+                    'model': model,
+                    'watershed': watershed,
+                    'subbasin': subbasin,
+                    'bbox': extent.join(','),
+                    'zoom': Math.floor(view.getZoom())
+                },
+                success: function(result) {
+                    if (result.error) {
+                        console.log(result.error);
+                        return;
+                    }
+                    source.addFeatures((new ol.format.GeoJSON()).readFeatures(result.options));
+                    if (!fitted) {
+                        fitted = true;
+                        view.fit(result.legend_extent, map.getSize());
+                    }
+                },
+                complete: function() {
+                    $('#featureLoader').hide();
                 }
-                map.getLayers().item(1).setVisible(false);
-            }
+            });
+        }
+    });
+
+    var level = Math.floor(view.getZoom());
+    // The listener of the previous drainage layer goes with it
+    if (drainage_zoom_listener) {
+        ol.Observable.unByKey(drainage_zoom_listener);
+    }
+    drainage_zoom_listener = view.on('change:resolution', function() {
+        var current = Math.floor(view.getZoom());
+        if (current !== level && map.getLayers().getArray().indexOf(wmsLayer) !== -1 && wmsLayer.getSource() === source) {
+            level = current;
+            source.clear(true);
+        }
+    });
+
+    wmsLayer = new ol.layer.Vector({
+        renderMode: 'image',
+        source: source,
+        style: new ol.style.Style({
+            stroke: new ol.style.Stroke({
+                color: 'blue',
+                width: 1
+            })
+        })
+    });
+
+    map.addLayer(wmsLayer);
+
+    feature_layer = wmsLayer;
+    add_peak_flow_layer(model, watershed, subbasin);
+}
 
-            if (result.warning10 != 'undefined') {
-                var warLen10 = result.warning10.length;
-                for (var j = 0; j < warLen10; ++j) {
-                    var geometry = new ol.geom.Point(ol.proj.transform([result.warning10[j].geometry.coordinates[0],
-                            result.warning10[j].geometry.coordinates[1]
-                        ],
-                        'EPSG:4326', 'EPSG:3857'));
-                    var feature = new ol.Feature({
-                        geometry: geometry,
-                        point_size: result.warning10[j].properties.size
-                    });
-                    map.getLayers().item(2).getSource().addFeature(feature);
+// Draws the forecast peak of every reach. Reaches whose peak exceeds a return period are colored like the warning
+// points, the others (below the 2 year flow, or without return periods) in a neutral grey. While the peak flows are
+// being computed the server answers 202 and the layer asks again after the Retry-After seconds.
+function add_peak_flow_layer(model, watershed, subbasin) {
+    var colors = {'2': 'rgba(255,255,0,0.9)', '10': 'rgba(255,0,0,0.9)', '20': 'rgba(128,0,128,0.9)'};
+    var styles = {};
+    $.each(colors, function(return_period, color) {
+        styles[return_period] = new ol.style.Style({
+            stroke: new ol.style.Stroke({
+                color: color,
+                width: 3
+            })
+        });
+    });
+    var unclassed = new ol.style.Style({
+        stroke: new ol.style.Stroke({
+            color: 'rgba(128,128,128,0.6)',
+            width: 1
+        })
+    });
+
+    map.removeLayer(peak_flow_layer);
+    var layer, source;
+    var load = function(extent, resolution, projection) {
+        $.ajax({
+            type: 'GET',
+            url: 'get-peak-flows/',
+            dataType: 'json',
+            data: {'model': model, 'watershed': watershed, 'subbasin': subbasin},
+            success: function(result, status, xhr) {
+                if (xhr.status === 202) {
+                    var retry = parseInt(xhr.getResponseHeader('Retry-After'), 10) || 10;
+                    setTimeout(function() {
+                        // Only while the layer is still the one on the map
+                        if (peak_flow_layer === layer) {
+                            load(extent, resolution, projection);
+                        }
+                    }, retry * 1000);
+                    return;
                 }
-                map.getLayers().item(2).setVisible(false);
+                if (result.error) {
+                    console.log(result.error);
+                    return;
+                }
+                source.addFeatures(source.getFormat().readFeatures(result, {featureProjection: projection}));
+            }
+        });
+    };
+    source = new ol.source.Vector({
+        format: new ol.format.GeoJSON(),
+        loader: load
+    });
+    layer = new ol.layer.Vector({
+        renderMode: 'image',
+        source: source,
+        style: function(feature) {
+            return styles[feature.get('return_period')] || unclassed;
+        }
+    });
+    peak_flow_layer = layer;
+    map.addLayer(peak_flow_layer);
+}
+
+// Identifies a warning point as the server does in events.py
+function warning_key(warning) {
+    var properties = warning.properties || {};
+    var names = ['comid', 'COMID', 'rivid'];
+    for (var i = 0; i < names.length; i++) {
+        if (properties[names[i]] !== undefined) {
+            return String(properties[names[i]]);
+        }
+    }
+    return warning.geometry.coordinates[0].toFixed(5) + ',' + warning.geometry.coordinates[1].toFixed(5);
+}
+
+// Applies a warnings event: adds the new warning points and removes the ones that are gone
+function apply_warning_diff(return_periods) {
+    var layers_by_period = {'2': 1, '10': 2, '20': 3};
+    $.each(return_periods, function(return_period, diff) {
+        var source = map.getLayers().item(layers_by_period[return_period]).getSource();
+        diff.removed.forEach(function(key) {
+            var feature = source.getFeatureById(key);
+            if (feature) {
+                source.removeFeature(feature);
             }
+        });
+        diff.added.forEach(function(warning) {
+            source.addFeature(warning_feature(warning));
+        });
+    });
+}
 
-            if (result.warning20 != 'undefined') {
-                var warLen20 = result.warning20.length;
-                for (var k = 0; k < warLen20; ++k) {
-                    var geometry = new ol.geom.Point(ol.proj.transform([result.warning20[k].geometry.coordinates[0],
-                            result.warning20[k].geometry.coordinates[1]
-                        ],
-                        'EPSG:4326', 'EPSG:3857'));
-                    var feature = new ol.Feature({
-                        geometry: geometry,
-                        point_size: result.warning20[k].properties.size
-                    });
-                    map.getLayers().item(3).getSource().addFeature(feature);
+// Listens for new forecast cycles, warning points and LIS/HIWAT files of the current watershed and refreshes only
+// the open reach and the warning points that changed. The events are polled for, or pushed over a server-sent event
+// stream when the server says it can hold one; the polling resumes when the stream cannot be opened.
+function listen_for_events(model, watershed, subbasin) {
+    if (event_poll) {
+        clearTimeout(event_poll.timer);
+        if (event_poll.source) {
+            event_poll.source.close();
+        }
+        event_poll.stopped = true;
+    }
+    var poll = event_poll = {'last_id': null, 'timer': null, 'stopped': false, 'source': null, 'no_stream': false};
+    var is_current = function(data) {
+        return data.model === model && data.watershed === watershed && data.subbasin === subbasin;
+    };
+    var handlers = {
+        'cycle': function(data) {
+            if (is_current(data) && current_reach && $('#graph').hasClass('in')) {
+                get_time_series(current_reach.comid, current_reach.tot_drain_area);
+                get_forecast_percent(current_reach.comid);
+            }
+        },
+        'warnings': function(data) {
+            if (is_current(data)) {
+                // Clusters are recounted by the server, single points can take the diff
+                if (warnings_clustered) {
+                    load_warning_points();
+                } else {
+                    apply_warning_diff(data.return_periods);
                 }
-                map.getLayers().item(3).setVisible(false);
             }
+        },
+        'file': function(data) {
+            if (is_current(data)) {
+                $('#info').html('<p class="alert alert-info" style="text-align: center"><strong>A new ' + data.model + ' run is available.</strong></p>');
+                $('#info').removeClass('hidden');
+
+                setTimeout(function() {
+                    $('#info').addClass('hidden')
+                }, 5000);
+            }
+        },
+    };
 
+    var next = function(seconds) {
+        if (!poll.stopped) {
+            poll.timer = setTimeout(request, seconds * 1000);
         }
-    });
+    };
+    var open_stream = function(seconds) {
+        var data = {'model': model, 'watershed': watershed, 'subbasin': subbasin, 'last_id': poll.last_id};
+        var source = poll.source = new EventSource('events-stream/?' + $.param(data));
+        $.each(handlers, function(name, handler) {
+            source.addEventListener(name, function(event) {
+                poll.last_id = parseInt(event.lastEventId, 10);
+                handler(JSON.parse(event.data));
+            });
+        });
+        source.onerror = function() {
+            // EventSource reconnects by itself unless the stream was refused or failed for good
+            if (source.readyState === EventSource.CLOSED && poll.source === source) {
+                poll.source = null;
+                poll.no_stream = true;
+                next(seconds);
+            }
+        };
+    };
+    var request = function() {
+        var data = {'model': model, 'watershed': watershed, 'subbasin': subbasin};
+        if (poll.last_id !== null) {
+            data['last_id'] = poll.last_id;
+        }
+        $.ajax({
+            type: 'GET',
+            url: 'events/',
+            dataType: 'json',
+            data: data,
+            success: function(result) {
+                if (poll.stopped || result.error) {
+                    return;
+                }
+                poll.last_id = result.last_id;
+                result.events.forEach(function(event) {
+                    if (handlers[event.event]) {
+                        handlers[event.event](event.data);
+                    }
+                });
+                if (result.stream && window.EventSource && !poll.no_stream) {
+                    open_stream(result.poll);
+                } else {
+                    next(result.poll);
+                }
+            },
+            error: function() {
+                next(60);
+            }
+        });
+    };
+    request();
 }
 
 function get_available_dates(model, watershed, subbasin, comid) {
@@ -570,17 +768,33 @@ function get_return_periods(watershed, subbasin, comid) {
     });
 }
 
-function get_time_series(comid, tot_drain_area) {
+function show_stale_notice(data) {
+    if (data.stale) {
+        $('#info').html('<p class="alert alert-warning" style="text-align: center"><strong>The forecast service is not responding. Showing data retrieved ' + Math.round(data.age / 60) + ' minutes ago.</strong></p>');
+        $('#info').removeClass('hidden');
+
+        setTimeout(function() {
+            $('#info').addClass('hidden')
+        }, 5000);
+    }
+}
+
+function get_time_series(comid, tot_drain_area, start, end) {
     $loading.removeClass('hidden');
     $('#long-term-chart').addClass('hidden');
     $('#dates').addClass('hidden');
+    var data = {
+        'comid': comid,
+        'tot_drain_area': tot_drain_area,
+    };
+    if (start && end) {
+        data['start'] = start;
+        data['end'] = end;
+    }
     $.ajax({
         type: 'GET',
         url: 'get-time-series/',
-        data: {
-            'comid': comid,
-            'tot_drain_area': tot_drain_area,
-        },
+        data: data,
         error: function() {
             $('#info').html('<p class="alert alert-danger" style="text-align: center"><strong>An unknown error occurred while retrieving the forecast</strong></p>');
             $('#info').removeClass('hidden');
@@ -595,9 +809,13 @@ function get_time_series(comid, tot_drain_area) {
                 $loading.addClass('hidden');
                 $('#long-term-chart').removeClass('hidden');
                 $('#long-term-chart').html(data['plot']);
+                show_stale_notice(data);
 
                 //resize main graph
                 Plotly.Plots.resize($("#long-term-chart .js-plotly-plot")[0]);
+                requery_on_zoom($("#long-term-chart .js-plotly-plot")[0], function(start, end) {
+                    get_time_series(comid, tot_drain_area, start, end);
+                });
 
                 var params = {
                     reach_id: comid,
@@ -622,21 +840,30 @@ function get_time_series(comid, tot_drain_area) {
     });
 }
 
-function get_historic_data(comid, tot_drain_area) {
+function get_historic_data(comid, tot_drain_area, start, end) {
     $('#his-view-file-loading').removeClass('hidden');
     m_downloaded_historical_streamflow = true;
+    var data = {
+        'comid': comid,
+        'tot_drain_area': tot_drain_area,
+    };
+    if (start && end) {
+        data['start'] = start;
+        data['end'] = end;
+    }
     $.ajax({
         type: 'GET',
         url: 'get-historic-data',
-        data: {
-            'comid': comid,
-            'tot_drain_area': tot_drain_area,
-        },
+        data: data,
         success: function(data) {
             if (!data.error) {
                 $('#his-view-file-loading').addClass('hidden');
                 $('#historical-chart').removeClass('hidden');
                 $('#historical-chart').html(data['plot']);
+                show_stale_notice(data);
+                requery_on_zoom($("#historical-chart .js-plotly-plot")[0], function(start, end) {
+                    get_historic_data(comid, tot_drain_area, start, end);
+                });
 
                 var params = {
                     reach_id: comid,
@@ -661,6 +888,22 @@ function get_historic_data(comid, tot_drain_area) {
     });
 }
 
+// The server sends long hydrographs downsampled; a zoomed or reset chart asks again for its time window, which is
+// returned at full resolution once it is short enough. The series is cached per reach on the server, so a window
+// costs no upstream request.
+function requery_on_zoom(plot, requery) {
+    if (!plot || !plot.on) {
+        return;
+    }
+    plot.on('plotly_relayout', function(event) {
+        if (event['xaxis.range[0]'] && event['xaxis.range[1]']) {
+            requery(event['xaxis.range[0]'], event['xaxis.range[1]']);
+        } else if (event['xaxis.autorange']) {
+            requery();
+        }
+    });
+}
+
 function get_flow_duration_curve(comid, tot_drain_area) {
     $('#fdc-view-file-loading').removeClass('hidden');
     m_downloaded_flow_duration = true;
@@ -706,12 +949,48 @@ function get_forecast_percent(comid) {
             }, 5000);
         },
         success: function(data) {
-            $("#mytable").html(data['table']);
+            if (data.error) {
+                $('#mytable').html('');
+                return;
+            }
+            $("#mytable").html(probabilities_table(data));
             $("#mytable").removeClass('hidden');
         }
     })
 }
 
+var return_period_colors = {
+    2: 'rgba(254, 240, 1, .4)',
+    5: 'rgba(253, 154, 1, .4)',
+    10: 'rgba(255, 56, 5, .4)',
+    25: 'rgba(255, 0, 0, .4)',
+    50: 'rgba(128, 0, 106, .4)',
+    100: 'rgba(128, 0, 246, .4)'
+};
+
+function probabilities_table(data) {
+    var months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'];
+    var html = '<h4 style="text-align: center">Percent of Ensembles that Exceed Return Periods</h4>' +
+        '<table id="returntable" align="center"><tbody><tr><th>Dates</th>';
+    data.days.forEach(function(day) {
+        var parts = day.split('-');
+        html += '<th>' + months[parseInt(parts[1], 10) - 1] + ' ' + parts[2] + '</th>';
+    });
+    html += '</tr>';
+    data.return_periods.forEach(function(rp, i) {
+        html += '<tr><td>' + rp + '-yr Return Period</td>';
+        data.percent[i].forEach(function(percent) {
+            if (percent !== 0) {
+                html += '<td style="background-color: ' + return_period_colors[rp] + '">' + percent + '%</td>';
+            } else {
+                html += '<td>-</td>';
+            }
+        });
+        html += '</tr>';
+    });
+    return html + '</tbody></table>';
+}
+
 function map_events() {
     map.on('pointermove', function(evt) {
         if (evt.dragging) {
@@ -775,6 +1054,7 @@ function map_events() {
                         var comid = result["features"][0]["properties"]["COMID"];
                         var tot_drain_area = result["features"][0]["properties"]["Tot_Drain_"];
                         tot_drain_area = (tot_drain_area/1000000).toFixed(0)
+                        current_reach = {'comid': comid, 'tot_drain_area': tot_drain_area};
 
                         get_time_series(comid, tot_drain_area);
                         get_historic_data(comid, tot_drain_area);
@@ -829,7 +1109,8 @@ function add_feature(model, workspace, comid) {
             data: {
                 'model': model,
                 'watershed': workspace[0],
-                'subbasin': workspace[1]
+                'subbasin': workspace[1],
+                'comid': comid
             },
             success: function(result) {
                 JSON.parse(result.options).features.forEach(function(elm) {
@@ -867,7 +1148,8 @@ function add_feature(model, workspace, comid) {
             data: {
                 'model': model,
                 'watershed': workspace[0],
-                'subbasin': workspace[1]
+                'subbasin': workspace[1],
+                'comid': comid
             },
             success: function(result) {
                 JSON.parse(result.options).features.forEach(function(elm) {
@@ -0,0 +1,127 @@
+"""
+Access to the RAPID Qout NetCDF files of the LIS and HIWAT models.
+
+The HDF5 library under netCDF4 is not built thread-safe, and netCDF4 releases the GIL while it reads, so two threads
+reading NetCDF files at once (comparison sources, table scans, exports, concurrent requests) can crash the process.
+Every NetCDF call of the app holds HDF5_LOCK; long scans take it per block, so requests wait one block at most.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+import netCDF4 as nc
+import numpy as np
+
+from .app import Hydroviewer as app
+
+MODEL_PATH_SETTINGS = {
+    'LIS-RAPID': 'lis_path',
+    'HIWAT-RAPID': 'hiwat_path',
+}
+HDF5_LOCK = threading.RLock()
+# Flows read at once by read_reach_blocks
+BLOCK_VALUES = 2 * 1024 * 1024
+
+
+def qout_path(model, watershed, subbasin):
+    """
+    Returns the path of the Qout file of a watershed/subbasin for model ('LIS-RAPID' or 'HIWAT-RAPID').
+    """
+    path = os.path.join(app.get_custom_setting(MODEL_PATH_SETTINGS[model]), '-'.join([watershed, subbasin]))
+    filename = [f for f in os.listdir(path) if 'Qout' in f]
+    return os.path.join(path, filename[0])
+
+
+def read_series(model, watershed, subbasin, comid):
+    """
+    Returns (times, flows) of a single reach, times in seconds since the epoch.
+    """
+    times, rivids, flows = read_reaches(qout_path(model, watershed, subbasin), [int(comid)])
+    if not len(rivids):
+        raise ValueError('Reach {0} not found in the {1} Qout file of {2}-{3}'.format(comid, model, watershed,
+                                                                                   subbasin))
+    return times, flows[:, 0]
+
+
+@contextmanager
+def dataset(path, mode='r', **kwargs):
+    """
+    A netCDF4 Dataset opened and closed under HDF5_LOCK. Reads and writes of it must hold HDF5_LOCK as well.
+    """
+    with HDF5_LOCK:
+        res = nc.Dataset(path, mode, **kwargs)
+    try:
+        yield res
+    finally:
+        with HDF5_LOCK:
+            res.close()
+
+
+def read_rivids(path):
+    with HDF5_LOCK, nc.Dataset(path, 'r') as res:
+        return np.asarray(res.variables['rivid'][:])
+
+
+def read_reaches(path, comids=None):
+    """
+    Reads a Qout file and returns (times, rivids, flows): times in seconds since the epoch, the reach ids, and a
+    float (time, reach) array of flows with missing values as NaN. When comids is given, only those reaches are
+    returned, in that order; unknown comids are dropped.
+    """
+    with HDF5_LOCK, nc.Dataset(path, 'r') as res:
+        times = np.asarray(res.variables['time'][:])
+        rivids = np.asarray(res.variables['rivid'][:])
+
+        if comids is None:
+            flows = res.variables['Qout'][:]
+            return times, rivids, np.ma.filled(flows.astype(float), np.nan)
+
+        positions = reach_positions(rivids, comids)
+        positions = positions[positions >= 0]
+        if not len(positions):
+            return times, rivids[:0], np.empty((len(times), 0))
+
+        # Read the contiguous span of columns once and pick the reaches in memory
+        lo, hi = positions.min(), positions.max()
+        flows = res.variables['Qout'][:, lo:hi + 1]
+        flows = np.ma.filled(flows.astype(float), np.nan)[:, positions - lo]
+        return times, rivids[positions], flows
+
+
+def read_reach_blocks(path, comids, block_values=BLOCK_VALUES):
+    """
+    Yields (times, rivids, flows) like read_reaches for blocks of the given reaches, in the order of the file, each
+    holding at most block_values flows (one reach at least). HDF5_LOCK is held for one block at a time.
+    """
+    with dataset(path) as res:
+        with HDF5_LOCK:
+            times = np.asarray(res.variables['time'][:])
+            rivids = np.asarray(res.variables['rivid'][:])
+        positions = reach_positions(rivids, comids)
+        positions = np.unique(positions[positions >= 0])
+        width = max(1, block_values // max(1, len(times)))
+        qout_var = res.variables['Qout']
+        start = 0
+        while start < len(positions):
+            # The reaches whose span of columns fits in a block
+            stop = start + np.searchsorted(positions[start:], positions[start] + width)
+            block = positions[start:stop]
+            lo, hi = block[0], block[-1]
+            with HDF5_LOCK:
+                flows = qout_var[:, lo:hi + 1]
+            yield times, rivids[block], np.ma.filled(flows.astype(float), np.nan)[:, block - lo]
+            start = stop
+
+
+def reach_positions(rivids, comids):
+    """
+    Returns the column of each comid in rivids, -1 for comids that are not in the file.
+    """
+    comids = np.asarray(comids, dtype=rivids.dtype)
+    if not len(rivids):
+        return np.full(len(comids), -1)
+    order = np.argsort(rivids)
+    found = np.searchsorted(rivids, comids, sorter=order)
+    found = np.clip(found, 0, len(rivids) - 1)
+    positions = order[found]
+    return np.where(rivids[positions] == comids, positions, -1)
@@ -0,0 +1,115 @@
+"""
+Per-file tables precomputed from the LIS and HIWAT Qout files.
+
+A FileTables computes a dict of arrays from a Qout file once, saves it as <workspace>/<name>/<hash>.npz and reuses
+it, from memory or from disk, for as long as the file keeps its mtime and size. A table that is not available yet
+is computed on a single background thread shared by every FileTables, so at most one Qout file is scanned at a
+time, and get() returns None until it is done.
+"""
+import hashlib
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .app import Hydroviewer as app
+
+_executor = ThreadPoolExecutor(max_workers=1)
+
+
+class FileTables(object):
+
+    def __init__(self, name, compute, layout=1):
+        """
+        compute(path) returns the table of a Qout file as a dict of arrays, or None when the file has no table
+        (which is remembered as well). layout is raised whenever compute changes the arrays it returns, so tables
+        saved in an older layout are computed again.
+        """
+        self.name = name
+        self.compute = compute
+        self.layout = layout
+        self._lock = threading.Lock()
+        self._tables = {}
+        self._pending = set()
+
+    def get(self, path):
+        """
+        The table of a Qout file, or None while it is computed or when the file has none.
+        """
+        version = _version(path) + (self.layout,)
+        with self._lock:
+            cached = self._tables.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        try:
+            return self._load(path, version)
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+
+        with self._lock:
+            if path not in self._pending:
+                self._pending.add(path)
+                _executor.submit(self._build_in_background, path)
+        return None
+
+    def build(self, path):
+        """
+        Computes and saves the table of a Qout file now, unless the saved one is current, and returns it.
+        """
+        version = _version(path) + (self.layout,)
+        try:
+            return self._load(path, version)
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+        table = self.compute(path)
+        cache_path = self._cache_path(path)
+        directory = os.path.dirname(cache_path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        tmp = '{0}.{1}.tmp'.format(cache_path, uuid.uuid4().hex[:8])
+        with open(tmp, 'wb') as f:
+            np.savez(f, version=np.array(version), **(table or {}))
+        os.replace(tmp, cache_path)
+        with self._lock:
+            self._tables[path] = (version, table)
+        return table
+
+    def _load(self, path, version):
+        with np.load(self._cache_path(path)) as saved:
+            if tuple(saved['version']) != version:
+                raise ValueError('Outdated table')
+            names = [name for name in saved.files if name != 'version']
+            table = {name: saved[name] for name in names} if names else None
+        with self._lock:
+            self._tables[path] = (version, table)
+        return table
+
+    def _build_in_background(self, path):
+        try:
+            self.build(path)
+        except Exception as e:
+            print('Computing the {0} of {1} failed: {2}'.format(self.name.replace('_', ' '), path, e))
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+
+    def _cache_path(self, path):
+        digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(app.get_app_workspace().path, self.name, digest + '.npz')
+
+
+def _version(path):
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def time_blocks(res, max_values):
+    """
+    (lo, hi) bounds of the blocks of time steps of an open Qout dataset holding at most max_values flows each.
+    """
+    n_steps = len(res.variables['time'])
+    steps = max(1, max_values // max(1, len(res.variables['rivid'])))
+    return [(lo, min(lo + steps, n_steps)) for lo in range(0, n_steps, steps)]
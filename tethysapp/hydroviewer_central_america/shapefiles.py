@@ -0,0 +1,125 @@
+"""
+Minimal reader of polyline shapefiles (.shp geometry and .dbf attributes), enough for drainage-line networks.
+
+Only the null and PolyLine/PolyLineZ/PolyLineM shape types are read; Z and M values are dropped. Geographic
+coordinates (a .prj starting with GEOGCS, or no .prj and every coordinate within longitude/latitude bounds) are
+projected to web mercator (EPSG:3857), so every network comes out in the map's projection.
+"""
+import os
+import struct
+
+import numpy as np
+
+POLYLINE_TYPES = (3, 13, 23)
+EARTH_RADIUS = 6378137.0
+MAX_LATITUDE = 85.0511287798
+# Metres per pixel of EPSG:3857 at zoom level 0 (256 pixel tiles)
+ZOOM_0_RESOLUTION = 2 * np.pi * EARTH_RADIUS / 256
+
+
+def read(path):
+    """
+    Reads a polyline shapefile and returns (records, lines): the .dbf attributes as a list of dicts and, for each
+    record, a list of (n, 2) float arrays, one per part, in EPSG:3857.
+    """
+    base = os.path.splitext(path)[0]
+    lines = read_shp(base + '.shp')
+    records = read_dbf(base + '.dbf') if os.path.exists(base + '.dbf') else [{} for _ in lines]
+    geographic = is_geographic(base + '.prj')
+    if geographic is None:
+        geographic = all(np.all(np.abs(part) <= (180, 90)) for parts in lines for part in parts)
+    if geographic:
+        lines = [[to_web_mercator(part) for part in parts] for parts in lines]
+    return records, lines
+
+
+def read_shp(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    file_code, = struct.unpack_from('>i', data, 0)
+    if file_code != 9994:
+        raise ValueError('{0} is not a shapefile'.format(path))
+
+    lines = []
+    offset = 100
+    while offset + 8 <= len(data):
+        _, words = struct.unpack_from('>ii', data, offset)
+        content = offset + 8
+        offset = content + 2 * words
+        shape_type, = struct.unpack_from('<i', data, content)
+        if shape_type == 0:
+            lines.append([])
+            continue
+        if shape_type not in POLYLINE_TYPES:
+            raise ValueError('Unsupported shape type {0} in {1}'.format(shape_type, path))
+        n_parts, n_points = struct.unpack_from('<ii', data, content + 36)
+        parts = np.frombuffer(data, dtype='<i4', count=n_parts, offset=content + 44)
+        points = np.frombuffer(data, dtype='<f8', count=2 * n_points,
+                               offset=content + 44 + 4 * n_parts).reshape(n_points, 2)
+        bounds = list(parts) + [n_points]
+        lines.append([points[bounds[i]:bounds[i + 1]].copy() for i in range(n_parts)])
+    return lines
+
+
+def read_dbf(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    n_records, header_length, record_length = struct.unpack_from('<IHH', data, 4)
+
+    fields = []
+    offset = 32
+    while data[offset:offset + 1] != b'\r' and offset + 32 <= header_length:
+        name = data[offset:offset + 11].split(b'\0')[0].decode('ascii', 'replace')
+        kind = data[offset + 11:offset + 12].decode('ascii')
+        length, decimals = data[offset + 16], data[offset + 17]
+        fields.append((name, kind, length, decimals))
+        offset += 32
+
+    records = []
+    for i in range(n_records):
+        start = header_length + i * record_length
+        position = start + 1
+        record = {}
+        for name, kind, length, decimals in fields:
+            record[name] = _dbf_value(data[position:position + length], kind, decimals)
+            position += length
+        records.append(record)
+    return records
+
+
+def _dbf_value(raw, kind, decimals):
+    text = raw.decode('latin-1').strip()
+    if kind in ('N', 'F'):
+        if not text or text.startswith('*'):
+            return None
+        value = float(text)
+        return int(value) if kind == 'N' and decimals == 0 else value
+    if kind == 'L':
+        return text.upper() in ('T', 'Y') if text not in ('', '?') else None
+    return text
+
+
+def is_geographic(prj_path):
+    """
+    Whether a .prj describes geographic coordinates, None when there is no .prj.
+    """
+    try:
+        with open(prj_path) as f:
+            return f.read().lstrip().upper().startswith('GEOGCS')
+    except (IOError, OSError):
+        return None
+
+
+def to_web_mercator(points):
+    points = np.asarray(points, dtype=float)
+    x = np.radians(points[:, 0]) * EARTH_RADIUS
+    lat = np.radians(np.clip(points[:, 1], -MAX_LATITUDE, MAX_LATITUDE))
+    y = np.log(np.tan(np.pi / 4 + lat / 2)) * EARTH_RADIUS
+    return np.column_stack([x, y])
+
+
+def resolution(level):
+    """
+    Metres per pixel of web mercator at a zoom level.
+    """
+    return ZOOM_0_RESOLUTION / 2 ** level
@@ -0,0 +1,148 @@
+"""
+Cache tier shared by the worker processes of a host, behind the in-process cache of cache.py.
+
+A DiskStore keeps every entry pickled in its own file, <directory>/<sha1 of the key>.pkl, holding the key, the time
+the payload was built, the payload and its validator (see snapshots.py). Entries are written to a temporary file
+and renamed into place, so a reader in another worker sees either the old entry or the new one, never part of one.
+Reading an entry touches its file, as do the workers still using their in-process copy of it (see
+cache.TOUCH_SECONDS), and once the files written since the last check add up to EVICT_FRACTION of MAX_BYTES the
+directory is trimmed to TRIM_FRACTION of MAX_BYTES, least recently used entries first.
+
+Payloads that cannot be pickled are only kept in process. Errors of the store are logged and otherwise ignored: a
+failing shared tier costs a rebuild, never a request.
+"""
+import hashlib
+import os
+import pickle
+import threading
+import time
+import uuid
+
+MAX_BYTES = 512 * 1024 * 1024
+TRIM_FRACTION = 0.8
+EVICT_FRACTION = 0.05
+SUFFIX = '.pkl'
+ORPHAN_SECONDS = 60 * 60
+
+
+class DiskStore(object):
+
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Start with a check, the directory may have grown while no process was running
+        self._written = max_bytes
+
+    def get(self, key):
+        """
+        (payload, stored time, validator) of key, or None when the store has no entry for it.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                saved_key, stored, value, validator = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print('Reading {0} from the shared cache failed: {1}'.format(key, e))
+            return None
+        if saved_key != key:
+            return None
+        self.touch(key)
+        return value, stored, validator
+
+    def touch(self, key):
+        """
+        Marks the entry of key as used now, keeping it from eviction.
+        """
+        try:
+            os.utime(self._path(key), None)
+        except OSError:
+            pass
+
+    def put(self, key, value, stored, validator=None):
+        try:
+            content = pickle.dumps((key, stored, value, validator), protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # Not every payload pickles; those stay in process
+            return
+        path = self._path(key)
+        tmp = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex[:8])
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                f.write(content)
+            os.replace(tmp, path)
+        except OSError as e:
+            print('Writing {0} to the shared cache failed: {1}'.format(key, e))
+            _remove(tmp)
+            return
+        with self._lock:
+            self._written += len(content)
+            evict = self._written >= self.max_bytes * EVICT_FRACTION
+            if evict:
+                self._written = 0
+        if evict:
+            self.evict()
+
+    def invalidate(self, key):
+        _remove(self._path(key))
+
+    def clear(self):
+        for entry in self._entries():
+            _remove(entry.path)
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the store is within TRIM_FRACTION of max_bytes.
+        """
+        entries = []
+        for entry in self._entries(suffix=''):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if entry.name.endswith('.tmp'):
+                # Left behind by a writer that died before renaming it
+                if time.time() - stat.st_mtime > ORPHAN_SECONDS:
+                    _remove(entry.path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * TRIM_FRACTION:
+                break
+            _remove(path)
+            total -= size
+
+    def size(self):
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self, suffix=SUFFIX):
+        try:
+            return [entry for entry in os.scandir(self.directory) if entry.name.endswith(suffix)]
+        except OSError:
+            return []
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + SUFFIX)
+
+
+def default_store():
+    """
+    The DiskStore of the app workspace.
+    """
+    from .app import Hydroviewer as app
+
+    return DiskStore(os.path.join(app.get_app_workspace().path, 'shared_cache'))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,195 @@
+"""
+Snapshots of the hottest payload cache entries, so a restarted worker starts warm.
+
+Every SNAPSHOT_SECONDS each worker merges its in-process entries of the snapshotted kinds into one file per kind,
+<workspace>/snapshots/<kind>.snap: a zlib-compressed pickle of {key: (stored time, validator, payload)} keeping
+the MAX_ENTRIES most recent entries no older than MAX_AGE. Workers merge under a lock on the kind's .lock file and
+write to a temporary file renamed into place.
+
+A worker reads the snapshot of a kind the first time it misses a key of that kind (and again when the file
+changes) and hands the entry to the cache only while its validator still holds:
+
+- catalogues and return periods are always valid; an expired one is served stale and rebuilt like any other;
+- ECMWF reach products carry the newest forecast cycle known when they were built and are dropped once a newer
+  cycle is known, so a restart never serves a previous cycle as current;
+- LIS and HIWAT comparison series carry the mtime and size of their Qout file and are dropped once it changes.
+
+The validator of an entry is recorded by the cache when the entry is built, not when it is saved. LIS and HIWAT
+charts are not in the payload cache (they are revalidated against their Qout file instead) and are not snapshotted.
+"""
+import fcntl
+import os
+import pickle
+import threading
+import time
+import uuid
+import zlib
+
+from . import cache
+
+SNAPSHOT_SECONDS = 5 * 60
+MAX_AGE = 2 * 24 * 60 * 60
+MAX_ENTRIES = 2000
+# Snapshot file of each kind of cache key, by the first item of the key
+KINDS = {
+    'forecast_cycles': 'catalogues',
+    'return_periods': 'return_periods',
+    'forecast_stats_plot': 'reach_products',
+    'forecast_probabilities': 'reach_products',
+    'historic_plot': 'reach_products',
+    'compare_source': 'reach_products',
+}
+CYCLE_KINDS = ('forecast_stats_plot', 'forecast_probabilities')
+
+
+def kind(key):
+    return KINDS.get(key[0]) if isinstance(key, tuple) and key else None
+
+
+def current_cycle(snapshots=None):
+    """
+    The newest forecast cycle (YYYYMMDDHHMM) of the catalogues in the cache, or of the catalogue snapshot when the
+    cache has none. None when no catalogue is known.
+    """
+    from .forecast_cycles import cycle_key
+
+    catalogues = [value for _, value, _, _ in cache.entries('forecast_cycles')]
+    if not catalogues and snapshots is not None:
+        catalogues = [value for _, _, value in snapshots.load('catalogues').values()]
+    latest = [cycle_key(c.latest()) for c in catalogues if c.latest() is not None]
+    return max(latest) if latest else None
+
+
+def validator(key, snapshots=None):
+    """
+    What the payload of key was built from: the current forecast cycle, the version of a Qout file or nothing.
+    """
+    if key[0] in CYCLE_KINDS:
+        return 'cycle', current_cycle(snapshots)
+    if key[0] == 'compare_source':
+        from . import qout
+
+        stat = os.stat(qout.qout_path(key[1], key[2], key[3]))
+        return 'file', stat.st_mtime, stat.st_size
+    return None
+
+
+class Snapshots(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._loaded = {}
+        self._thread = None
+
+    def lookup(self, key):
+        """
+        (payload, stored time, validator) of key from its snapshot while still valid, otherwise None.
+        """
+        name = kind(key)
+        if name is None:
+            return None
+        self.start()
+        entry = self.load(name).get(key)
+        if entry is None:
+            return None
+        stored, saved_validator, value = entry
+        try:
+            if validator(key, self) != saved_validator:
+                return None
+        except Exception:
+            return None
+        return value, stored, saved_validator
+
+    def validator(self, key):
+        """
+        What the payload of a snapshotted key is built from now (see validator()), None for other keys.
+        """
+        if kind(key) is None:
+            return None
+        try:
+            return validator(key, self)
+        except Exception:
+            return None
+
+    def load(self, name):
+        """
+        {key: (stored, validator, payload)} of a snapshot, read again when the file changes.
+        """
+        path = os.path.join(self.directory, name + '.snap')
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return {}
+        with self._lock:
+            loaded = self._loaded.get(name)
+        if loaded is not None and loaded[0] == mtime:
+            return loaded[1]
+        entries = _read(path)
+        with self._lock:
+            self._loaded[name] = (mtime, entries)
+        return entries
+
+    def save(self):
+        """
+        Merges the in-process entries of every kind into their snapshots.
+        """
+        collected = {}
+        for key, value, stored, saved_validator in cache.entries(*KINDS):
+            collected.setdefault(kind(key), {})[key] = (stored, saved_validator, value)
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        for name, entries in collected.items():
+            path = os.path.join(self.directory, name + '.snap')
+            with open(os.path.join(self.directory, name + '.lock'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                merged = _read(path)
+                for key, entry in entries.items():
+                    if key not in merged or merged[key][0] < entry[0]:
+                        merged[key] = entry
+                oldest = time.time() - MAX_AGE
+                kept = sorted((e for e in merged.items() if e[1][0] >= oldest), key=lambda e: e[1][0])[-MAX_ENTRIES:]
+                _write(path, dict(kept))
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='cache-snapshots', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(SNAPSHOT_SECONDS)
+            try:
+                self.save()
+            except Exception as e:
+                print('Saving the cache snapshots failed: {0}'.format(e))
+
+
+def default_snapshots():
+    """
+    The Snapshots of the app workspace.
+    """
+    from .app import Hydroviewer as app
+
+    return Snapshots(os.path.join(app.get_app_workspace().path, 'snapshots'))
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as f:
+            return pickle.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print('Reading the cache snapshot {0} failed: {1}'.format(path, e))
+        return {}
+
+
+def _write(path, entries):
+    tmp = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex[:8])
+    with open(tmp, 'wb') as f:
+        f.write(zlib.compress(pickle.dumps(entries, protocol=pickle.HIGHEST_PROTOCOL), 6))
+    os.replace(tmp, path)
@@ -0,0 +1,5 @@
+from .. import cache
+
+# Tests never use the shared cache or the snapshots of the app workspace; the tests of those tiers set up their own.
+cache.set_shared_store(None)
+cache.set_snapshots(None)
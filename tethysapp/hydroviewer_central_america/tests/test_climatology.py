@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import netCDF4 as nc
+import numpy as np
+
+from .. import climatology
+
+
+class ClimatologyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_qout(self, times, flows):
+        path = os.path.join(self.directory, 'Qout.nc')
+        with nc.Dataset(path, 'w') as res:
+            res.createDimension('time', len(times))
+            res.createDimension('rivid', flows.shape[1])
+            res.createVariable('time', 'i8', ('time',))[:] = times.astype('datetime64[s]').astype('i8')
+            res.createVariable('rivid', 'i4', ('rivid',))[:] = np.arange(flows.shape[1]) + 1
+            res.createVariable('Qout', 'f4', ('time', 'rivid'))[:] = flows
+        return path
+
+    def test_streamed_table_matches_full_statistics(self):
+        rng = np.random.RandomState(0)
+        times = np.arange(np.datetime64('2018-01-01'), np.datetime64('2021-01-01'))
+        flows = rng.lognormal(3, 1, size=(len(times), 4))
+        flows[5, 2] = np.nan
+        path = self.write_qout(times, flows)
+
+        table = climatology.compute_table(path, block_values=4 * 50)
+        np.testing.assert_allclose(table['mean'], np.nanmean(flows, axis=0), rtol=1e-5)
+        for i, p in enumerate(climatology.PERCENTILES):
+            # Within the width of a histogram bin
+            np.testing.assert_allclose(table['percentiles'][i], np.nanpercentile(flows, p, axis=0), rtol=0.13)
+
+        days = climatology.calendar_day(times)
+        self.assertEqual(table['days'].tolist(), list(range(366)))
+        np.testing.assert_allclose(table['day_mean'][40], flows[days == 40].mean(axis=0), rtol=1e-5)
+        np.testing.assert_allclose(table['current'], flows[-1], rtol=1e-6)
+        np.testing.assert_allclose(table['normal'], table['day_mean'][days[-1]])
+        expected_rank = 100.0 * (flows < flows[-1]).sum(axis=0) / (~np.isnan(flows)).sum(axis=0)
+        # Within the share of the flows in one histogram bin
+        np.testing.assert_allclose(table['rank'], expected_rank, atol=5.0)
+
+    def test_sketch_bins(self):
+        bins = climatology.sketch_bins(np.array([0.0, -1.0, 1e-4, 1e-3, 1.0, 1e7]))
+        self.assertEqual(bins[:3].tolist(), [0, 0, 0])
+        self.assertEqual(bins[3], 1)
+        self.assertEqual(bins[-1], climatology.SKETCH_BINS - 1)
+
+    def test_calendar_days_ignore_leap_years(self):
+        days = climatology.calendar_day(np.array(['2019-02-28', '2019-03-01', '2020-02-29', '2020-03-01',
+                                                  '2020-12-31T18:00'], dtype='datetime64[s]'))
+        self.assertEqual(days.tolist(), [58, 60, 59, 60, 365])
+        self.assertEqual(climatology.calendar_label(60), '03-01')
+
+    def test_only_covered_days_are_kept(self):
+        times = np.arange(np.datetime64('2019-02-27'), np.datetime64('2019-03-03'))
+        leap = np.arange(np.datetime64('2020-02-27'), np.datetime64('2020-03-03'))
+        flows = np.r_[np.full((4, 2), 1.0), np.full((5, 2), 3.0)]
+        path = self.write_qout(np.r_[times, leap], flows)
+
+        table = climatology.compute_table(path)
+        self.assertEqual(table['days'].tolist(), [57, 58, 59, 60, 61])
+        self.assertEqual(table['day_mean'][:, 0].tolist(), [2.0, 2.0, 3.0, 2.0, 2.0])
+        self.assertEqual(table['normal'].tolist(), [2.0, 2.0])
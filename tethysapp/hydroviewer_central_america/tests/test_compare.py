@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import netCDF4 as nc
+import numpy as np
+
+from .. import cache, compare
+
+
+class AlignTestCase(unittest.TestCase):
+
+    def test_align_on_common_axis(self):
+        hour = 3600
+        sources = {
+            'ECMWF-RAPID': (np.array([0, 6 * hour]), np.array([0.0, 6.0])),
+            'LIS-RAPID': (np.array([3 * hour, 4 * hour, 9 * hour]), np.array([3.0, np.nan, 9.0])),
+        }
+        axis, aligned = compare.align(sources, step=3 * hour)
+        np.testing.assert_array_equal(axis, [0, 3 * hour, 6 * hour, 9 * hour])
+        np.testing.assert_array_equal(aligned['ECMWF-RAPID'], [0.0, 3.0, 6.0, np.nan])
+        np.testing.assert_array_equal(aligned['LIS-RAPID'], [np.nan, 3.0, 6.0, 9.0])
+
+    def test_step_is_widened_for_long_axes(self):
+        sources = {'LIS-RAPID': (np.array([0, 10 ** 8]), np.array([1.0, 2.0]))}
+        axis, _ = compare.align(sources, step=60)
+        self.assertLessEqual(len(axis), compare.MAX_POINTS + 1)
+
+
+class ReadSourceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(cache.clear)
+        self.path = os.path.join(self.directory, 'Qout.nc')
+
+    def write(self, flows, mtime):
+        with nc.Dataset(self.path, 'w') as res:
+            res.createDimension('time', 2)
+            res.createDimension('rivid', 1)
+            res.createVariable('time', 'i8', ('time',))[:] = [0, 3600]
+            res.createVariable('rivid', 'i4', ('rivid',))[:] = [11]
+            res.createVariable('Qout', 'f4', ('time', 'rivid'))[:] = [[flow] for flow in flows]
+        os.utime(self.path, (mtime, mtime))
+
+    def test_new_qout_file_is_read_again(self):
+        with mock.patch.object(compare.qout, 'qout_path', return_value=self.path):
+            self.write([1.0, 2.0], 1000)
+            self.assertEqual(compare.read_source('LIS-RAPID', 11, 'ws', 'sb')[1].tolist(), [1.0, 2.0])
+            self.write([3.0, 4.0], 2000)
+            self.assertEqual(compare.read_source('LIS-RAPID', 11, 'ws', 'sb')[1].tolist(), [3.0, 4.0])
@@ -0,0 +1,53 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from .. import downsample
+
+
+class DownsampleTestCase(unittest.TestCase):
+
+    def test_peaks_are_kept(self):
+        flows = np.sin(np.arange(100000) / 500.0)
+        flows[12345] = 50.0
+        flows[54321] = -50.0
+        flows[777] = np.nan
+        keep = downsample.minmax_indices(flows, 1000)
+        self.assertLessEqual(len(keep), 1000)
+        self.assertTrue(np.all(np.diff(keep) > 0))
+        self.assertIn(0, keep)
+        self.assertIn(len(flows) - 1, keep)
+        self.assertIn(12345, keep)
+        self.assertIn(54321, keep)
+        self.assertEqual(np.nanmax(flows[keep]), 50.0)
+
+    def test_short_series_are_unchanged(self):
+        np.testing.assert_array_equal(downsample.minmax_indices(np.arange(10.0), 2000), np.arange(10))
+        np.testing.assert_array_equal(downsample.minmax_indices(np.arange(5000.0), 0), np.arange(5000))
+
+    def test_window(self):
+        times = np.arange(0, 100 * 3600, 3600)
+        flows = np.arange(100.0)
+        start = np.datetime64(10 * 3600, 's')
+        end = np.datetime64(19 * 3600, 's')
+        window_times, window_flows = downsample.series(times, flows, 2000, start, end)
+        np.testing.assert_array_equal(window_flows, np.arange(10.0, 20.0))
+        self.assertEqual(window_times[0], 10 * 3600)
+
+    def test_frame_keeps_peaks_of_every_column(self):
+        index = np.datetime64('2000-01-01T00', 's') + np.arange(10000) * np.timedelta64(3600, 's')
+        df = pd.DataFrame({'a': np.zeros(10000), 'b': np.zeros(10000)}, index=pd.DatetimeIndex(index))
+        df.iloc[100, 0] = 10.0
+        df.iloc[5000, 1] = 20.0
+        result = downsample.frame(df, 200, start=downsample.time_param('2000-01-01 02:00:00.5'))
+        self.assertLessEqual(len(result), 200)
+        self.assertEqual(result['a'].max(), 10.0)
+        self.assertEqual(result['b'].max(), 20.0)
+        self.assertEqual(result.index[0], pd.Timestamp('2000-01-01 02:00'))
+
+    def test_params(self):
+        self.assertEqual(downsample.points_param(None), downsample.DEFAULT_POINTS)
+        self.assertEqual(downsample.points_param('0'), 0)
+        self.assertEqual(downsample.points_param('99999999'), downsample.MAX_POINTS)
+        self.assertIsNone(downsample.time_param(''))
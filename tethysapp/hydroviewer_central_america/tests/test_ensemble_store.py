@@ -0,0 +1,103 @@
+import datetime as dt
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from .. import ensemble_store
+
+
+def ensembles(day, value, members=3):
+    index = pd.DatetimeIndex([pd.Timestamp(day) + pd.Timedelta(hours=3 * i) for i in range(8)])
+    return pd.DataFrame(np.full((8, members), value, dtype=float), index=index,
+                        columns=['ensemble_{0:02d} (m^3/s)'.format(i + 1) for i in range(members)])
+
+
+def day(offset):
+    """
+    YYYY-MM-DD of a recent day, so the cycles are within the retention period.
+    """
+    return (dt.datetime.utcnow() - dt.timedelta(days=offset)).strftime('%Y-%m-%d')
+
+
+class EnsembleStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        patcher = mock.patch.object(ensemble_store, 'store_dir', return_value=self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_round_trip(self):
+        frame = ensembles(day(1), 1.5)
+        with mock.patch.object(ensemble_store.upstream, 'forecast_ensembles', return_value=frame) as fetch:
+            cycle, times, flows = ensemble_store.load(9000001)
+            again = ensemble_store.load('9000001')
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(cycle, day(1).replace('-', '') + '0000')
+        self.assertEqual(list(times), list(frame.index.values.astype('datetime64[s]')))
+        self.assertEqual(flows.dtype, np.float32)
+        self.assertEqual(flows.shape, (8, 3))
+        self.assertTrue((np.asarray(flows) == 1.5).all())
+        self.assertIsInstance(again[2], np.memmap)
+        self.assertEqual(ensemble_store.cycles(), [cycle])
+
+    def test_expired_reach_is_fetched_again_into_the_next_cycle(self):
+        with mock.patch.object(ensemble_store.upstream, 'forecast_ensembles',
+                               return_value=ensembles(day(2), 1)):
+            old_cycle, _, _ = ensemble_store.load(9000001)
+        flows_path, _ = ensemble_store._paths(old_cycle, 9000001)
+        stale = time.time() - ensemble_store.MAX_AGE - 60
+        os.utime(flows_path, (stale, stale))
+
+        with mock.patch.object(ensemble_store.upstream, 'forecast_ensembles',
+                               return_value=ensembles(day(1), 2)) as fetch:
+            cycle, _, flows = ensemble_store.load(9000001)
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(cycle, day(1).replace('-', '') + '0000')
+        self.assertTrue((np.asarray(flows) == 2).all())
+        self.assertEqual(ensemble_store.cycles(), [cycle, old_cycle])
+
+    def test_reach_missing_from_the_newest_cycle_is_fetched(self):
+        with mock.patch.object(ensemble_store.upstream, 'forecast_ensembles',
+                               return_value=ensembles(day(1), 1)):
+            ensemble_store.load(9000001)
+        with mock.patch.object(ensemble_store.upstream, 'forecast_ensembles',
+                               return_value=ensembles(day(1), 4)) as fetch:
+            _, _, flows = ensemble_store.load(9000002)
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertTrue((np.asarray(flows) == 4).all())
+
+    def test_newer_cycle_of_the_same_day_is_fetched(self):
+        with mock.patch.object(ensemble_store.upstream, 'forecast_ensembles',
+                               return_value=ensembles(day(1), 1)):
+            ensemble_store.load(9000001)
+        announced = day(1).replace('-', '') + '.1200'
+        with mock.patch.object(ensemble_store.upstream, 'forecast_ensembles',
+                               return_value=ensembles(day(1) + ' 12:00', 2)) as fetch:
+            cycle, _, flows = ensemble_store.load(9000001, announced)
+            again, _, _ = ensemble_store.load(9000001, announced)
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual((cycle, again), (day(1).replace('-', '') + '1200',) * 2)
+        self.assertTrue((np.asarray(flows) == 2).all())
+
+    def test_evict_deletes_old_cycles(self):
+        for cycle in ('202001010000', '202001051200', '202001100000', '20200110'):
+            os.makedirs(os.path.join(self.directory, cycle))
+        os.makedirs(os.path.join(self.directory, 'not_a_cycle'))
+
+        ensemble_store.evict(now=dt.datetime(2020, 1, 10))
+
+        self.assertEqual(ensemble_store.cycles(), ['202001100000'])
+        self.assertFalse(os.path.isdir(os.path.join(self.directory, '20200110')))
+        self.assertTrue(os.path.isdir(os.path.join(self.directory, 'not_a_cycle')))
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from django.test import RequestFactory
+
+from .. import events
+
+
+def warning(comid, lon=-85.0, lat=12.0):
+    return {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+            'properties': {'size': 1, 'comid': comid}}
+
+
+class EventsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        patcher = mock.patch.object(events, 'events_dir', return_value=self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_log(self):
+        self.assertEqual(events.append_event('cycle', {'cycle': '20200101.0'}), 1)
+        self.assertEqual(events.append_event('cycle', {'cycle': '20200101.1200'}), 2)
+        self.assertEqual([e['id'] for e in events.read_events(1)], [2])
+        self.assertEqual(events.last_event_id(), 2)
+
+    def test_log_is_trimmed(self):
+        with mock.patch.object(events, 'MAX_LOG_BYTES', 2000), mock.patch.object(events, 'KEEP_EVENTS', 5):
+            for i in range(100):
+                events.append_event('file', {'i': i})
+        ids = [e['id'] for e in events.read_events()]
+        self.assertEqual(ids[-1], 100)
+        self.assertLess(len(ids), 30)
+
+    def test_warning_diff(self):
+        watcher = events.Watcher()
+        current = {2: [warning(1), warning(2)], 10: [warning(1)], 20: []}
+        with mock.patch.object(events.upstream, 'warning_points', side_effect=lambda ws, sb, rp: current[rp]):
+            watcher.poll_warnings('ws--sb', 'ws', 'sb')
+            self.assertEqual(events.read_events(), [])
+
+            current[2] = [warning(2), warning(3)]
+            watcher.poll_warnings('ws--sb', 'ws', 'sb')
+        event, = events.read_events()
+        self.assertEqual(event['event'], 'warnings')
+        diff = event['data']['return_periods']
+        self.assertEqual([w['properties']['comid'] for w in diff['2']['added']], [3])
+        self.assertEqual(diff['2']['removed'], ['1'])
+        self.assertEqual(diff['10'], {'added': [], 'removed': []})
+
+    def test_subscriptions(self):
+        events.subscribe('central_america', 'geoglows')
+        self.assertEqual(events.subscriptions(), [('central_america', 'geoglows')])
+        with self.assertRaises(ValueError):
+            events.subscribe('../central_america', 'geoglows')
+
+    def test_poll_returns_events_after_last_id(self):
+        events.append_event('cycle', {'watershed': 'ws', 'subbasin': 'sb', 'cycle': '20200101.0'})
+        events.append_event('file', {'model': 'LIS-RAPID'})
+        with mock.patch.object(events, 'ensure_watcher'):
+            first = events.poll()
+            self.assertEqual((first['events'], first['last_id']), ([], 2))
+            reply = events.poll(after_id=1)
+            self.assertEqual(events.poll(after_id=2)['last_id'], 2)
+        self.assertEqual(reply['events'], [{'id': 2, 'event': 'file', 'data': {'model': 'LIS-RAPID'}}])
+        self.assertEqual(reply['last_id'], 2)
+        self.assertEqual(json.loads(json.dumps(reply)), reply)
+
+    def test_stream_sends_events_after_last_id(self):
+        events.append_event('cycle', {'watershed': 'ws', 'subbasin': 'sb', 'cycle': '20200101.0'})
+        events.append_event('file', {'model': 'LIS-RAPID'})
+
+        async def collect():
+            return [chunk async for chunk in events.stream(after_id=1, duration=0.05)]
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        with mock.patch.object(events, 'ensure_watcher'), mock.patch.object(events, 'STREAM_POLL_SECONDS', 0.01):
+            chunks = loop.run_until_complete(collect())
+        self.assertEqual(chunks, ['retry: 10\n\n', 'id: 2\nevent: file\ndata: {"model": "LIS-RAPID"}\n\n'])
+
+    def test_streams_need_asgi(self):
+        self.assertFalse(events.can_stream(RequestFactory().get('/events-stream/')))
+
+    def test_announced_cycles_and_warnings(self):
+        self.assertIsNone(events.announced_cycle())
+        watcher = events.Watcher()
+        catalogue = mock.Mock()
+        catalogue.latest.return_value = '20200101.1200'
+        catalogue.labels = ['label']
+        current = {2: [warning(1)], 10: [], 20: []}
+        with mock.patch.object(events.forecast_cycles, 'refresh', return_value=catalogue), \
+                mock.patch.object(events, 'subscriptions', return_value=[('ws', 'sb'), ('other', 'sb')]), \
+                mock.patch.object(events.upstream, 'warning_points', side_effect=lambda ws, sb, rp: current[rp]), \
+                mock.patch.object(events, 'LOCAL_MODELS', ()):
+            watcher.poll()
+            catalogue.latest.return_value = '20200102.0'
+            current[2] = []
+            watcher.poll()
+
+        self.assertEqual(events.announced_cycle('ws', 'sb'), '20200102.0')
+        self.assertEqual(events.announced_cycle(), '20200102.0')
+        self.assertIsNone(events.announced_cycle('missing', 'sb'))
+        self.assertEqual(events.warnings_version('ws', 'sb'), 2)
+        self.assertEqual(events.warnings_version('other', 'sb'), 4)
+        self.assertEqual([e['event'] for e in events.read_events()], ['cycle', 'warnings', 'cycle', 'warnings'])
@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import zipfile
+from unittest import mock
+
+import netCDF4 as nc
+
+from .. import exports
+
+
+class ExportsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        patcher = mock.patch.object(exports, 'exports_dir', return_value=self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def wait(self, job_id, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            status = exports.job_status(job_id)
+            if status['state'] in ('done', 'failed'):
+                return status
+            time.sleep(0.05)
+        self.fail('The export did not finish')
+
+    def test_invalid_requests(self):
+        self.assertRaises(exports.ExportError, exports.submit, 'GFS', 'forecast', 'csv', comids=[1])
+        self.assertRaises(exports.ExportError, exports.submit, 'LIS-RAPID', 'historic', 'csv', comids=[1])
+        self.assertRaises(exports.ExportError, exports.submit, 'ECMWF-RAPID', 'forecast', 'xls', comids=[1])
+        self.assertRaises(exports.ExportError, exports.submit, 'ECMWF-RAPID', 'forecast', 'csv')
+        self.assertRaises(exports.ExportError, exports.submit, 'LIS-RAPID', 'forecast', 'csv', region='central')
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_local_watershed_export(self):
+        path = os.path.join(self.directory, 'Qout.nc')
+        with nc.Dataset(path, 'w') as res:
+            res.createDimension('time', 3)
+            res.createDimension('rivid', 2)
+            res.createVariable('time', 'i8', ('time',))[:] = [0, 3600, 7200]
+            res.createVariable('rivid', 'i4', ('rivid',))[:] = [11, 12]
+            res.createVariable('Qout', 'f4', ('time', 'rivid'))[:] = [[1, 2], [3, 4], [5, 6]]
+
+        with mock.patch.object(exports.qout, 'qout_path', return_value=path):
+            status = exports.submit('LIS-RAPID', 'forecast', 'csv', watershed='central_america', subbasin='lis')
+            status = self.wait(status['job_id'])
+        self.assertEqual((status['state'], status['completed'], status['total']), ('done', 2, 2))
+        with zipfile.ZipFile(exports.result_path(status)) as archive:
+            self.assertEqual(sorted(archive.namelist()), ['11.csv', '12.csv'])
+            self.assertEqual(archive.read('12.csv').decode().splitlines()[1:], ['1970-01-01 00:00:00,2.0',
+                                                                                '1970-01-01 01:00:00,4.0',
+                                                                                '1970-01-01 02:00:00,6.0'])
+
+    def test_reach_blocks(self):
+        path = os.path.join(self.directory, 'Qout.nc')
+        with nc.Dataset(path, 'w') as res:
+            res.createDimension('time', 2)
+            res.createDimension('rivid', 5)
+            res.createVariable('time', 'i8', ('time',))[:] = [0, 3600]
+            res.createVariable('rivid', 'i4', ('rivid',))[:] = [10, 11, 12, 13, 14]
+            res.createVariable('Qout', 'f4', ('time', 'rivid'))[:] = [[0, 1, 2, 3, 4], [5, 6, 7, 8, 9]]
+
+        blocks = list(exports.qout.read_reach_blocks(path, [14, 99, 10, 11], block_values=4))
+        self.assertEqual([rivids.tolist() for _, rivids, _ in blocks], [[10, 11], [14]])
+        self.assertEqual([flows.tolist() for _, _, flows in blocks], [[[0.0, 1.0], [5.0, 6.0]], [[4.0], [9.0]]])
+        self.assertEqual(blocks[0][0].tolist(), [0, 3600])
+
+    def test_ecmwf_watershed_uses_its_layer(self):
+        feature_types = {'featureTypes': {'featureType': [{'name': 'south_america-geoglows-drainage_line'},
+                                                          {'name': 'central_america-geoglows-catchment'},
+                                                          {'name': 'central_america-geoglows-drainage_line'}]}}
+        features = {'features': [{'properties': {'COMID': 3}}, {'properties': {'COMID': 1}}]}
+        responses = [mock.Mock(content=json.dumps(feature_types)), mock.Mock(json=lambda: features)]
+        with mock.patch.object(exports, 'app') as app, \
+                mock.patch.object(exports.upstream, 'geoserver_get', side_effect=responses) as geoserver_get:
+            app.get_custom_setting.return_value = 'hydroviewer'
+            comids = exports._resolve_comids({'model': 'ECMWF-RAPID', 'region': None,
+                                              'watershed': 'central_america', 'subbasin': 'geoglows'})
+        self.assertEqual(comids, [1, 3])
+        self.assertEqual(geoserver_get.call_args[1]['params']['typeName'],
+                         'hydroviewer:central_america-geoglows-drainage_line')
+
+        responses = [mock.Mock(content=json.dumps(feature_types))]
+        with mock.patch.object(exports, 'app'), \
+                mock.patch.object(exports.upstream, 'geoserver_get', side_effect=responses):
+            self.assertRaises(exports.ExportError, exports._resolve_comids,
+                              {'model': 'ECMWF-RAPID', 'region': None, 'watershed': 'africa', 'subbasin': 'geoglows'})
+
+    def test_sweep(self):
+        now = time.time()
+        jobs = {'a' * 32: {'created': now - 10 * 86400, 'finished': now - 8 * 86400},
+                'b' * 32: {'created': now - 10 * 86400, 'finished': now - 60},
+                'c' * 32: {'created': now - 60, 'finished': None}}
+        for job_id, times in jobs.items():
+            os.makedirs(os.path.join(self.directory, job_id))
+            exports._write_status(dict(times, job_id=job_id, state='done'))
+        os.makedirs(os.path.join(self.directory, 'd' * 32))
+        os.utime(os.path.join(self.directory, 'd' * 32), (now - 8 * 86400, now - 8 * 86400))
+
+        self.assertEqual(sorted(exports.sweep(now=now)), ['a' * 32, 'd' * 32])
+        self.assertEqual(sorted(os.listdir(self.directory)), ['b' * 32, 'c' * 32])
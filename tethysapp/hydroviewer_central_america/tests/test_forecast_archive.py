@@ -0,0 +1,50 @@
+import datetime as dt
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from .. import forecast_archive
+
+
+def forecast_stats(day, value):
+    index = pd.DatetimeIndex([pd.Timestamp(day) + pd.Timedelta(hours=3 * i) for i in range(8)])
+    return pd.DataFrame(np.full((8, len(forecast_archive.COLUMNS)), value), index=index,
+                        columns=forecast_archive.COLUMNS)
+
+
+class ForecastArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        patcher = mock.patch.object(forecast_archive, 'archive_dir', return_value=self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_last_cycles(self):
+        for i, day in enumerate(['2020-01-01', '2020-01-02', '2020-01-03']):
+            self.assertTrue(forecast_archive.append(9000001, forecast_stats(day, i)))
+        self.assertFalse(forecast_archive.append(9000001, forecast_stats('2020-01-03', 5)))
+
+        cycles = forecast_archive.last_cycles(9000001, 2)
+        self.assertEqual([str(c) for c, _, _ in cycles], ['2020-01-02T00:00:00', '2020-01-03T00:00:00'])
+        times, values = cycles[-1][1], cycles[-1][2]
+        self.assertEqual(str(times[1]), '2020-01-03T03:00:00')
+        self.assertEqual(values.shape, (8, len(forecast_archive.COLUMNS)))
+        self.assertTrue((values == 2).all())
+
+    def test_expired_cycles_are_compacted(self):
+        with mock.patch.object(forecast_archive, 'COMPACT_MIN', 2), \
+                mock.patch.object(forecast_archive, 'RETENTION_DAYS', 10):
+            old = pd.Timestamp(dt.datetime.utcnow().date()) - pd.Timedelta(days=20)
+            for i in range(3):
+                forecast_archive.append(1, forecast_stats(old + pd.Timedelta(days=i), i))
+            forecast_archive.append(1, forecast_stats(old + pd.Timedelta(days=19), 9))
+
+        cycles = forecast_archive.last_cycles(1, 10)
+        self.assertEqual(len(cycles), 2)
+        self.assertTrue((cycles[-1][2] == 9).all())
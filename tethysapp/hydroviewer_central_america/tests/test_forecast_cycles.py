@@ -0,0 +1,29 @@
+import unittest
+
+from ..forecast_cycles import CycleCatalogue, cycle_key, cycle_time
+
+
+class CycleCatalogueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cycles = CycleCatalogue(['20200102.0', '20200101.1200', '20200101.0', '20200103.1200'])
+
+    def test_cycle_key(self):
+        self.assertEqual(cycle_key('20200101.0'), 202001010000)
+        self.assertEqual(cycle_key('20200101.1200'), 202001011200)
+        self.assertRaises(ValueError, cycle_key, '2020-01-01')
+
+    def test_cycle_time(self):
+        self.assertEqual(cycle_time('20200101.1200'), 1577880000)
+        self.assertIsNone(cycle_time(None))
+
+    def test_sorted_with_labels(self):
+        self.assertEqual(self.cycles.latest(), '20200103.1200')
+        self.assertEqual(self.cycles.between()[-1], ('2020-01-01 00:00', '20200101.0'))
+
+    def test_range_queries(self):
+        self.assertEqual([n for _, n in self.cycles.between(20200102)], ['20200103.1200', '20200102.0'])
+        self.assertEqual([n for _, n in self.cycles.between(end=20200101)], ['20200101.1200', '20200101.0'])
+        self.assertEqual([n for _, n in self.cycles.between(limit=1)], ['20200103.1200'])
+        self.assertIn('20200101.1200', self.cycles)
+        self.assertNotIn('20200104.0', self.cycles)
@@ -0,0 +1,39 @@
+import unittest
+from unittest import mock
+
+from ..helpers import replace_csv_header
+
+
+class ReplaceCsvHeaderTestCase(unittest.TestCase):
+
+    def test_header_split_across_chunks(self):
+        chunks = [b'dat', b'etime,flo', b'w\r\n2020-01-01', b',1.5\r\n2020-01-02,2.5\r\n']
+        first_row, stream = replace_csv_header(chunks, 'datetime,streamflow (m3/s)')
+        self.assertEqual(first_row, '2020-01-01,1.5')
+        self.assertEqual(b''.join(stream),
+                         b'datetime,streamflow (m3/s)\r\n2020-01-01,1.5\r\n2020-01-02,2.5\r\n')
+
+    def test_one_chunk_per_byte(self):
+        content = b'a,b\n1,2\n3,4\n'
+        first_row, stream = replace_csv_header([content[i:i + 1] for i in range(len(content))], 'x,y')
+        self.assertEqual(first_row, '1,2')
+        self.assertEqual(b''.join(stream), b'x,y\n1,2\n3,4\n')
+
+    def test_header_only(self):
+        first_row, stream = replace_csv_header([b'a,b\n'], 'x,y')
+        self.assertEqual(first_row, '')
+        self.assertEqual(b''.join(stream), b'x,y\n')
+
+    def test_on_close_when_done(self):
+        on_close = mock.Mock()
+        _, stream = replace_csv_header([b'a,b\n1,2\n', b'3,4\n'], 'x,y', on_close=on_close)
+        on_close.assert_not_called()
+        list(stream)
+        on_close.assert_called_once_with()
+
+    def test_on_close_when_abandoned(self):
+        on_close = mock.Mock()
+        _, stream = replace_csv_header([b'a,b\n1,2\n', b'3,4\n', b'5,6\n'], 'x,y', on_close=on_close)
+        next(stream)
+        stream.close()
+        on_close.assert_called_once_with()
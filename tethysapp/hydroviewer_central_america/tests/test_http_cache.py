@@ -0,0 +1,51 @@
+import gzip
+import unittest
+from email.utils import formatdate
+
+from .. import http_cache
+
+
+class FakeRequest(object):
+    def __init__(self, **meta):
+        self.META = meta
+
+
+class HttpCacheTestCase(unittest.TestCase):
+
+    def test_if_none_match(self):
+        tag = http_cache.etag('Qout.nc', 1600000000.0, 1024, '9000001')
+        self.assertTrue(http_cache.is_not_modified(FakeRequest(HTTP_IF_NONE_MATCH=tag), tag, None))
+        self.assertTrue(http_cache.is_not_modified(FakeRequest(HTTP_IF_NONE_MATCH='"x", ' + tag[2:]), tag, None))
+        self.assertTrue(http_cache.is_not_modified(FakeRequest(HTTP_IF_NONE_MATCH='*'), tag, None))
+        self.assertFalse(http_cache.is_not_modified(FakeRequest(HTTP_IF_NONE_MATCH='W/"x"'), tag, None))
+        self.assertFalse(http_cache.is_not_modified(FakeRequest(), tag, 1600000000.0))
+
+    def test_if_modified_since(self):
+        since = formatdate(1600000000, usegmt=True)
+        request = FakeRequest(HTTP_IF_MODIFIED_SINCE=since)
+        self.assertTrue(http_cache.is_not_modified(request, 'W/"a"', 1600000000.5))
+        self.assertFalse(http_cache.is_not_modified(request, 'W/"a"', 1600000001.0))
+        # If-None-Match takes precedence
+        request.META['HTTP_IF_NONE_MATCH'] = 'W/"b"'
+        self.assertFalse(http_cache.is_not_modified(request, 'W/"a"', 1600000000.0))
+
+    def test_stale_etag(self):
+        tag = http_cache.Body(b'{}').etag
+        stale = http_cache.stale_etag(tag, 125.7)
+        self.assertTrue(stale.startswith('W/"') and stale.endswith('-stale-125"'))
+        self.assertFalse(http_cache.is_not_modified(FakeRequest(HTTP_IF_NONE_MATCH=stale), tag, None))
+        self.assertTrue(http_cache.is_not_modified(FakeRequest(HTTP_IF_NONE_MATCH=stale), stale, None))
+
+    def test_accepted_encoding(self):
+        self.assertEqual(http_cache.accepted_encoding(FakeRequest(HTTP_ACCEPT_ENCODING='gzip, deflate')), 'gzip')
+        self.assertIsNone(http_cache.accepted_encoding(FakeRequest(HTTP_ACCEPT_ENCODING='gzip;q=0, deflate')))
+        self.assertIsNone(http_cache.accepted_encoding(FakeRequest()))
+
+    def test_body_is_compressed_once(self):
+        body = http_cache.Body(b'{"plot": "' + b'a' * 5000 + b'"}')
+        content, encoding = body.encoded('gzip')
+        self.assertEqual(encoding, 'gzip')
+        self.assertEqual(gzip.decompress(content), body.content)
+        self.assertIs(body.encoded('gzip')[0], content)
+        self.assertEqual(http_cache.Body(b'{}').encoded('gzip'), (b'{}', None))
+        self.assertEqual(http_cache.Body(body.content).etag, body.etag)
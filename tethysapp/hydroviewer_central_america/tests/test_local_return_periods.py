@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import netCDF4 as nc
+import numpy as np
+
+from .. import local_return_periods
+
+
+class LocalReturnPeriodsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'Qout.nc')
+        # Three years of daily flows for two reaches, the second always twice the first
+        self.times = np.arange(np.datetime64('2018-01-01'), np.datetime64('2021-01-01')).astype('datetime64[s]')
+        self.flows = np.stack([np.arange(len(self.times), dtype=float) % 400, np.zeros(len(self.times))], axis=1)
+        self.flows[:, 1] = 2 * self.flows[:, 0]
+        with nc.Dataset(self.path, 'w') as res:
+            res.createDimension('time', len(self.times))
+            res.createDimension('rivid', 2)
+            res.createVariable('time', 'i8', ('time',))[:] = self.times.astype('i8')
+            res.createVariable('rivid', 'i4', ('rivid',))[:] = [11, 12]
+            res.createVariable('Qout', 'f4', ('time', 'rivid'))[:] = self.flows
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_annual_maxima_in_chunks(self):
+        rivids, maxima, overall = local_return_periods.annual_maxima(self.path, chunk_steps=100)
+        years = self.times.astype('datetime64[Y]')
+        expected = [self.flows[years == year].max(axis=0) for year in np.unique(years)]
+        np.testing.assert_array_equal(rivids, [11, 12])
+        np.testing.assert_array_equal(maxima, expected)
+        np.testing.assert_array_equal(overall, self.flows.max(axis=0))
+
+    def test_gumbel_flows(self):
+        maxima = np.array([[100.0, 10.0], [200.0, 10.0], [300.0, 10.0]])
+        flows = local_return_periods.gumbel_flows(maxima)
+        # The 2 year flow of a Gumbel distribution is slightly below the mean
+        self.assertAlmostEqual(flows[0, 0], 200 - 0.1643 * 100, places=1)
+        self.assertTrue(np.all(np.diff(flows[:, 0]) > 0))
+        np.testing.assert_allclose(flows[:, 1], 10.0)
+
+    def test_complete_years(self):
+        daily = np.arange(np.datetime64('2017-12-01'), np.datetime64('2020-01-31')).astype('datetime64[s]')
+        np.testing.assert_array_equal(local_return_periods.complete_years(daily), [False, True, True, False])
+        three_hourly = np.arange(np.datetime64('2019-01-01T00'), np.datetime64('2020-01-01T00'),
+                                 np.timedelta64(3, 'h')).astype('datetime64[s]')
+        np.testing.assert_array_equal(local_return_periods.complete_years(three_hourly), [True])
+
+    def test_partial_years_are_not_fitted(self):
+        # A few weeks over New Year span two calendar years but none of them completely
+        with nc.Dataset(self.path, 'a') as res:
+            res.variables['time'][:] = np.datetime64('2018-12-20', 's').astype('i8') + 1800 * np.arange(len(self.times))
+        _, maxima, overall = local_return_periods.annual_maxima(self.path)
+        self.assertEqual(maxima.shape, (0, 2))
+        np.testing.assert_array_equal(overall, self.flows.max(axis=0))
+        self.assertIsNone(local_return_periods.compute_table(self.path))
+
+    def test_too_few_years(self):
+        self.assertIsNotNone(local_return_periods.compute_table(self.path))
+        with nc.Dataset(self.path, 'a') as res:
+            res.variables['time'][:] = np.datetime64('2018-01-01', 's').astype('i8') + np.arange(len(self.times))
+        self.assertIsNone(local_return_periods.compute_table(self.path))
@@ -0,0 +1,143 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from .. import metrics
+
+
+class FakeResponse(dict):
+    status_code = 200
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        metrics.set_directory(None)
+
+    def test_instrumented_adds_server_timing(self):
+        @metrics.instrumented
+        def controller(request):
+            with metrics.span('spt'):
+                pass
+            with metrics.span('render'):
+                pass
+            return FakeResponse()
+
+        header = controller(None)['Server-Timing']
+        names = [entry.split(';')[0] for entry in header.split(', ')]
+        self.assertEqual(names, ['spt', 'render', 'total'])
+
+    def test_nested_controllers_are_timed_once(self):
+        @metrics.instrumented
+        def inner(request):
+            with metrics.span('inner_span'):
+                return FakeResponse()
+
+        @metrics.instrumented
+        def outer(request):
+            return inner(request)
+
+        before = metrics.histogram('request_seconds', endpoint='inner').count
+        header = outer(None)['Server-Timing']
+        self.assertIn('inner_span', header)
+        self.assertEqual(metrics.histogram('request_seconds', endpoint='inner').count, before)
+        self.assertEqual(metrics.histogram('request_seconds', endpoint='outer').count, 1)
+
+    def test_log_error_counts_against_current_endpoint(self):
+        @metrics.instrumented
+        def failing(request):
+            metrics.log_error(ValueError('No data'))
+            return FakeResponse()
+
+        failing(None)
+        self.assertEqual(metrics.counter('request_errors', endpoint='failing').value, 1)
+
+    def test_prometheus_text(self):
+        metrics.histogram('test_seconds', upstream='spt').observe(0.2)
+        text = metrics.prometheus_text([('test_gauge', {'upstream': 'spt'}, 1)])
+        self.assertIn('# TYPE hydroviewer_test_seconds histogram', text)
+        self.assertIn('hydroviewer_test_seconds_bucket{le="0.1",upstream="spt"} 0', text)
+        self.assertIn('hydroviewer_test_seconds_bucket{le="0.25",upstream="spt"} 1', text)
+        self.assertIn('hydroviewer_test_seconds_bucket{le="+Inf",upstream="spt"} 1', text)
+        self.assertIn('hydroviewer_test_seconds_count{upstream="spt"} 1', text)
+        self.assertIn('hydroviewer_test_gauge{upstream="spt"} 1', text)
+
+    def test_unflagged_request_is_not_profiled(self):
+        class FakeRequest(object):
+            GET = {'comid': '9000001'}
+
+        @metrics.instrumented
+        def controller(request):
+            return FakeResponse()
+
+        response = controller(FakeRequest())
+        self.assertNotIn('X-Profile', response)
+        self.assertIn('Server-Timing', response)
+
+    def test_nested_controllers_are_profiled_once(self):
+        from .. import profiling
+
+        class FakeRequest(object):
+            GET = {'profile': '1'}
+
+        @metrics.instrumented
+        def profiled_inner(request):
+            return FakeResponse()
+
+        @metrics.instrumented
+        def profiled_outer(request):
+            return profiled_inner(request)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with mock.patch.object(profiling, 'wants_profile', return_value=True), \
+                mock.patch.object(profiling, 'profiles_dir', return_value=directory):
+            response = profiled_outer(FakeRequest())
+            self.assertEqual(profiling.list_profiles(), [response['X-Profile']])
+            with open(profiling.profile_path(response['X-Profile'][:-len('.prof')] + '.txt')) as f:
+                summary = f.read()
+        self.assertIn('(profiled_inner)', summary)
+
+
+class AggregationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        metrics.set_directory(self.directory)
+
+    def tearDown(self):
+        metrics.set_directory(None)
+        shutil.rmtree(self.directory)
+
+    def write_worker(self, pid, requests, errors):
+        buckets = [[bound, requests] for bound in metrics.LATENCY_BUCKETS]
+        with open(os.path.join(self.directory, '{0}.json'.format(pid)), 'w') as f:
+            json.dump({'histograms': [['agg_seconds', {'endpoint': 'home'}, {'buckets': buckets,
+                                                                             'count': requests, 'sum': 1.5}]],
+                       'counters': [['agg_errors', {'endpoint': 'home'}, errors]]}, f)
+
+    def test_series_are_summed_over_running_workers(self):
+        metrics.histogram('agg_seconds', endpoint='home').observe(0.001)
+        metrics.counter('agg_errors', endpoint='home').inc()
+        self.write_worker(os.getppid(), 2, 3)
+
+        text = metrics.prometheus_text()
+        self.assertIn('hydroviewer_agg_seconds_count{endpoint="home"} 3', text)
+        self.assertIn('hydroviewer_agg_seconds_bucket{endpoint="home",le="0.005"} 3', text)
+        self.assertIn('hydroviewer_agg_seconds_bucket{endpoint="home",le="+Inf"} 3', text)
+        self.assertIn('hydroviewer_agg_errors_total{endpoint="home"} 4', text)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, '{0}.json'.format(os.getpid()))))
+
+    def test_workers_that_exited_are_dropped(self):
+        worker = subprocess.Popen([sys.executable, '-c', 'pass'])
+        worker.wait()
+        self.write_worker(worker.pid, 5, 5)
+
+        _, counters = metrics.collect()
+        self.assertNotIn(('agg_errors', {'endpoint': 'home'}, 5), counters)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, '{0}.json'.format(worker.pid))))
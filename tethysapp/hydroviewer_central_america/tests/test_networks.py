@@ -0,0 +1,59 @@
+import json
+import unittest
+
+import numpy as np
+
+from .. import networks
+
+
+def network(lines):
+    return networks.Network([{'COMID': 100 + i} for i in range(len(lines))], lines)
+
+
+class NetworksTestCase(unittest.TestCase):
+
+    def test_simplify(self):
+        x = np.linspace(0, 1000, 101)
+        line = np.column_stack([x, np.where(x == 500, 40.0, 0.0)])
+        np.testing.assert_array_equal(networks.simplify(line, 50.0), line[[0, -1]])
+        # Points next to the peak are further than 10 from the lines joining it to the ends
+        np.testing.assert_array_equal(networks.simplify(line, 10.0), line[[0, 49, 50, 51, -1]])
+        np.testing.assert_array_equal(networks.simplify(line[:2], 50.0), line[:2])
+
+    def test_grid_query(self):
+        lines = [[np.array([[0.0, 0.0], [10.0, 10.0]])],
+                 [np.array([[6390.0, 6390.0], [6400.0, 6400.0]])],
+                 [np.array([[0.0, 6350.0], [6400.0, 6350.0]])],
+                 []]
+        reaches = network(lines)
+        self.assertEqual(reaches.extent, [0.0, 0.0, 6400.0, 6400.0])
+        self.assertEqual(reaches.query(reaches.cell_range([0, 0, 50, 50])).tolist(), [0])
+        self.assertEqual(reaches.query(reaches.cell_range([6300, 6300, 9000, 9000])).tolist(), [1, 2])
+        self.assertEqual(reaches.query(reaches.cell_range()).tolist(), [0, 1, 2])
+        self.assertIsNone(reaches.cell_range([7000, 7000, 8000, 8000]))
+        self.assertEqual(len(reaches.query(None)), 0)
+
+    def test_zoom_levels(self):
+        self.assertIsNone(networks.zoom_level(None))
+        self.assertIsNone(networks.zoom_level('nan'))
+        self.assertIsNone(networks.zoom_level(networks.FULL_DETAIL_ZOOM))
+        self.assertEqual(networks.zoom_level('7.6'), 7)
+
+    def test_features(self):
+        x = np.linspace(-9500000.0, -9400000.0, 1001)
+        lines = [[np.column_stack([x, np.full(len(x), 1500000.3)])],
+                 [np.array([[-9400000.0, 1500000.0], [-9390000.0, 1510000.0]])]]
+        reaches = network(lines)
+
+        features = [json.loads(f) for f in reaches.features(reaches.cell_range(), 6)]
+        # The first reach spans many cells but is sent once
+        self.assertEqual([f['properties']['COMID'] for f in features], [100, 101])
+        self.assertEqual(features[0]['geometry']['coordinates'], [[-9500000, 1500000], [-9400000, 1500000]])
+        self.assertIs(reaches.cell_features((0, 0), 6), reaches.cell_features((0, 0), 6))
+
+        payload = json.loads(networks._body(reaches, reaches.features(reaches.cell_range(), 6)).content)
+        self.assertEqual(json.loads(payload['options'])['features'], features)
+        self.assertEqual(payload['legend_extent'], reaches.extent)
+
+        single = json.loads(reaches.feature(0, None))
+        self.assertEqual(len(single['geometry']['coordinates']), len(x))
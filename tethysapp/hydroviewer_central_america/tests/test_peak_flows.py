@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import netCDF4 as nc
+import numpy as np
+
+from .. import networks, peak_flows
+
+
+class PeakFlowsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_peaks_across_blocks(self):
+        times = np.arange(0, 100 * 3600, 3600)
+        flows = np.ones((100, 3))
+        flows[7, 0] = 5.0
+        flows[93, 1] = 9.0
+        flows[:, 2] = np.nan
+        path = os.path.join(self.directory, 'Qout.nc')
+        with nc.Dataset(path, 'w') as res:
+            res.createDimension('time', 100)
+            res.createDimension('rivid', 3)
+            res.createVariable('time', 'i8', ('time',))[:] = times
+            res.createVariable('rivid', 'i4', ('rivid',))[:] = [11, 12, 13]
+            res.createVariable('Qout', 'f4', ('time', 'rivid'))[:] = flows
+
+        table = peak_flows.compute_table(path, block_values=3 * 10)
+        np.testing.assert_array_equal(table['peak'], [5.0, 9.0, np.nan])
+        np.testing.assert_array_equal(table['peak_time'][:2], [7 * 3600, 93 * 3600])
+
+    def test_classes(self):
+        return_periods = {
+            'rivid': np.array([12, 11, 13]),
+            'rp2': np.array([2.0, 1.0, np.nan]),
+            'rp10': np.array([4.0, 3.0, np.nan]),
+            'rp20': np.array([6.0, 5.0, np.nan]),
+        }
+        peak = np.array([0.5, 4.0, 9.0, 9.0, 9.0])
+        rivids = np.array([11, 11, 11, 13, 14])
+        self.assertEqual(peak_flows.classes(peak, rivids, return_periods).tolist(), [0, 10, 20, -1, -1])
+        self.assertEqual(peak_flows.classes(peak, rivids, None).tolist(), [-1] * 5)
+
+    def test_layer_of_a_forecast_file(self):
+        # Two days of flows: too short for return periods, every reach is served unclassed
+        flows = np.tile([1.0, 2.0], (48, 1))
+        flows[30, 1] = 7.5
+        path = os.path.join(self.directory, 'Qout.nc')
+        with nc.Dataset(path, 'w') as res:
+            res.createDimension('time', 48)
+            res.createDimension('rivid', 2)
+            res.createVariable('time', 'i8', ('time',))[:] = np.arange(0, 48 * 3600, 3600)
+            res.createVariable('rivid', 'i4', ('rivid',))[:] = [11, 12]
+            res.createVariable('Qout', 'f4', ('time', 'rivid'))[:] = flows
+        records = [{'COMID': 11}, {'COMID': 12}]
+        lines = [[np.array([[0.0, 0.0], [1.0, 1.0]])] for _ in records]
+
+        with mock.patch.object(peak_flows.qout, 'qout_path', return_value=path), \
+                mock.patch.object(peak_flows.tables, 'get', side_effect=peak_flows.compute_table), \
+                mock.patch.object(peak_flows.local_return_periods.tables, 'get',
+                                  side_effect=peak_flows.local_return_periods.compute_table), \
+                mock.patch.object(peak_flows.networks, 'load', return_value=networks.Network(records, lines)), \
+                mock.patch.object(peak_flows.networks, 'version', return_value=0):
+            body = peak_flows.layer('HIWAT-RAPID', 'ws', 'sb')
+
+        properties = [f['properties'] for f in json.loads(body.content.decode('utf-8'))['features']]
+        self.assertEqual([(p['COMID'], p['peak'], p['peak_time'], p['return_period']) for p in properties],
+                         [(11, 1.0, '1970-01-01T00:00', -1), (12, 7.5, '1970-01-02T06:00', -1)])
+
+    def test_layer_classes_the_reaches(self):
+        records = [{'COMID': comid} for comid in (11, 12, 13, 14)]
+        lines = [[np.array([[0.0, 0.0], [1.0, 1.0]])] for _ in records]
+        peaks = {'rivid': np.array([11, 12, 13, 14]), 'peak': np.array([0.5, 4.0, np.nan, 9.0]),
+                 'peak_time': np.zeros(4, dtype='i8')}
+        return_periods = {'rivid': np.array([11, 12, 13, 14]), 'rp2': np.ones(4), 'rp10': np.full(4, 3.0),
+                          'rp20': np.full(4, 5.0)}
+        with mock.patch.object(peak_flows.networks, 'load', return_value=networks.Network(records, lines)):
+            body = peak_flows._build('LIS-RAPID', 'ws', 'sb', peaks, return_periods, 0)
+
+        properties = [f['properties'] for f in json.loads(body.content.decode('utf-8'))['features']]
+        self.assertEqual([(p['COMID'], p['return_period']) for p in properties], [(11, 0), (12, 10), (14, 20)])
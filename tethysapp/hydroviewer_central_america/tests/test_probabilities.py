@@ -0,0 +1,20 @@
+import unittest
+
+import numpy as np
+
+from .. import probabilities
+
+
+class ProbabilitiesTestCase(unittest.TestCase):
+
+    def test_daily_max_includes_next_midnight(self):
+        times = np.array(['2020-01-01T00', '2020-01-01T12', '2020-01-02T00', '2020-01-02T12'], dtype='datetime64[s]')
+        flows = np.array([[1.0, 1.0], [2.0, np.nan], [5.0, 3.0], [4.0, 1.0]])
+        days, maxima = probabilities.daily_max(times, flows)
+        self.assertEqual([str(d) for d in days], ['2020-01-01', '2020-01-02'])
+        np.testing.assert_array_equal(maxima, [[5.0, 3.0], [5.0, 3.0]])
+
+    def test_exceedance_percent(self):
+        maxima = np.array([[1.0, 3.0, 5.0, np.nan], [6.0, 6.0, 6.0, 6.0]])
+        percent = probabilities.exceedance_percent(maxima, [2.0, 4.0])
+        np.testing.assert_array_equal(percent, [[50, 100], [25, 100]])
@@ -0,0 +1,89 @@
+import time
+import unittest
+
+from .. import cache
+from ..upstream import CircuitBreaker, CircuitOpenError
+
+
+def wait_for_refresh(timeout=2):
+    deadline = time.time() + timeout
+    while cache._refreshing and time.time() < deadline:
+        time.sleep(0.01)
+
+
+class StaleWhileRevalidateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        cache.invalidate('key')
+
+    def test_cold_miss_builds_synchronously(self):
+        value, stale_age = cache.get('key', lambda: {'plot': 1}, ttl=60)
+        self.assertEqual(value, {'plot': 1})
+        self.assertIsNone(stale_age)
+
+    def test_cold_miss_propagates_errors(self):
+        def build():
+            raise ValueError('upstream down')
+
+        self.assertRaises(ValueError, cache.get, 'key', build, 60)
+
+    def test_expired_entry_is_served_stale_and_refreshed(self):
+        cache.put('key', {'plot': 'old'}, stored=time.time() - 120)
+
+        value, stale_age = cache.get('key', lambda: {'plot': 'new'}, ttl=60)
+        self.assertEqual(value, {'plot': 'old'})
+        self.assertGreaterEqual(stale_age, 120)
+
+        wait_for_refresh()
+        value, stale_age = cache.get('key', lambda: {'plot': 'newer'}, ttl=60)
+        self.assertEqual(value, {'plot': 'new'})
+        self.assertIsNone(stale_age)
+
+    def test_failed_refresh_keeps_old_payload(self):
+        cache.put('key', {'plot': 'old'}, stored=time.time() - 120)
+
+        def build():
+            raise ValueError('upstream down')
+
+        cache.get('key', build, ttl=60)
+        wait_for_refresh()
+        value, stale_age = cache.get('key', build, ttl=60)
+        self.assertEqual(value, {'plot': 'old'})
+        self.assertIsNotNone(stale_age)
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker('test', failure_threshold=3, open_seconds=60)
+        for _ in range(2):
+            breaker.before_call()
+            breaker.record_failure()
+        self.assertEqual(breaker.state, 'closed')
+
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertRaises(CircuitOpenError, breaker.before_call)
+
+    def test_single_trial_after_open_period(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, open_seconds=0)
+        breaker.before_call()
+        breaker.record_failure()
+
+        breaker.before_call()
+        self.assertRaises(CircuitOpenError, breaker.before_call)
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.before_call()
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker('test', failure_threshold=5, open_seconds=0)
+        for _ in range(5):
+            breaker.record_failure()
+
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertIsNotNone(breaker.opened_at)
+        self.assertFalse(breaker.trial_running)
@@ -0,0 +1,56 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from .. import shapefiles
+
+
+def write_polylines(base, lines, comids):
+    records = b''
+    for number, parts in enumerate(lines, 1):
+        points = np.concatenate(parts)
+        offsets = np.cumsum([0] + [len(p) for p in parts[:-1]])
+        content = struct.pack('<i4d2i', 3, 0, 0, 0, 0, len(parts), len(points)) + \
+            np.asarray(offsets, dtype='<i4').tobytes() + np.asarray(points, dtype='<f8').tobytes()
+        records += struct.pack('>2i', number, len(content) // 2) + content
+    header = struct.pack('>7i', 9994, 0, 0, 0, 0, 0, (100 + len(records)) // 2) + struct.pack('<2i8d', 1000, 3,
+                                                                                               *[0] * 8)
+    with open(base + '.shp', 'wb') as f:
+        f.write(header + records)
+
+    fields = struct.pack('<11sc4xBB14x', b'COMID', b'N', 10, 0)
+    header_length = 32 + len(fields) + 1
+    with open(base + '.dbf', 'wb') as f:
+        f.write(struct.pack('<B3BIHH20x', 3, 120, 1, 1, len(comids), header_length, 11) + fields + b'\r')
+        for comid in comids:
+            f.write(b' ' + str(comid).rjust(10).encode('ascii'))
+
+
+class ShapefilesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_read_polylines(self):
+        base = os.path.join(self.directory, 'drainage_line')
+        lines = [[np.array([[-85.0, 12.0], [-85.1, 12.1]])],
+                 [np.array([[-86.0, 13.0], [-86.1, 13.1], [-86.2, 13.0]]), np.array([[0.0, 0.0], [1.0, 1.0]])]]
+        write_polylines(base, lines, [101, 102])
+
+        records, read = shapefiles.read(base + '.shp')
+        self.assertEqual(records, [{'COMID': 101}, {'COMID': 102}])
+        self.assertEqual([len(parts) for parts in read], [1, 2])
+        np.testing.assert_allclose(read[0][0], shapefiles.to_web_mercator(lines[0][0]))
+        self.assertAlmostEqual(read[1][1][1][0], 111319.49, places=1)
+
+    def test_projected_coordinates_are_kept(self):
+        base = os.path.join(self.directory, 'projected')
+        lines = [[np.array([[-9462000.0, 1345000.0], [-9463000.0, 1346000.0]])]]
+        write_polylines(base, lines, [1])
+        _, read = shapefiles.read(base + '.shp')
+        np.testing.assert_array_equal(read[0][0], lines[0][0])
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from .. import cache, shared_cache
+
+
+class DiskStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.store = shared_cache.DiskStore(self.directory, max_bytes=10000)
+
+    def test_round_trip(self):
+        self.assertIsNone(self.store.get(('forecast_cycles', 'central_america', 'geoglows')))
+        self.store.put(('forecast_cycles', 'central_america', 'geoglows'), {'dates': [1, 2]}, 100.0)
+        self.assertEqual(self.store.get(('forecast_cycles', 'central_america', 'geoglows')),
+                         ({'dates': [1, 2]}, 100.0, None))
+        self.assertEqual([name for name in os.listdir(self.directory) if not name.endswith('.pkl')], [])
+
+        self.store.invalidate(('forecast_cycles', 'central_america', 'geoglows'))
+        self.assertIsNone(self.store.get(('forecast_cycles', 'central_america', 'geoglows')))
+
+    def test_unpicklable_payloads_are_skipped(self):
+        self.store.put('key', threading.Lock(), 100.0)
+        self.assertIsNone(self.store.get('key'))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for i in range(3):
+            self.store.put(i, b'x' * 3000, 100.0)
+            os.utime(self.store._path(i), (1000 + i, 1000 + i))
+        self.store.get(0)
+        self.store.put(3, b'x' * 3000, 100.0)
+        self.store.evict()
+        self.assertLessEqual(self.store.size(), 8000)
+        self.assertIsNone(self.store.get(1))
+        self.assertIsNotNone(self.store.get(0))
+        self.assertIsNotNone(self.store.get(3))
+
+
+class SharedTierTestCase(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        patcher = mock.patch.object(cache, '_shared', shared_cache.DiskStore(directory))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.invalidate('key')
+
+    def forget_local(self):
+        # What another worker sees: nothing in process, the shared store as is
+        with cache._lock:
+            cache._entries.clear()
+
+    def test_built_once_per_host(self):
+        build = mock.Mock(return_value={'plot': 1})
+        cache.get('key', build, ttl=60)
+        self.forget_local()
+        value, stale_age = cache.get('key', build, ttl=60)
+        self.assertEqual(value, {'plot': 1})
+        self.assertIsNone(stale_age)
+        self.assertEqual(build.call_count, 1)
+
+    def test_refresh_of_another_worker_is_used(self):
+        cache.put('key', {'plot': 'old'}, stored=time.time() - 120)
+        cache.shared_store().put('key', {'plot': 'new'}, time.time())
+        build = mock.Mock(side_effect=ValueError('upstream down'))
+        value, stale_age = cache.get('key', build, ttl=60)
+        self.assertEqual(value, {'plot': 'new'})
+        self.assertIsNone(stale_age)
+        build.assert_not_called()
+
+    def test_in_process_hits_touch_the_shared_entry(self):
+        cache.get('key', mock.Mock(return_value={'plot': 1}), ttl=60)
+        path = cache.shared_store()._path('key')
+        os.utime(path, (1000, 1000))
+        cache.get('key', mock.Mock(), ttl=60)
+        self.assertEqual(os.path.getmtime(path), 1000)
+
+        with cache._lock:
+            cache._entries['key']['touched'] -= cache.TOUCH_SECONDS + 1
+        cache.get('key', mock.Mock(), ttl=60)
+        self.assertGreater(os.path.getmtime(path), time.time() - 60)
+
+    def test_turned_off(self):
+        cache.set_shared_store(None)
+        self.assertIsNone(cache.shared_store())
+        build = mock.Mock(return_value={'plot': 1})
+        cache.get('key', build, ttl=60)
+        self.forget_local()
+        cache.get('key', build, ttl=60)
+        self.assertEqual(build.call_count, 2)
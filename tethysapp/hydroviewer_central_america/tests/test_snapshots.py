@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from .. import cache, snapshots
+from ..forecast_cycles import CycleCatalogue
+
+
+class SnapshotsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.snapshots = snapshots.Snapshots(self.directory)
+        # The thread is not needed, save() is called directly
+        self.snapshots._thread = True
+        for name, value in (('_shared', False), ('_snapshots', self.snapshots)):
+            patcher = mock.patch.object(cache, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.restart()
+        self.addCleanup(self.restart)
+
+    def restart(self):
+        with cache._lock:
+            cache._entries.clear()
+
+    def test_restored_after_restart(self):
+        cache.put(('return_periods', '9007781'), {'return_period_2': 10.0}, stored=time.time() - 60)
+        cache.put(('not_snapshotted', '9007781'), 1)
+        self.snapshots.save()
+        self.assertEqual(sorted(os.listdir(self.directory)), ['return_periods.lock', 'return_periods.snap'])
+
+        self.restart()
+        build = mock.Mock(side_effect=ValueError('upstream down'))
+        value, stale_age = cache.get(('return_periods', '9007781'), build, 30)
+        self.assertEqual(value, {'return_period_2': 10.0})
+        self.assertGreaterEqual(stale_age, 60)
+        self.assertIsNone(self.snapshots.lookup(('not_snapshotted', '9007781')))
+
+    def test_workers_are_merged(self):
+        cache.put(('return_periods', '1'), 'first')
+        self.snapshots.save()
+        self.restart()
+        cache.put(('return_periods', '2'), 'second')
+        self.snapshots.save()
+        self.assertEqual(sorted(key[1] for key in self.snapshots.load('return_periods')), ['1', '2'])
+
+    def test_products_of_a_previous_cycle_are_dropped(self):
+        product = ('forecast_stats_plot', '9007781', '100', 2000, None)
+        cache.put(('forecast_cycles', 'central_america', 'geoglows'), CycleCatalogue(['20200101.0']))
+        cache.put(product, {'plot': 'first'})
+        self.snapshots.save()
+
+        self.restart()
+        self.assertEqual(self.snapshots.lookup(product)[0], {'plot': 'first'})
+        cache.put(('forecast_cycles', 'central_america', 'geoglows'), CycleCatalogue(['20200101.0', '20200102.0']))
+        self.assertIsNone(self.snapshots.lookup(product))
+
+    def test_validator_is_recorded_when_built(self):
+        product = ('forecast_probabilities', '9007781', None)
+        cache.put(('forecast_cycles', 'central_america', 'geoglows'), CycleCatalogue(['20200101.0']))
+        cache.get(product, lambda: {'plot': 'first'}, 60)
+        # A newer cycle known before the snapshot is saved does not make the product current
+        cache.put(('forecast_cycles', 'central_america', 'geoglows'), CycleCatalogue(['20200101.0', '20200102.0']))
+        self.snapshots.save()
+
+        self.assertEqual(self.snapshots.load('reach_products')[product][1], ('cycle', 202001010000))
+        self.assertIsNone(self.snapshots.lookup(product))
+
+    def test_products_of_a_changed_file_are_dropped(self):
+        path = os.path.join(self.directory, 'Qout.nc')
+        with open(path, 'w') as f:
+            f.write('first')
+        product = ('compare_source', 'LIS-RAPID', 'central_america', 'geoglows', '9007781')
+        with mock.patch('{0}.qout.qout_path'.format(cache.__package__), return_value=path):
+            cache.put(product, 'flows')
+            self.snapshots.save()
+            self.restart()
+            self.assertEqual(self.snapshots.lookup(product)[0], 'flows')
+            os.utime(path, (time.time() + 10, time.time() + 10))
+            self.assertIsNone(self.snapshots.lookup(product))
@@ -0,0 +1,69 @@
+import unittest
+from unittest import mock
+
+from .. import cache, warning_index
+from ..shapefiles import to_web_mercator
+
+
+def warning(comid, lon, lat, size=1):
+    return {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+            'properties': {'size': size, 'comid': comid}}
+
+
+class WarningIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.features = {
+            2: [warning(1, -90.0, 14.0), warning(2, -90.001, 14.001, size=3), warning(3, -84.0, 10.0)],
+            10: [warning(4, -84.0, 10.0)],
+            20: [],
+        }
+        self.index = warning_index.WarningIndex('20200101.0', self.features)
+
+    def comids(self, features):
+        return sorted(f['properties']['comid'] for f in features)
+
+    def test_viewport(self):
+        west = list(to_web_mercator([[-91.0, 13.0], [-89.0, 15.0]]).reshape(-1))
+        payload = self.index.payload(self.index.cell_range(west), level=12)
+        self.assertFalse(payload['clustered'])
+        self.assertEqual(self.comids(payload['warning2']), [1, 2])
+        self.assertEqual(payload['warning10'], [])
+
+        payload = self.index.payload(self.index.cell_range(), level=None)
+        self.assertEqual(self.comids(payload['warning2']), [1, 2, 3])
+        self.assertEqual(self.comids(payload['warning10']), [4])
+
+        outside = list(to_web_mercator([[-60.0, 0.0], [-59.0, 1.0]]).reshape(-1))
+        self.assertIsNone(self.index.cell_range(outside))
+        self.assertEqual(self.index.payload(None, level=12)['warning2'], [])
+
+    def test_clusters(self):
+        payload = self.index.payload(self.index.cell_range(), level=5)
+        self.assertTrue(payload['clustered'])
+        clusters = [f for f in payload['warning2'] if 'count' in f['properties']]
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual(clusters[0]['properties'], {'count': 2, 'size': 3})
+        self.assertEqual(self.comids(f for f in payload['warning2'] if 'comid' in f['properties']), [3])
+
+    def test_rebuilt_for_new_cycle_or_warnings(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        catalogue = mock.Mock()
+        catalogue.latest.return_value = '20200101.0'
+        state = {}
+        with mock.patch.object(warning_index.forecast_cycles, 'catalogue', return_value=catalogue), \
+                mock.patch.object(warning_index.events, 'watcher_state', return_value=state), \
+                mock.patch.object(warning_index.upstream, 'warning_points',
+                                  side_effect=lambda ws, sb, rp: self.features[rp]) as fetch:
+            first = warning_index.index('central_america', 'geoglows')
+            self.assertIs(warning_index.index('central_america', 'geoglows'), first)
+            catalogue.latest.return_value = '20200101.12'
+            second = warning_index.index('central_america', 'geoglows')
+            self.assertEqual(second.cycle, '20200101.12')
+            self.assertEqual(fetch.call_count, 6)
+
+            state['warnings_event'] = {'central_america--geoglows': 7}
+            third = warning_index.index('central_america', 'geoglows')
+        self.assertEqual(third.version, 7)
+        self.assertEqual(fetch.call_count, 9)
@@ -0,0 +1,196 @@
+"""
+Shared HTTP client for the GEOGLOWS, Streamflow Prediction Tool (SPT) and GeoServer APIs.
+
+Every upstream gets its own requests.Session so connections are pooled and kept alive per host, and every call gets
+connect/read timeouts, a bounded number of retries with exponential backoff, and a latency observation in the
+upstream_request_seconds histogram.
+
+A circuit breaker per upstream stops calls to a host after FAILURE_THRESHOLD consecutive failures: for the next
+OPEN_SECONDS every call fails immediately with CircuitOpenError instead of tying up a worker, after which a single
+trial call decides whether the circuit closes again.
+"""
+import json
+import threading
+import time
+from io import StringIO
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .app import Hydroviewer as app
+from .metrics import histogram, span
+
+GEOGLOWS_ENDPOINT = 'https://geoglows.ecmwf.int/api/'
+SPT_API_PATH = '/apps/streamflow-prediction-tool/api/'
+
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 30
+RETRIES = 2
+BACKOFF_FACTOR = 0.5
+POOL_MAXSIZE = 10
+
+FAILURE_THRESHOLD = 5
+OPEN_SECONDS = 30
+
+# The SPT and GeoServer hosts have historically been called without certificate verification.
+UPSTREAMS = {
+    'geoglows': {'verify': True},
+    'spt': {'verify': False},
+    'geoserver': {'verify': False},
+}
+
+_sessions = {}
+
+
+class CircuitOpenError(requests.ConnectionError):
+    pass
+
+
+class CircuitBreaker(object):
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, open_seconds=OPEN_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Raises CircuitOpenError when the call must not reach the upstream.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.time() - self.opened_at < self.open_seconds or self.trial_running:
+                raise CircuitOpenError('Circuit open for upstream {0}'.format(self.name))
+            # Half open: let this call through as the trial
+            self.trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+            self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if time.time() - self.opened_at >= self.open_seconds else 'open'
+
+
+_breakers = {name: CircuitBreaker(name) for name in UPSTREAMS}
+
+
+def session(upstream):
+    """
+    Returns the pooled session used for an upstream, creating it on first use.
+    """
+    s = _sessions.get(upstream)
+    if s is None:
+        retry = Retry(total=RETRIES, connect=RETRIES, read=RETRIES, status=RETRIES,
+                      backoff_factor=BACKOFF_FACTOR, status_forcelist=(502, 503, 504), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+        s = requests.Session()
+        s.mount('https://', adapter)
+        s.mount('http://', adapter)
+        s = _sessions.setdefault(upstream, s)
+    return s
+
+
+def get(upstream, url, params=None, headers=None, auth=None, stream=False, timeout=None):
+    """
+    GET a url through the pooled session of an upstream ('geoglows', 'spt' or 'geoserver').
+    Raises requests.HTTPError for error status codes and CircuitOpenError while the upstream is considered down.
+    """
+    breaker = _breakers[upstream]
+    breaker.before_call()
+    start = time.time()
+    try:
+        with span(upstream):
+            response = session(upstream).get(url, params=params, headers=headers, auth=auth, stream=stream,
+                                             verify=UPSTREAMS[upstream]['verify'],
+                                             timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT))
+        response.raise_for_status()
+    except requests.HTTPError as e:
+        # Client errors mean a bad request for a reach, not an unhealthy upstream
+        if e.response is not None and e.response.status_code < 500:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+    finally:
+        histogram('upstream_request_seconds', upstream=upstream).observe(time.time() - start)
+    breaker.record_success()
+    return response
+
+
+def breaker_states():
+    return {name: breaker.state for name, breaker in _breakers.items()}
+
+
+def spt_get(method, params, stream=False):
+    """
+    Call a method of the Streamflow Prediction Tool API, e.g. spt_get('GetWarningPoints', {...}).
+    """
+    return get('spt', app.get_custom_setting('api_source') + SPT_API_PATH + method + '/', params=params,
+               headers={'Authorization': 'Token ' + app.get_custom_setting('spt_token')}, stream=stream)
+
+
+def geoserver_get(url, auth=None, params=None):
+    return get('geoserver', url, params=params, auth=auth)
+
+
+def geoglows_get(method, params, stream=False):
+    return get('geoglows', GEOGLOWS_ENDPOINT + method + '/', params=params, stream=stream)
+
+
+def geoglows_frame(method, reach_id, **params):
+    """
+    Returns a GEOGLOWS API csv response as a DataFrame in the same shape geoglows.streamflow returns it.
+    """
+    import pandas as pd
+
+    params.update({'reach_id': reach_id, 'return_format': 'csv'})
+    frame = pd.read_csv(StringIO(geoglows_get(method, params).text), index_col=0)
+    if method != 'ReturnPeriods':
+        frame.index = pd.to_datetime(frame.index)
+    return frame
+
+
+def forecast_stats(reach_id):
+    return geoglows_frame('ForecastStats', reach_id)
+
+
+def forecast_ensembles(reach_id):
+    return geoglows_frame('ForecastEnsembles', reach_id)
+
+
+def historic_simulation(reach_id):
+    return geoglows_frame('HistoricSimulation', reach_id)
+
+
+def return_periods(reach_id):
+    return geoglows_frame('ReturnPeriods', reach_id)
+
+
+def warning_points(watershed, subbasin, return_period):
+    """
+    GeoJSON features of the SPT warning points of a watershed/subbasin for a return period.
+    """
+    res = spt_get('GetWarningPoints', {'watershed_name': watershed, 'subbasin_name': subbasin,
+                                       'return_period': return_period})
+    return json.loads(res.content)['features']
@@ -0,0 +1,44 @@
+"""
+Optional preloading of the heavy dependencies.
+
+controllers.py imports geoglows, plotly, pandas, numpy and netCDF4 only in the controllers that need them, so a
+worker boots without them and the first chart request pays the import. To move that cost out of the first request,
+call preload() from the application server once a worker has started, e.g. in a gunicorn config file:
+
+    def post_fork(server, worker):
+        from tethysapp.hydroviewer_central_america.warmup import preload
+        preload(background=True)
+"""
+import importlib
+import threading
+import time
+
+HEAVY_MODULES = (
+    'numpy',
+    'pandas',
+    'netCDF4',
+    'plotly.graph_objs',
+    'geoglows',
+    'tethysapp.hydroviewer_central_america.qout',
+    'tethysapp.hydroviewer_central_america.exports',
+)
+
+
+def preload(background=False):
+    """
+    Imports HEAVY_MODULES and returns the seconds spent on each. With background=True the imports run in a
+    daemon thread and the function returns immediately.
+    """
+    if background:
+        threading.Thread(target=preload, name='hydroviewer-preload', daemon=True).start()
+        return None
+
+    timings = {}
+    for name in HEAVY_MODULES:
+        start = time.time()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print('Preloading {0} failed: {1}'.format(name, e))
+        timings[name] = time.time() - start
+    return timings
@@ -0,0 +1,151 @@
+"""
+Viewport queries of the ECMWF warning points.
+
+The warning points of a watershed are fetched once per forecast cycle and indexed in a uniform grid of at most
+GRID_CELLS cells a side over their extent (in EPSG:3857), with the points of every return period sorted by cell so
+the points of a range of cells are a few contiguous slices. A query returns the points of the grid cells its bbox
+overlaps; below CLUSTER_ZOOM they are grouped into clusters of CLUSTER_PIXELS pixels, aligned on the world origin
+so a cluster does not move when the map is panned, that carry the number of points they stand for.
+"""
+import math
+import time
+
+import numpy as np
+
+from . import cache, events, forecast_cycles, upstream
+from .shapefiles import resolution, to_web_mercator
+
+RETURN_PERIODS = (2, 10, 20)
+GRID_CELLS = 64
+CLUSTER_ZOOM = 10
+CLUSTER_PIXELS = 40
+INDEX_TTL = 30 * 60
+WORLD_ORIGIN = -20037508.342789244
+
+
+class WarningIndex(object):
+    """
+    The warning points of a watershed for one forecast cycle, per return period, in a grid index.
+    """
+
+    def __init__(self, cycle, features, version=None):
+        """
+        features maps each return period to its list of GeoJSON point features (EPSG:4326); version is the
+        events.warnings_version() they were fetched at.
+        """
+        self.cycle = cycle
+        self.version = version
+        self.built = time.time()
+        self.features = {rp: list(features.get(rp, [])) for rp in RETURN_PERIODS}
+        lonlat = {rp: np.array([f['geometry']['coordinates'][:2] for f in self.features[rp]],
+                               dtype=float).reshape(-1, 2) for rp in RETURN_PERIODS}
+        xy = {rp: to_web_mercator(lonlat[rp]) for rp in RETURN_PERIODS}
+
+        every = np.concatenate([xy[rp] for rp in RETURN_PERIODS])
+        if len(every):
+            self.extent = list(every.min(axis=0)) + list(every.max(axis=0))
+        else:
+            self.extent = [0.0, 0.0, 0.0, 0.0]
+        self.cell_size = max(self.extent[2] - self.extent[0], self.extent[3] - self.extent[1]) / GRID_CELLS or 1.0
+
+        self.points = {}
+        for rp in RETURN_PERIODS:
+            cells = self._cell_ids(xy[rp])
+            order = np.argsort(cells, kind='stable')
+            self.points[rp] = {'cell': cells[order], 'order': order, 'xy': xy[rp], 'lonlat': lonlat[rp]}
+
+    def _cell_ids(self, xy):
+        x = np.clip(((xy[:, 0] - self.extent[0]) // self.cell_size).astype('i8'), 0, GRID_CELLS - 1)
+        y = np.clip(((xy[:, 1] - self.extent[1]) // self.cell_size).astype('i8'), 0, GRID_CELLS - 1)
+        return y * GRID_CELLS + x
+
+    def cell_range(self, bbox=None):
+        """
+        (x0, y0, x1, y1) inclusive range of the grid cells overlapping a (minx, miny, maxx, maxy) EPSG:3857 bbox,
+        the whole grid when bbox is None, None when the bbox misses every point.
+        """
+        extent = self.extent
+        if bbox is None:
+            bbox = extent
+        elif bbox[0] > extent[2] or bbox[2] < extent[0] or bbox[1] > extent[3] or bbox[3] < extent[1]:
+            return None
+        cell = lambda value, origin: min(max(int((value - origin) // self.cell_size), 0), GRID_CELLS - 1)
+        return cell(bbox[0], extent[0]), cell(bbox[1], extent[1]), cell(bbox[2], extent[0]), cell(bbox[3], extent[1])
+
+    def query(self, return_period, cell_range):
+        """
+        Positions, in the feature list of a return period, of the points in a range of grid cells.
+        """
+        if cell_range is None:
+            return np.array([], dtype='i8')
+        points = self.points[return_period]
+        x0, y0, x1, y1 = cell_range
+        rows = np.arange(y0, y1 + 1) * GRID_CELLS
+        starts = np.searchsorted(points['cell'], rows + x0, side='left')
+        ends = np.searchsorted(points['cell'], rows + x1, side='right')
+        found = [points['order'][lo:hi] for lo, hi in zip(starts, ends) if hi > lo]
+        return np.sort(np.concatenate(found)) if found else np.array([], dtype='i8')
+
+    def payload(self, cell_range, level=None):
+        """
+        The warning points of a range of grid cells per return period, as in the full warning points response,
+        clustered for the zoom level below CLUSTER_ZOOM.
+        """
+        clustered = level is not None and level < CLUSTER_ZOOM
+        payload = {'success': 'Data analysis complete!', 'cycle': self.cycle, 'clustered': clustered}
+        for rp in RETURN_PERIODS:
+            positions = self.query(rp, cell_range)
+            if clustered:
+                payload['warning{0}'.format(rp)] = self._clusters(rp, positions, level)
+            else:
+                payload['warning{0}'.format(rp)] = [self.features[rp][i] for i in positions]
+        return payload
+
+    def _clusters(self, return_period, positions, level):
+        points = self.points[return_period]
+        size = resolution(level) * CLUSTER_PIXELS
+        cells = np.floor((points['xy'][positions] - WORLD_ORIGIN) / size).astype('i8')
+        if not len(cells):
+            return []
+        _, group, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+        grouped = positions[np.argsort(group.reshape(-1), kind='stable')]
+
+        features = []
+        for members in np.split(grouped, np.cumsum(counts)[:-1]):
+            if len(members) == 1:
+                features.append(self.features[return_period][members[0]])
+                continue
+            lon, lat = points['lonlat'][members].mean(axis=0)
+            largest = max((self.features[return_period][i].get('properties') or {}).get('size') or 0 for i in members)
+            features.append({'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                             'properties': {'count': int(len(members)), 'size': largest}})
+        return features
+
+
+def zoom_level(zoom):
+    """
+    Integer zoom level of a map zoom, None when there is none.
+    """
+    if zoom is None or not math.isfinite(float(zoom)):
+        return None
+    return max(int(math.floor(float(zoom))), 0)
+
+
+def index(watershed, subbasin):
+    """
+    The WarningIndex of a watershed/subbasin for its latest forecast cycle, rebuilt when a new cycle is out or the
+    events watcher saw its warning points change.
+    """
+    cycle = forecast_cycles.catalogue(watershed, subbasin, events.announced_cycle(watershed, subbasin)).latest()
+    version = events.warnings_version(watershed, subbasin)
+    key = ('warning_index', watershed, subbasin)
+    value, _ = cache.get(key, lambda: _build(watershed, subbasin, cycle, version), INDEX_TTL)
+    if value.cycle != cycle or value.version != version:
+        value = _build(watershed, subbasin, cycle, version)
+        cache.put(key, value)
+    return value
+
+
+def _build(watershed, subbasin, cycle, version=None):
+    return WarningIndex(cycle, {rp: upstream.warning_points(watershed, subbasin, rp) for rp in RETURN_PERIODS},
+                        version)